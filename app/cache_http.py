@@ -0,0 +1,33 @@
+from fastapi import Request, Response
+from typing import Optional
+
+
+def etag_confere(request: Request, etag: str, curinga: bool = True) -> bool:
+    """
+    Verifica se o If-None-Match da requisição contém a ETag atual
+    - curinga=False: "*" não conta (use antes de saber se o recurso existe)
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    for valor in if_none_match.split(","):
+        valor = valor.strip()
+        if valor.startswith("W/"):
+            valor = valor[2:]
+        if valor == etag or (curinga and valor == "*"):
+            return True
+    return False
+
+
+def resposta_condicional(request: Request, response: Response, etag: str, curinga: bool = True) -> Optional[Response]:
+    """
+    Aplica a ETag na resposta e, se o cliente já tem essa versão, retorna um 304
+    - O cliente deve sempre revalidar (no-cache), mas só baixa o corpo quando mudou
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_confere(request, etag, curinga):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
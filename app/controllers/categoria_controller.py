@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from app.schemas import CategoriaIn, CategoriaOut, CategoriaUpdate
 from app.services.categoria_service import (
     create_categoria, get_categorias, get_categoria_by_id,
     update_categoria, delete_categoria
 )
+from app.services import catalogo_cache
+from app.cache_http import resposta_condicional
 
 router = APIRouter()
 
@@ -12,15 +14,23 @@ async def create_categoria_route(cat: CategoriaIn):
     return await create_categoria(cat)
 
 @router.get("/", response_model=list[CategoriaOut])
-async def list_categorias_route():
+async def list_categorias_route(request: Request, response: Response):
+    nao_modificado = resposta_condicional(request, response, catalogo_cache.etag("categorias"))
+    if nao_modificado:
+        return nao_modificado
     return await get_categorias()
 
 @router.get("/{cat_id}", response_model=CategoriaOut)
-async def get_categoria_route(cat_id: str):
+async def get_categoria_route(cat_id: str, request: Request, response: Response):
+    # "*" só responde 304 depois de confirmar que a categoria existe
+    etag = catalogo_cache.etag("categorias")
+    nao_modificado = resposta_condicional(request, response, etag, curinga=False)
+    if nao_modificado:
+        return nao_modificado
     cat = await get_categoria_by_id(cat_id)
     if not cat:
         raise HTTPException(status_code=404, detail="Categoria não encontrada")
-    return cat
+    return resposta_condicional(request, response, etag) or cat
 
 @router.put("/{cat_id}", response_model=CategoriaOut)
 async def update_categoria_route(cat_id: str, cat: CategoriaUpdate):
@@ -1,49 +1,51 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from app.services import imagem_service, imagem_variantes, imagem_upload
+from app.cache_http import etag_confere
 import base64
+import re
 from typing import Optional
 
 router = APIRouter()
 
+# Conteúdo endereçado por hash nunca muda: pode ficar em cache "para sempre"
+CACHE_CONTROL_IMAGENS = "public, max-age=31536000, immutable"
+# Original servido no lugar de uma variante que não pôde ser gerada: cache curto
+CACHE_CONTROL_IMAGEM_SUBSTITUTA = "public, max-age=300"
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
 class ImageUploadRequest(BaseModel):
     image_base64: str
     filename: Optional[str] = None
 
 class ImageUploadResponse(BaseModel):
     success: bool
-    image_data: str
+    image_data: str  # URL da imagem armazenada (/images/<hash>)
     message: str
+    hash: Optional[str] = None
 
 @router.post("/upload-image", response_model=ImageUploadResponse)
 async def upload_image(request: ImageUploadRequest):
     """
-    Converte e valida imagem base64 para ser salva no banco de dados
+    Valida a imagem base64 e salva no armazenamento de imagens (GridFS)
+
+    - Cada imagem é guardada uma única vez, identificada pelo SHA-256 do conteúdo
+    - Retorna a URL /images/<hash>, que deve ser usada no campo 'imagem' do produto
     """
     try:
-        # Remove o prefixo data:image/...;base64, se existir
-        if request.image_base64.startswith("data:image"):
-            # Extrai apenas a parte base64
-            image_data = request.image_base64.split(",")[1]
-        else:
-            image_data = request.image_base64
-        
-        # Valida se é base64 válido
         try:
-            decoded = base64.b64decode(image_data)
-            # Testa se consegue decodificar (validação básica)
-            if len(decoded) == 0:
-                raise HTTPException(status_code=400, detail="Imagem base64 inválida")
-        except Exception:
-            raise HTTPException(status_code=400, detail="Formato base64 inválido")
+            decoded, content_type = imagem_service.decodificar_imagem(request.image_base64)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Verifica tamanho da imagem (máximo 5MB)
-        if len(decoded) > 5 * 1024 * 1024:  # 5MB
-            raise HTTPException(status_code=400, detail="Imagem muito grande. Máximo 5MB")
+        hash_imagem = await imagem_service.salvar_imagem(decoded, content_type)
         
         return ImageUploadResponse(
             success=True,
-            image_data=request.image_base64,
-            message="Imagem processada com sucesso"
+            image_data=imagem_service.url_imagem(hash_imagem),
+            message="Imagem processada com sucesso",
+            hash=hash_imagem
         )
         
     except HTTPException:
@@ -51,6 +53,50 @@ async def upload_image(request: ImageUploadRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
 
+@router.post("/upload", response_model=ImageUploadResponse)
+async def upload_image_multipart(request: Request):
+    """
+    Envia uma imagem via multipart/form-data (campo "file")
+
+    - O corpo é lido em pedaços: uploads acima do limite (5MB) são abortados na hora (413)
+    - O formato é identificado pelos primeiros bytes (PNG, JPEG, GIF ou WebP)
+    - Retorna a URL /images/<hash>, como o /upload-image
+    """
+    try:
+        boundary = imagem_upload.extrair_boundary(request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    # Content-Length já acima do limite (com folga para o envelope multipart): nem lê o corpo
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > imagem_service.TAMANHO_MAXIMO_IMAGEM + 64 * 1024:
+        raise HTTPException(status_code=413, detail=imagem_service.mensagem_tamanho_maximo())
+
+    upload = imagem_upload.UploadImagemStream(boundary)
+    try:
+        async for pedaco in request.stream():
+            upload.escrever(pedaco)
+        dados, content_type = upload.finalizar()
+        await imagem_upload.verificar_imagem(dados)
+    except imagem_upload.ImagemMuitoGrande as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except imagem_upload.FormatoNaoSuportado as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        hash_imagem = await imagem_service.salvar_imagem(dados, content_type)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao processar imagem: {str(e)}")
+
+    return ImageUploadResponse(
+        success=True,
+        image_data=imagem_service.url_imagem(hash_imagem),
+        message="Imagem processada com sucesso",
+        hash=hash_imagem
+    )
+
 @router.post("/validate-image")
 async def validate_image(request: ImageUploadRequest):
     """
@@ -72,8 +118,8 @@ async def validate_image(request: ImageUploadRequest):
             raise HTTPException(status_code=400, detail="Formato base64 inválido")
         
         # Verifica tamanho
-        if len(decoded) > 5 * 1024 * 1024:  # 5MB
-            raise HTTPException(status_code=400, detail="Imagem muito grande. Máximo 5MB")
+        if len(decoded) > imagem_service.TAMANHO_MAXIMO_IMAGEM:
+            raise HTTPException(status_code=400, detail=imagem_service.mensagem_tamanho_maximo())
         
         return {"success": True, "message": "Imagem válida", "size_bytes": len(decoded)}
         
@@ -82,3 +128,92 @@ async def validate_image(request: ImageUploadRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao validar imagem: {str(e)}")
 
+
+def _parse_range(range_header: str, tamanho: int) -> Optional[tuple[int, int]]:
+    """Interpreta um header Range de intervalo único; retorna (inicio, fim) inclusivos"""
+    match = _RANGE_RE.match(range_header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+
+    if match.group(1):
+        inicio = int(match.group(1))
+        fim = int(match.group(2)) if match.group(2) else tamanho - 1
+    else:
+        # bytes=-N: últimos N bytes
+        inicio = max(tamanho - int(match.group(2)), 0)
+        fim = tamanho - 1
+
+    fim = min(fim, tamanho - 1)
+    if inicio > fim:
+        return None
+    return inicio, fim
+
+
+@router.get("/{hash_imagem}")
+async def obter_imagem(
+    hash_imagem: str,
+    request: Request,
+    variante: Optional[str] = Query(None, description="thumb, card ou full (WebP); omita para o original")
+):
+    """
+    Serve uma imagem armazenada pelo hash do conteúdo
+
+    - variante: versão redimensionada em WebP (thumb 160px, card 480px, full 1600px)
+    - Leitura em streaming direto do GridFS
+    - ETag = hash (+ variante); If-None-Match retorna 304
+    - Variante que não pôde ser gerada: serve o original, com o ETag do original e cache curto
+    - Suporta Range (bytes=inicio-fim) com resposta 206
+    """
+    if not imagem_service.eh_hash(hash_imagem):
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    if variante is not None and variante not in imagem_variantes.VARIANTES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Variante inválida. Use uma de: {', '.join(imagem_variantes.VARIANTES)}"
+        )
+
+    etag = f'"{imagem_service.nome_arquivo(hash_imagem, variante)}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CACHE_CONTROL_IMAGENS,
+        "Accept-Ranges": "bytes",
+    }
+
+    if etag_confere(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    arquivo, substituta = await imagem_service.abrir_imagem(hash_imagem, variante)
+    if arquivo is None:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    if substituta:
+        # Bytes do original: ETag do original e sem cache imutável
+        headers["ETag"] = f'"{hash_imagem}"'
+        headers["Cache-Control"] = CACHE_CONTROL_IMAGEM_SUBSTITUTA
+        if etag_confere(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    tamanho = arquivo.length
+    content_type = (arquivo.metadata or {}).get("contentType", "application/octet-stream")
+
+    inicio, fim = 0, tamanho - 1
+    status_code = 200
+    range_header = request.headers.get("range")
+    if range_header and tamanho > 0:
+        intervalo = _parse_range(range_header, tamanho)
+        if intervalo is None:
+            raise HTTPException(
+                status_code=416,
+                detail="Intervalo inválido",
+                headers={"Content-Range": f"bytes */{tamanho}"}
+            )
+        inicio, fim = intervalo
+        status_code = 206
+        headers["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+
+    headers["Content-Length"] = str(max(fim - inicio + 1, 0))
+    return StreamingResponse(
+        imagem_service.ler_intervalo(arquivo, inicio, fim),
+        status_code=status_code,
+        media_type=content_type,
+        headers=headers
+    )
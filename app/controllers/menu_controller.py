@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Request, Response
+from app.schemas import MenuOut
+from app.services import menu_service, catalogo_cache
+from app.cache_http import resposta_condicional
+
+router = APIRouter()
+
+@router.get("/", response_model=MenuOut)
+@router.get("", response_model=MenuOut)
+async def obter_menu_route(request: Request, response: Response):
+    """
+    Retorna o cardápio completo em uma chamada
+
+    - Categorias com seus produtos ativos (id, título, preço e imagem)
+    - Categorias sem produtos ativos não aparecem
+    - Envia ETag; com If-None-Match igual retorna 304
+    """
+    nao_modificado = resposta_condicional(request, response, catalogo_cache.etag("categorias", "produtos"))
+    if nao_modificado:
+        return nao_modificado
+    return await menu_service.obter_menu()
@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+from app import metrics
+
+router = APIRouter()
+
+@router.get("/", response_model=dict)
+async def obter_metricas_route():
+    """
+    Retorna as métricas internas deste processo (contadores, medidores e latências)
+
+    - checkout.produtos.consultas / checkout.produtos.carregamentos: consultas ao Mongo por checkout (máximo 2)
+    - catalogo_cache.hits / catalogo_cache.misses / catalogo_cache.invalidacoes: cache do catálogo
+    - medidores.indices.falhas: índices declarados que não puderam ser criados no startup
+    - webhooks_pix.recebidos / .duplicados / .aplicados / .falhas / .mortos: fila de webhooks PIX
+    - medidores.webhooks_pix.fila: webhooks pendentes
+    - latencias.webhooks_pix.latencia_aplicacao_ms: do recebimento à aplicação (p50/p95/p99)
+    - pix.expirados / latencias.pix.expiracao.duracao_ms: varredura de PIX vencidos
+    - eventos.publicados / eventos.entregues / eventos.descartados: feed de pedidos em tempo real
+    - loaders.<nome>.consultas / loaders.<nome>.memoizados: leituras em lote e reaproveitadas dentro da requisição
+    - latencias.gateway.autorizar.latencia_ms / .tentativa_ms: latência do gateway de cartão (p50/p95/p99)
+    - gateway.autorizar.falhas / .retentativas, gateway.circuito.rejeitadas / .aberturas, medidores.gateway.circuito.aberto: saúde do gateway
+    - pagamentos.cartao.indeterminados / .resolvidos: cobranças de cartão sem resposta e resolvidas depois pela consulta ao gateway
+    - reconciliacao.pedidos / .divergencias, medidores.reconciliacao.docs_por_segundo: reconciliação pagamentos x pedidos
+    """
+    return metrics.snapshot()
@@ -3,7 +3,7 @@ from app.schemas import (
     PagamentoPixIn, PagamentoPixOut, PagamentoCartaoIn, PagamentoCartaoOut,
     PagamentoWebhookIn, PagamentoOut
 )
-from app.services import pagamento_service
+from app.services import pagamento_service, webhook_service, gateway_pagamento
 from app.dependencies_jwt import get_current_user_id_from_token
 from typing import Optional
 
@@ -35,24 +35,29 @@ async def criar_pagamento_pix(
             detail=f"Erro interno do servidor: {str(e)}"
         )
 
-@router.post("/pix/webhook")
+@router.post("/pix/webhook", status_code=status.HTTP_202_ACCEPTED)
 async def webhook_pagamento_pix(webhook_data: PagamentoWebhookIn):
     """
     Webhook para receber notificações de pagamento PIX
     
     - Endpoint público (não requer autenticação)
     - Recebe status: "pago" ou "expirado"
-    - Atualiza automaticamente o status do pedido quando pago
+    - Só grava a notificação e responde 202; a aplicação é feita em segundo plano
+    - Repetições do mesmo evento (eventoId, ou pedidoId + pagamentoId + status) são ignoradas
+    - Sem pagamentoId, vale para o PIX mais recente do pedido
+    - Quando pago, o pedido passa para em_preparacao
     """
     try:
-        sucesso = await pagamento_service.processar_webhook_pix(webhook_data)
-        if not sucesso:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Pagamento não encontrado"
-            )
-        
-        return {"message": f"Webhook processado com sucesso. Status: {webhook_data.status}"}
+        novo = await webhook_service.enfileirar(webhook_data)
+        return {
+            "message": "Webhook recebido" if novo else "Webhook já recebido anteriormente",
+            "duplicado": not novo
+        }
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -65,14 +70,22 @@ async def criar_pagamento_cartao(
     usuario_id: str = Depends(get_current_user_id_from_token)
 ):
     """
-    Cria um pagamento via cartão (simulado)
+    Cria um pagamento via cartão
     
-    - Simula autorização do cartão (90% de aprovação)
+    - Autoriza no gateway configurado (GATEWAY_BACKEND; o padrão é simulado, 90% de aprovação)
     - Retorna status: "pago" se aprovado, "expirado" se negado
     - Atualiza automaticamente o status do pedido quando aprovado
+    - 400 se o pedido já estiver pago
+    - 503 se o gateway não responder a tempo ou o disjuntor estiver aberto; o pagamento
+      fica pendente e uma nova chamada com o mesmo cartão reusa a chave (sem cobrança dupla)
     """
     try:
         return await pagamento_service.criar_pagamento_cartao(pagamento_data, usuario_id)
+    except gateway_pagamento.GatewayIndisponivel as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
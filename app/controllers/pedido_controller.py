@@ -1,18 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, status, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from app.schemas import (
     PedidoCheckoutIn, PedidoCheckoutOut, PedidoDetalhadoOut,
-    PaginacaoPedidosOut, StatusPedido, AtualizarStatusIn
+    PaginacaoPedidosOut, StatusPedido, AtualizarStatusIn, UsuarioOut,
+    AtualizarStatusLoteIn, AtualizarStatusLoteOut
 )
-from app.services import pedido_service
+from app.services import pedido_service, reconciliacao_service
+from app import eventos
+from app.projecoes import montar_projecao
 from app.dependencies_jwt import (
+    get_current_user_from_token,
     get_current_user_id_from_token,
     verify_admin_user,
     verify_funcionario_user,
 )
 from typing import Optional
+import asyncio
+import json
 
 router = APIRouter()
 
+# Comentário enviado na conexão SSE sem eventos, para manter proxies abertos
+# e perceber clientes que desconectaram
+INTERVALO_HEARTBEAT = 15
+
+
+def _projecao_pedido(view: Optional[str]) -> Optional[dict]:
+    try:
+        return montar_projecao(view, None, pedido_service.VISOES_PEDIDO, ())
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
+def _definir_headers_paginacao(response: Response, resultado: dict) -> None:
+    """As listagens da equipe devolvem uma lista; os cursores vão nos headers"""
+    if resultado["proximoCursor"]:
+        response.headers["X-Proximo-Cursor"] = resultado["proximoCursor"]
+    if resultado["cursorAnterior"]:
+        response.headers["X-Cursor-Anterior"] = resultado["cursorAnterior"]
+    response.headers["X-Total-Estimado"] = str(resultado["totalEstimado"])
+
 
 @router.post("/", response_model=PedidoCheckoutOut)
 @router.post("", response_model=PedidoCheckoutOut)
@@ -52,16 +83,87 @@ async def criar_pedido(
 
 @router.get("/admin", response_model=list[dict])
 async def listar_todos_pedidos_admin(
+    response: Response,
     admin_user = Depends(verify_admin_user),
-    page: int = Query(1, ge=1, description="Número da página"),
-    page_size: int = Query(10, ge=1, le=100, description="Tamanho da página")
+    cursor: Optional[str] = Query(None, description="Cursor opaco vindo de X-Proximo-Cursor ou X-Cursor-Anterior"),
+    page: int = Query(1, ge=1, description="Número da página (deprecated: use cursor)", deprecated=True),
+    page_size: int = Query(10, ge=1, le=100, description="Tamanho da página"),
+    view: Optional[str] = Query(None, description="Visão: summary (sem imagens) ou full (padrão)")
 ):
     """
     Lista todos os pedidos do sistema (apenas para administradores)
+
+    - Mais recentes primeiro, paginação por cursor (custo igual em qualquer página)
+    - Headers: X-Proximo-Cursor, X-Cursor-Anterior e X-Total-Estimado
+    """
+    projecao = _projecao_pedido(view)
+    try:
+        resultado = await pedido_service.listar_todos_pedidos_admin(page, page_size, projecao, cursor)
+        _definir_headers_paginacao(response, resultado)
+        return resultado["pedidos"]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro interno do servidor: {str(e)}"
+        )
+
+
+@router.post("/admin/migrar-imagens", status_code=status.HTTP_202_ACCEPTED)
+async def migrar_imagens_pedidos(
+    background_tasks: BackgroundTasks,
+    admin_user = Depends(verify_admin_user)
+):
+    """
+    Remove as cópias de imagens base64 dos itens dos pedidos antigos (em segundo plano)
+
+    - Cada item passa a guardar só a referência da imagem (hash)
+    - Progresso na métrica pedidos.imagens_migradas (GET /metricas)
+    - Só uma migração roda por vez; uma segunda chamada durante a execução não faz nada
+    """
+    background_tasks.add_task(pedido_service.migrar_imagens_pedidos)
+    return {"message": "Migração das imagens dos pedidos iniciada"}
+
+
+@router.post("/admin/reconciliar-pagamentos", status_code=status.HTTP_202_ACCEPTED)
+async def reconciliar_pagamentos(
+    background_tasks: BackgroundTasks,
+    admin_user = Depends(verify_admin_user),
+    reiniciar: bool = Query(False, description="Ignora o checkpoint e confere todos os pedidos")
+):
+    """
+    Confere pedidos x pagamentos novos e alterados desde a última execução (em segundo plano)
+
+    - Divergências: sem_pagamento_confirmado e valor_divergente (GET /pedidos/admin/divergencias-pagamento)
+    - Vazão na métrica reconciliacao.docs_por_segundo (GET /metricas)
+    """
+    async def executar():
+        if reiniciar:
+            await reconciliacao_service.reiniciar_checkpoint()
+        await reconciliacao_service.reconciliar_pagamentos()
+
+    background_tasks.add_task(executar)
+    return {"message": "Reconciliação de pagamentos iniciada"}
+
+
+@router.get("/admin/divergencias-pagamento", response_model=list[dict])
+async def listar_divergencias_pagamento(
+    admin_user = Depends(verify_admin_user),
+    tipo: Optional[str] = Query(None, pattern="^(sem_pagamento_confirmado|valor_divergente)$"),
+    limite: int = Query(100, ge=1, le=1000),
+    resolvidas: bool = Query(False, description="Lista as que deixaram de valer em vez das em aberto")
+):
+    """
+    Lista as divergências encontradas pela reconciliação (pedidoId mais alto primeiro)
+
+    - Por padrão só as em aberto; a divergência corrigida depois fica com resolvida=True
     """
     try:
-        pedidos = await pedido_service.listar_todos_pedidos_admin(page, page_size)
-        return pedidos
+        return jsonable_encoder(await reconciliacao_service.listar_divergencias(tipo, limite, resolvidas))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -71,16 +173,29 @@ async def listar_todos_pedidos_admin(
 
 @router.get("/funcionario", response_model=list[dict])
 async def listar_todos_pedidos_funcionario(
+    response: Response,
     funcionario_user = Depends(verify_funcionario_user),
-    page: int = Query(1, ge=1, description="Número da página"),
-    page_size: int = Query(10, ge=1, le=100, description="Tamanho da página")
+    cursor: Optional[str] = Query(None, description="Cursor opaco vindo de X-Proximo-Cursor ou X-Cursor-Anterior"),
+    page: int = Query(1, ge=1, description="Número da página (deprecated: use cursor)", deprecated=True),
+    page_size: int = Query(10, ge=1, le=100, description="Tamanho da página"),
+    view: Optional[str] = Query(None, description="Visão: summary (sem imagens) ou full (padrão)")
 ):
     """
     Lista todos os pedidos do sistema (para funcionários e administradores)
+
+    - Mais recentes primeiro, paginação por cursor (custo igual em qualquer página)
+    - Headers: X-Proximo-Cursor, X-Cursor-Anterior e X-Total-Estimado
     """
+    projecao = _projecao_pedido(view)
     try:
-        pedidos = await pedido_service.listar_todos_pedidos_admin(page, page_size)
-        return pedidos
+        resultado = await pedido_service.listar_todos_pedidos_admin(page, page_size, projecao, cursor)
+        _definir_headers_paginacao(response, resultado)
+        return resultado["pedidos"]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -105,10 +220,45 @@ async def obter_contadores_pedidos_funcionario(
         )
 
 
+def _formatar_sse(tipo: str, dados) -> str:
+    return f"event: {tipo}\ndata: {json.dumps(jsonable_encoder(dados))}\n\n"
+
+
+@router.get("/eventos")
+async def eventos_pedidos(
+    request: Request,
+    funcionario_user = Depends(verify_funcionario_user)
+):
+    """
+    Feed de pedidos em tempo real (Server-Sent Events) para cozinha e equipe
+
+    - Primeiro evento: 'contadores' com os contadores atuais por status
+    - Depois: pedido.criado, pedido.status_alterado, pagamento.criado e pagamento.atualizado
+    - Substitui o polling de /pedidos/funcionario e /pedidos/funcionario/contadores
+    - Autenticação pelo header Authorization (use fetch com streaming, não EventSource)
+    """
+    async def gerar():
+        async with eventos.assinar() as fila:
+            yield _formatar_sse("contadores", await pedido_service.obter_contadores_pedidos())
+            while not await request.is_disconnected():
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=INTERVALO_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield _formatar_sse(evento["tipo"], {**evento["dados"], "em": evento["em"]})
+
+    return StreamingResponse(
+        gerar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/{pedido_id}", response_model=PedidoDetalhadoOut)
 async def obter_pedido(
     pedido_id: int,
-    usuario_id: str = Depends(get_current_user_id_from_token)
+    usuario: UsuarioOut = Depends(get_current_user_from_token)
 ):
     """
     Obtém um pedido específico
@@ -117,13 +267,15 @@ async def obter_pedido(
     - Retorna todos os detalhes: itens, endereço, pagamento, totais
     """
     try:
-        pedido = await pedido_service.obter_pedido_por_id(pedido_id, usuario_id)
+        pedido = await pedido_service.obter_pedido_por_id(pedido_id, usuario)
         if not pedido:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Pedido não encontrado"
             )
         return pedido
+    except HTTPException:
+        raise
     except PermissionError as e:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -139,20 +291,64 @@ async def obter_pedido(
 @router.get("/", response_model=PaginacaoPedidosOut)
 @router.get("", response_model=PaginacaoPedidosOut)
 async def listar_pedidos_usuario(
-    page: int = Query(1, ge=1, description="Número da página"),
+    cursor: Optional[str] = Query(None, description="Cursor opaco (proximoCursor ou cursorAnterior)"),
+    page: int = Query(1, ge=1, description="Número da página (deprecated: use cursor)", deprecated=True),
     page_size: int = Query(10, ge=1, le=50, description="Itens por página"),
+    com_total: Optional[bool] = Query(None, description="Inclui total/totalPages (padrão: só na primeira página)"),
+    view: Optional[str] = Query(None, description="Visão: summary (sem imagens) ou full (padrão)"),
     usuario_id: str = Depends(get_current_user_id_from_token)
 ):
     """
     Lista pedidos do usuário autenticado
 
     - Retorna pedidos ordenados por data de criação (mais recentes primeiro)
-    - Suporte a paginação
+    - Paginação por cursor: envie proximoCursor/cursorAnterior da resposta anterior
     - Cada pedido inclui itens e informações básicas
     """
+    projecao = _projecao_pedido(view)
     try:
-        resultado = await pedido_service.listar_pedidos_usuario(usuario_id, page, page_size)
+        resultado = await pedido_service.listar_pedidos_usuario(
+            usuario_id, page, page_size, projecao, cursor, com_total
+        )
         return PaginacaoPedidosOut(**resultado)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro interno do servidor: {str(e)}"
+        )
+
+
+@router.patch("/status", response_model=AtualizarStatusLoteOut)
+async def atualizar_status_pedidos_lote(
+    payload: AtualizarStatusLoteIn,
+    funcionario_user = Depends(verify_funcionario_user)
+):
+    """
+    Atualiza o status de vários pedidos em uma única requisição (até 100)
+
+    - Body: {"pedidos": [{"pedidoId": 1, "status": "saiu_para_entrega"}, ...]}
+    - Transições aceitas: pendente -> em_preparacao -> saiu_para_entrega -> concluido
+      (em_preparacao -> concluido para retirada)
+    - Resultado por pedido: atualizado, inalterado, nao_encontrado, transicao_invalida ou conflito
+    """
+    try:
+        resultados = await pedido_service.atualizar_status_pedidos_lote(
+            [(item.pedidoId, item.status) for item in payload.pedidos]
+        )
+        return AtualizarStatusLoteOut(
+            atualizados=sum(1 for r in resultados if r["resultado"] == "atualizado"),
+            resultados=resultados
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
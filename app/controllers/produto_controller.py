@@ -1,27 +1,94 @@
-from fastapi import APIRouter, HTTPException
-from app.schemas import ProdutoIn, ProdutoOut, ProdutoUpdate
-from app.services import produto_service
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from app.schemas import ProdutoIn, ProdutoOut, ProdutoUpdate, ProdutoResumoOut, PaginaProdutosOut, ResultadoBuscaOut
+from app.services import produto_service, catalogo_cache, busca_service
+from app.cache_http import resposta_condicional
+from app.projecoes import montar_projecao
+from typing import Optional, Union
 
 router = APIRouter()
 
 @router.post("/", response_model=ProdutoOut)
 async def create_product_route(prod: ProdutoIn):
-    return await produto_service.create_product(prod)
+    try:
+        return await produto_service.create_product(prod)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _projecao_produto(view: Optional[str], fields: Optional[str]) -> Optional[dict]:
+    try:
+        return montar_projecao(view, fields, produto_service.VISOES_PRODUTO, produto_service.CAMPOS_PRODUTO)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/", response_model=PaginaProdutosOut, response_model_exclude_unset=True)
+async def list_products_route(
+    request: Request,
+    response: Response,
+    categoria_id: Optional[str] = Query(None, description="Filtra por categoria"),
+    ativo: Optional[bool] = Query(None, description="Filtra por produtos ativos/inativos"),
+    cursor: Optional[str] = Query(None, description="Valor de proximoCursor da página anterior"),
+    page_size: int = Query(50, ge=1, le=produto_service.PRODUTOS_PAGE_SIZE_MAX, description="Itens por página"),
+    view: Optional[str] = Query(None, description="Visão: summary ou full (padrão)"),
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula, ex.: titulo,preco")
+):
+    """
+    Lista produtos com paginação por cursor (keyset em _id)
 
-@router.get("/", response_model=list[ProdutoOut])
-async def list_products_route():
-    return await produto_service.get_products()
+    - Use proximoCursor da resposta para buscar a próxima página
+    - proximoCursor vem nulo na última página
+    - view/fields limitam os campos lidos do banco e devolvidos
+    - Envia ETag; com If-None-Match igual retorna 304 sem consultar o banco
+    """
+    nao_modificado = resposta_condicional(request, response, catalogo_cache.etag("produtos"))
+    if nao_modificado:
+        return nao_modificado
+
+    projecao = _projecao_produto(view, fields)
+    try:
+        return await produto_service.get_products(categoria_id, ativo, cursor, page_size, projecao)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/busca", response_model=ResultadoBuscaOut)
+async def buscar_produtos_route(
+    q: str = Query(..., min_length=1, description="Texto da busca (sem diferenciar acentos)"),
+    page: int = Query(1, ge=1, description="Número da página"),
+    page_size: int = Query(20, ge=1, le=produto_service.PRODUTOS_PAGE_SIZE_MAX, description="Itens por página")
+):
+    """
+    Busca produtos ativos por título e descrição
 
-@router.get("/{prod_id}", response_model=ProdutoOut)
-async def get_product_route(prod_id: str):
-    prod = await produto_service.get_product_by_id(prod_id)
+    - Ignora acentos e maiúsculas: "pao" encontra "Pão"
+    - As palavras também casam por prefixo, para busca enquanto digita ("queij" encontra "queijo")
+    - Resultados ordenados por relevância (título pesa mais que descrição)
+    """
+    return busca_service.buscar(q, page, page_size)
+
+@router.get("/{prod_id}", response_model=Union[ProdutoOut, ProdutoResumoOut], response_model_exclude_unset=True)
+async def get_product_route(
+    request: Request,
+    response: Response,
+    prod_id: str,
+    view: Optional[str] = Query(None, description="Visão: summary ou full (padrão)"),
+    fields: Optional[str] = Query(None, description="Campos separados por vírgula, ex.: titulo,preco")
+):
+    # Só a ETag citada explicitamente evita a busca; "*" exige que o produto exista
+    etag = catalogo_cache.etag("produtos")
+    nao_modificado = resposta_condicional(request, response, etag, curinga=False)
+    if nao_modificado:
+        return nao_modificado
+
+    prod = await produto_service.get_product_by_id(prod_id, _projecao_produto(view, fields))
     if not prod:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
-    return prod
+    return resposta_condicional(request, response, etag) or prod
 
 @router.put("/{prod_id}", response_model=ProdutoOut)
 async def update_product_route(prod_id: str, prod: ProdutoUpdate):
-    updated = await produto_service.update_product(prod_id, prod)
+    try:
+        updated = await produto_service.update_product(prod_id, prod)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not updated:
         raise HTTPException(status_code=404, detail="Produto não encontrado")
     return updated
@@ -84,3 +151,14 @@ async def migrar_produtos_route():
         "message": f"Migração concluída! {produtos_migrados} produtos foram atualizados.",
         "produtos_migrados": produtos_migrados
     }
+
+@router.post("/migrar-imagens")
+async def migrar_imagens_produtos_route():
+    """
+    Move as imagens base64 dos produtos para o armazenamento de imagens (/images/<hash>)
+    """
+    produtos_migrados = await produto_service.migrar_imagens_produtos()
+    return {
+        "message": f"Migração concluída! {produtos_migrados} imagens foram movidas.",
+        "produtos_migrados": produtos_migrados
+    }
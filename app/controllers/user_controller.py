@@ -6,6 +6,8 @@ from app.services.user_service import (
 )
 from app.services import pedido_service
 from app.dependencies_jwt import get_current_user_id_from_token
+from app.projecoes import montar_projecao
+from typing import Optional
 # from app.dependencies import get_current_user_from_cookie
 
 router = APIRouter()
@@ -42,8 +44,11 @@ async def delete_user_route(user_id: str):
 
 @router.get("/me/pedidos", response_model=PaginacaoPedidosOut)
 async def listar_meus_pedidos(
-    page: int = Query(1, ge=1, description="Número da página"),
+    cursor: Optional[str] = Query(None, description="Cursor opaco (proximoCursor ou cursorAnterior)"),
+    page: int = Query(1, ge=1, description="Número da página (deprecated: use cursor)", deprecated=True),
     page_size: int = Query(10, ge=1, le=50, description="Itens por página"),
+    com_total: Optional[bool] = Query(None, description="Inclui total/totalPages (padrão: só na primeira página)"),
+    view: Optional[str] = Query(None, description="Visão: summary (sem imagens) ou full (padrão)"),
     usuario_id: str = Depends(get_current_user_id_from_token)
 ):
     """
@@ -51,13 +56,18 @@ async def listar_meus_pedidos(
     
     - Endpoint específico para /usuarios/me/pedidos
     - Retorna pedidos ordenados por data de criação (mais recentes primeiro)
-    - Suporte a paginação
+    - Paginação por cursor: envie proximoCursor/cursorAnterior da resposta anterior
     """
     try:
-        resultado = await pedido_service.listar_pedidos_usuario(usuario_id, page, page_size)
-        return PaginacaoPedidosOut(**resultado)
+        projecao = montar_projecao(view, None, pedido_service.VISOES_PEDIDO, ())
+        resultado = await pedido_service.listar_pedidos_usuario(
+            usuario_id, page, page_size, projecao, cursor, com_total
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Erro interno do servidor: {str(e)}"
         )
+    return PaginacaoPedidosOut(**resultado)
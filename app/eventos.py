@@ -0,0 +1,165 @@
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from app import metrics
+import app.database as database
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Pub/sub de eventos de pedidos para as telas da cozinha e da equipe.
+# Os services publicam (pedido criado, status alterado, pagamento atualizado);
+# cada conexão SSE assina uma fila em memória. O backend decide como o evento
+# chega a todos os workers:
+# - local: entrega direto no próprio processo (um worker / desenvolvimento)
+# - mongo: grava em uma capped collection e cada worker lê com cursor tailable
+EVENTOS_BACKEND = os.getenv("EVENTOS_BACKEND", "local")
+EVENTOS_COLECAO = "eventos_pedidos"
+EVENTOS_CAPPED_BYTES = int(os.getenv("EVENTOS_CAPPED_BYTES", str(4 * 1024 * 1024)))
+# Conexão lenta não segura as outras: acima disso, os eventos mais antigos da fila dela são descartados
+EVENTOS_FILA_MAX = int(os.getenv("EVENTOS_FILA_MAX", "100"))
+
+PEDIDO_CRIADO = "pedido.criado"
+PEDIDO_STATUS_ALTERADO = "pedido.status_alterado"
+PAGAMENTO_CRIADO = "pagamento.criado"
+PAGAMENTO_ATUALIZADO = "pagamento.atualizado"
+
+
+class BackendEventos(ABC):
+    """Transporte dos eventos entre os workers"""
+
+    @abstractmethod
+    async def iniciar(self, entregar: Callable[[dict], None]) -> None:
+        """Começa a receber eventos; 'entregar' distribui para as conexões deste worker"""
+
+    @abstractmethod
+    async def publicar(self, evento: dict) -> None:
+        ...
+
+    async def parar(self) -> None:
+        pass
+
+
+class BackendLocal(BackendEventos):
+    """Entrega no próprio processo; também serve de substituto nos testes"""
+
+    def __init__(self):
+        self._entregar: Optional[Callable[[dict], None]] = None
+
+    async def iniciar(self, entregar: Callable[[dict], None]) -> None:
+        self._entregar = entregar
+
+    async def publicar(self, evento: dict) -> None:
+        if self._entregar is not None:
+            self._entregar(evento)
+
+
+class BackendMongo(BackendEventos):
+    """Capped collection + cursor tailable: todo worker recebe todo evento, inclusive os próprios"""
+
+    def __init__(self, colecao: str = EVENTOS_COLECAO, tamanho: int = EVENTOS_CAPPED_BYTES):
+        self.colecao = colecao
+        self.tamanho = tamanho
+        self._tarefa: Optional[asyncio.Task] = None
+
+    async def iniciar(self, entregar: Callable[[dict], None]) -> None:
+        try:
+            await database.db.create_collection(self.colecao, capped=True, size=self.tamanho)
+        except CollectionInvalid:
+            pass  # já existe
+        self._tarefa = asyncio.create_task(self._acompanhar(entregar), name="eventos_mongo")
+
+    async def _acompanhar(self, entregar: Callable[[dict], None]) -> None:
+        colecao = database.db[self.colecao]
+        ultimo = await colecao.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+        ultimo_id = ultimo["_id"] if ultimo else None
+
+        while True:
+            filtro = {"_id": {"$gt": ultimo_id}} if ultimo_id is not None else {}
+            cursor = colecao.find(filtro, {"_id": 1, "tipo": 1, "dados": 1, "em": 1},
+                                  cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        ultimo_id = doc.pop("_id")
+                        entregar(doc)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Erro lendo eventos da capped collection")
+            # Cursor morto (coleção vazia ou erro): tenta de novo em seguida
+            await asyncio.sleep(1)
+
+    async def publicar(self, evento: dict) -> None:
+        await database.db[self.colecao].insert_one(dict(evento))
+
+    async def parar(self) -> None:
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            await asyncio.gather(self._tarefa, return_exceptions=True)
+            self._tarefa = None
+
+
+BACKENDS = {
+    "local": BackendLocal,
+    "mongo": BackendMongo,
+}
+
+_backend: BackendEventos = BackendLocal()
+_assinantes: set[asyncio.Queue] = set()
+
+
+def _entregar(evento: dict) -> None:
+    """Coloca o evento na fila de cada conexão deste worker"""
+    for fila in _assinantes:
+        if fila.full():
+            fila.get_nowait()
+            metrics.incrementar("eventos.descartados")
+        fila.put_nowait(evento)
+    metrics.incrementar("eventos.entregues", len(_assinantes))
+
+
+async def iniciar(backend: Optional[BackendEventos] = None) -> None:
+    global _backend
+    if backend is None:
+        if EVENTOS_BACKEND not in BACKENDS:
+            raise ValueError(f"EVENTOS_BACKEND inválido: {EVENTOS_BACKEND}")
+        backend = BACKENDS[EVENTOS_BACKEND]()
+    _backend = backend
+    await _backend.iniciar(_entregar)
+    logger.info(f"Eventos de pedidos usando o backend '{type(_backend).__name__}'")
+
+
+async def parar() -> None:
+    await _backend.parar()
+
+
+async def publicar(tipo: str, dados: dict) -> None:
+    """Publica um evento; falhas são registradas sem interromper a operação que publicou"""
+    evento = {"tipo": tipo, "dados": dados, "em": datetime.utcnow()}
+    try:
+        await _backend.publicar(evento)
+        metrics.incrementar("eventos.publicados")
+    except Exception:
+        metrics.incrementar("eventos.falhas_publicacao")
+        logger.exception(f"Não foi possível publicar o evento '{tipo}'")
+
+
+@asynccontextmanager
+async def assinar() -> AsyncIterator[asyncio.Queue]:
+    """Fila com os eventos recebidos enquanto o contexto estiver aberto"""
+    fila: asyncio.Queue = asyncio.Queue(maxsize=EVENTOS_FILA_MAX)
+    _assinantes.add(fila)
+    try:
+        yield fila
+    finally:
+        _assinantes.discard(fila)
+
+
+def assinantes() -> int:
+    return len(_assinantes)
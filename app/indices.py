@@ -0,0 +1,178 @@
+from bson import ObjectId
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from app import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Índices necessários por coleção. São criados no startup (main.lifespan);
+# create_indexes não faz nada quando o índice já existe com a mesma definição.
+INDICES = {
+    "produtos": [
+        IndexModel([("categoria_id", ASCENDING), ("ativo", ASCENDING), ("_id", ASCENDING)], name="categoria_ativo_id"),
+        IndexModel([("ativo", ASCENDING), ("_id", ASCENDING)], name="ativo_id"),
+        IndexModel([("produtoId", ASCENDING)], name="produtoId", sparse=True),
+    ],
+    "pedidos": [
+        IndexModel([("pedidoId", ASCENDING)], name="pedidoId_unico", unique=True),
+        # (criadoEm, _id): paginação por keyset das listagens (app/paginacao.py)
+        IndexModel([("usuarioId", ASCENDING), ("criadoEm", DESCENDING), ("_id", DESCENDING)], name="usuario_criadoEm_id"),
+        IndexModel([("criadoEm", DESCENDING), ("_id", DESCENDING)], name="criadoEm_id"),
+        # status + criadoEm: seleção do arquivamento (app/services/arquivo_pedidos_service.py)
+        IndexModel([("status", ASCENDING), ("criadoEm", ASCENDING)], name="status_criadoEm"),
+        # Pedidos alterados desde a última reconciliação (app/services/reconciliacao_service.py)
+        IndexModel([("atualizadoEm", ASCENDING)], name="atualizadoEm"),
+    ],
+    "pedidos_arquivo": [
+        IndexModel([("pedidoId", ASCENDING)], name="pedidoId_unico", unique=True),
+        IndexModel([("usuarioId", ASCENDING), ("criadoEm", DESCENDING), ("_id", DESCENDING)], name="usuario_criadoEm_id"),
+        IndexModel([("criadoEm", DESCENDING), ("_id", DESCENDING)], name="criadoEm_id"),
+    ],
+    "pagamentos": [
+        IndexModel([("pedidoId", ASCENDING)], name="pedidoId"),
+        IndexModel([("pagamentoId", ASCENDING)], name="pagamentoId_unico", unique=True),
+        # Varredura de PIX vencidos (pagamento_service.expirar_pagamentos_pix)
+        IndexModel([("status", ASCENDING), ("expiraEm", ASCENDING)], name="status_expiraEm"),
+        # Chave de idempotência do cartão; pendentes resolvidos por pagamento_service.resolver_pagamentos_cartao
+        IndexModel([("transacaoId", ASCENDING)], name="transacaoId_unico", unique=True, sparse=True),
+        IndexModel([("status", ASCENDING), ("metodo", ASCENDING), ("criadoEm", ASCENDING)], name="status_metodo_criadoEm"),
+        IndexModel([("atualizadoEm", ASCENDING)], name="atualizadoEm"),
+    ],
+    "webhooks_pix": [
+        IndexModel([("estado", ASCENDING), ("proximaTentativaEm", ASCENDING)], name="estado_proximaTentativaEm"),
+        # Aplicados somem depois de 7 dias (janela de deduplicação); mortos ficam
+        IndexModel([("aplicadoEm", ASCENDING)], name="aplicadoEm_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "enderecos": [
+        IndexModel([("pedidoId", ASCENDING)], name="pedidoId"),
+    ],
+    "reconciliacao_divergencias": [
+        IndexModel([("tipo", ASCENDING), ("pedidoId", DESCENDING)], name="tipo_pedidoId"),
+        IndexModel([("pedidoId", DESCENDING)], name="pedidoId"),
+    ],
+    "usuarios": [
+        IndexModel([("email", ASCENDING)], name="email_unico", unique=True),
+    ],
+    "cartoes": [
+        IndexModel([("usuarioId", ASCENDING), ("criadoEm", DESCENDING)], name="usuario_criadoEm"),
+    ],
+    "sacola": [
+        IndexModel([("usuario_id", ASCENDING)], name="usuario_id"),
+    ],
+    # GridFS das imagens: nome = hash do conteúdo (ou <hash>.<variante>), uma cópia só
+    "imagens.files": [
+        IndexModel([("filename", ASCENDING)], name="filename_unico", unique=True),
+    ],
+}
+
+# Padrões de consulta dos services: (descrição, coleção, filtro, ordenação)
+# Usados pela auditoria para garantir que nenhum deles cai em COLLSCAN
+CONSULTAS = [
+    ("produtos por categoria (listagem)", "produtos", {"categoria_id": "x", "ativo": {"$ne": False}}, [("_id", ASCENDING)]),
+    ("produtos ativos (listagem)", "produtos", {"ativo": {"$ne": False}}, [("_id", ASCENDING)]),
+    ("produtos por produtoId (checkout)", "produtos", {"produtoId": {"$in": [1, 2]}, "ativo": True}, None),
+    ("pedido por pedidoId", "pedidos", {"pedidoId": 1}, None),
+    ("pedidos do usuário", "pedidos", {"usuarioId": "x"}, [("criadoEm", DESCENDING), ("_id", DESCENDING)]),
+    ("todos os pedidos (admin)", "pedidos", {}, [("criadoEm", DESCENDING), ("_id", DESCENDING)]),
+    ("todos os pedidos (admin, página seguinte)", "pedidos",
+     {"$or": [{"criadoEm": {"$lt": datetime(2024, 1, 1)}}, {"criadoEm": datetime(2024, 1, 1), "_id": {"$lt": ObjectId()}}]},
+     [("criadoEm", DESCENDING), ("_id", DESCENDING)]),
+    ("pedidos por status", "pedidos", {"status": "pendente"}, None),
+    ("pedidos a arquivar", "pedidos", {"status": "concluido", "criadoEm": {"$lt": datetime(2024, 1, 1)}}, [("criadoEm", ASCENDING)]),
+    ("pedido arquivado por pedidoId", "pedidos_arquivo", {"pedidoId": 1}, None),
+    ("pedidos arquivados do usuário", "pedidos_arquivo", {"usuarioId": "x"}, [("criadoEm", DESCENDING), ("_id", DESCENDING)]),
+    ("pagamento do pedido", "pagamentos", {"pedidoId": 1}, None),
+    ("pagamento pendente do pedido", "pagamentos", {"pedidoId": 1, "status": "pendente"}, None),
+    ("webhooks PIX prontos", "webhooks_pix", {"estado": "pendente", "proximaTentativaEm": {"$lte": datetime(2024, 1, 1)}}, [("proximaTentativaEm", ASCENDING)]),
+    ("PIX vencidos", "pagamentos", {"status": "pendente", "expiraEm": {"$lte": datetime(2024, 1, 1)}}, [("expiraEm", ASCENDING)]),
+    ("pedidos a reconciliar", "pedidos", {"pedidoId": {"$gt": 1}}, [("pedidoId", ASCENDING)]),
+    ("pedidos arquivados a reconciliar", "pedidos_arquivo", {"pedidoId": {"$gt": 1}}, [("pedidoId", ASCENDING)]),
+    ("pedidos alterados desde a reconciliação", "pedidos",
+     {"atualizadoEm": {"$gt": datetime(2024, 1, 1), "$lte": datetime(2024, 1, 2)}, "pedidoId": {"$lte": 1}}, None),
+    ("pagamentos alterados desde a reconciliação", "pagamentos",
+     {"atualizadoEm": {"$gt": datetime(2024, 1, 1), "$lte": datetime(2024, 1, 2)}, "pedidoId": {"$lte": 1}}, None),
+    ("divergências por tipo", "reconciliacao_divergencias", {"tipo": "valor_divergente", "resolvida": {"$ne": True}}, [("pedidoId", DESCENDING)]),
+    ("cartões pendentes a resolver", "pagamentos", {"status": "pendente", "metodo": "cartao", "criadoEm": {"$lte": datetime(2024, 1, 1)}}, [("criadoEm", ASCENDING)]),
+    ("endereço do pedido", "enderecos", {"pedidoId": 1}, None),
+    ("usuário por email", "usuarios", {"email": "x@x.com"}, None),
+    ("cartões do usuário", "cartoes", {"usuarioId": "x"}, [("criadoEm", DESCENDING)]),
+    ("sacola do usuário", "sacola", {"usuario_id": "x"}, None),
+]
+
+
+async def _valores_duplicados(db, colecao: str, indice: IndexModel, limite: int = 10) -> list[dict]:
+    """Valores que impedem um índice único: [{"valor", "quantidade"}]"""
+    campos = list(indice.document["key"].keys())
+    pipeline = []
+    if indice.document.get("sparse"):
+        pipeline.append({"$match": {campo: {"$exists": True} for campo in campos}})
+    pipeline += [
+        {"$group": {"_id": {campo.replace(".", "_"): f"${campo}" for campo in campos}, "quantidade": {"$sum": 1}}},
+        {"$match": {"quantidade": {"$gt": 1}}},
+        {"$sort": {"quantidade": -1}},
+        {"$limit": limite},
+    ]
+    return [
+        {"valor": doc["_id"], "quantidade": doc["quantidade"]}
+        async for doc in db[colecao].aggregate(pipeline, allowDiskUse=True)
+    ]
+
+
+async def garantir_indices(db) -> list[dict]:
+    """
+    Cria os índices declarados em INDICES, um a um
+    - Um índice que falha não impede os outros da mesma coleção
+    - Retorna as falhas; para índice único, com os valores duplicados que o impedem
+    """
+    falhas = []
+    for colecao, indices in INDICES.items():
+        for indice in indices:
+            nome = indice.document["name"]
+            try:
+                await db[colecao].create_indexes([indice])
+            except OperationFailure as e:
+                falha = {"colecao": colecao, "indice": nome, "erro": str(e)}
+                if indice.document.get("unique") and e.code == 11000:
+                    falha["duplicados"] = await _valores_duplicados(db, colecao, indice)
+                # A aplicação sobe mesmo assim; a auditoria (scripts/auditar_indices.py) acusa
+                logger.error(
+                    f"Não foi possível criar o índice '{nome}' de '{colecao}': {e}"
+                    + (f" (duplicados: {falha['duplicados']})" if "duplicados" in falha else "")
+                )
+                falhas.append(falha)
+    metrics.definir("indices.falhas", len(falhas))
+    return falhas
+
+
+def _estagios(plano) -> list[str]:
+    """Lista todos os estágios de um plano de execução (recursivo)"""
+    estagios = []
+    if isinstance(plano, dict):
+        if "stage" in plano:
+            estagios.append(plano["stage"])
+        for valor in plano.values():
+            estagios.extend(_estagios(valor))
+    elif isinstance(plano, list):
+        for valor in plano:
+            estagios.extend(_estagios(valor))
+    return estagios
+
+
+async def auditar_consultas(db) -> list[dict]:
+    """Roda explain() em cada padrão de CONSULTAS e marca os que usam COLLSCAN"""
+    relatorio = []
+    for descricao, colecao, filtro, ordenacao in CONSULTAS:
+        cursor = db[colecao].find(filtro)
+        if ordenacao:
+            cursor = cursor.sort(ordenacao)
+        explicacao = await cursor.explain()
+        estagios = _estagios(explicacao.get("queryPlanner", {}).get("winningPlan", {}))
+        relatorio.append({
+            "consulta": descricao,
+            "colecao": colecao,
+            "estagios": estagios,
+            "collscan": "COLLSCAN" in estagios,
+        })
+    return relatorio
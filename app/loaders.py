@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Optional
+from app import metrics
+import app.database as database
+import asyncio
+
+# Carregadores com escopo de requisição (estilo DataLoader):
+# - memoizam cada documento pela chave durante a requisição, então dois services
+#   que precisam do mesmo pedido fazem uma leitura só
+# - chaves pedidas no mesmo ciclo do event loop viram um único find com $in
+# - leem só os campos declarados em CARREGADORES (projeção)
+# Fora de uma requisição (tarefas em segundo plano) cada chamada usa um
+# carregador novo: há coalescência, mas nada fica memoizado.
+
+# nome -> (coleção, campo chave, projeção, filtro extra)
+CARREGADORES = {
+    "pedidos": ("pedidos", "pedidoId", ("pedidoId", "usuarioId", "status", "total", "metodoPagamento"), {}),
+    "usuarios": ("usuarios", "email", None, {}),
+    # Produtos ativos do checkout: por ObjectId e pelo produtoId numérico antigo
+    "produtos": ("produtos", "_id", None, {"ativo": True}),
+    "produtos_por_produtoId": ("produtos", "produtoId", None, {"ativo": True}),
+}
+
+
+class Carregador:
+    """Carrega documentos de uma coleção por um campo chave, em lote e com memoização"""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.colecao, self.campo, campos, self.filtro = CARREGADORES[nome]
+        self.projecao = {campo: 1 for campo in campos} if campos else None
+        if self.projecao is not None:
+            self.projecao[self.campo] = 1
+        self._memo: dict[Any, asyncio.Future] = {}
+        self._pendentes: dict[Any, asyncio.Future] = {}
+        # Referência forte aos despachos em andamento (o loop só guarda referência fraca)
+        self._despachos: set[asyncio.Task] = set()
+
+    def _iniciar_despacho(self) -> None:
+        tarefa = asyncio.ensure_future(self._despachar())
+        self._despachos.add(tarefa)
+        tarefa.add_done_callback(self._despachos.discard)
+
+    def _agendar(self, chave: Any) -> asyncio.Future:
+        if chave in self._memo:
+            metrics.incrementar(f"loaders.{self.nome}.memoizados")
+            return self._memo[chave]
+
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._memo[chave] = futuro
+        if not self._pendentes:
+            # Despacha depois que as outras corrotinas deste ciclo pedirem suas chaves
+            loop.call_soon(self._iniciar_despacho)
+        self._pendentes[chave] = futuro
+        return futuro
+
+    async def _despachar(self) -> None:
+        pendentes, self._pendentes = self._pendentes, {}
+        try:
+            filtro = {**self.filtro, self.campo: {"$in": list(pendentes)}}
+            encontrados = {}
+            async for doc in database.db[self.colecao].find(filtro, self.projecao):
+                encontrados[doc[self.campo]] = doc
+            metrics.incrementar(f"loaders.{self.nome}.consultas")
+        except Exception as e:
+            for chave, futuro in pendentes.items():
+                self._memo.pop(chave, None)
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+
+        for chave, futuro in pendentes.items():
+            if not futuro.done():
+                futuro.set_result(encontrados.get(chave))
+
+    async def carregar(self, chave: Any) -> Optional[dict]:
+        return await asyncio.shield(self._agendar(chave))
+
+    async def carregar_varios(self, chaves: Iterable[Any]) -> dict[Any, dict]:
+        """Retorna {chave: documento} só com as chaves encontradas"""
+        chaves = list(dict.fromkeys(chaves))
+        docs = await asyncio.gather(*(asyncio.shield(self._agendar(chave)) for chave in chaves))
+        return {chave: doc for chave, doc in zip(chaves, docs) if doc is not None}
+
+    def invalidar(self, chave: Any) -> None:
+        self._memo.pop(chave, None)
+
+
+class EscopoCarregadores:
+    def __init__(self):
+        self._carregadores: dict[str, Carregador] = {}
+
+    def obter(self, nome: str) -> Carregador:
+        if nome not in self._carregadores:
+            self._carregadores[nome] = Carregador(nome)
+        return self._carregadores[nome]
+
+
+_escopo: ContextVar[Optional[EscopoCarregadores]] = ContextVar("escopo_carregadores", default=None)
+
+
+@contextmanager
+def escopo():
+    """Abre um escopo de carregadores (uma requisição)"""
+    token = _escopo.set(EscopoCarregadores())
+    try:
+        yield
+    finally:
+        _escopo.reset(token)
+
+
+def carregador(nome: str) -> Carregador:
+    """Carregador do escopo atual; sem escopo, um carregador novo"""
+    atual = _escopo.get()
+    if atual is None:
+        return Carregador(nome)
+    return atual.obter(nome)
+
+
+def invalidar(nome: str, chave: Any) -> None:
+    """Descarta a cópia memoizada depois de uma escrita no documento"""
+    atual = _escopo.get()
+    if atual is not None:
+        atual.obter(nome).invalidar(chave)
+
+
+class EscopoCarregadoresMiddleware:
+    """Middleware ASGI: cada requisição HTTP tem o seu escopo de carregadores"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with escopo():
+            await self.app(scope, receive, send)
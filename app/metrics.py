@@ -0,0 +1,63 @@
+from collections import defaultdict, deque
+from threading import Lock
+import math
+
+# Métricas em memória do processo (cada worker mantém as suas)
+_contadores: dict[str, float] = defaultdict(float)
+_medidores: dict[str, float] = {}
+# Últimas amostras de cada latência, para os percentis
+AMOSTRAS_MAX = 1024
+_amostras: dict[str, deque] = defaultdict(lambda: deque(maxlen=AMOSTRAS_MAX))
+_lock = Lock()
+
+
+def incrementar(nome: str, valor: float = 1) -> None:
+    """Incrementa um contador"""
+    with _lock:
+        _contadores[nome] += valor
+
+
+def definir(nome: str, valor: float) -> None:
+    """Define o valor atual de um medidor (ex.: tamanho de uma fila)"""
+    with _lock:
+        _medidores[nome] = valor
+
+
+def observar(nome: str, valor: float) -> None:
+    """Registra uma amostra de latência (em ms)"""
+    with _lock:
+        _amostras[nome].append(valor)
+
+
+def obter(nome: str) -> float:
+    """Retorna o valor atual de um contador"""
+    return _contadores.get(nome, 0)
+
+
+def percentil(valores: list[float], p: float) -> float:
+    """Percentil por vizinho mais próximo de uma lista já ordenada"""
+    if not valores:
+        return 0.0
+    indice = min(len(valores) - 1, max(0, math.ceil(p / 100 * len(valores)) - 1))
+    return valores[indice]
+
+
+def _resumo(amostras) -> dict:
+    valores = sorted(amostras)
+    return {
+        "amostras": len(valores),
+        "p50": percentil(valores, 50),
+        "p95": percentil(valores, 95),
+        "p99": percentil(valores, 99),
+        "max": valores[-1] if valores else 0.0,
+    }
+
+
+def snapshot() -> dict:
+    """Retorna uma cópia de todas as métricas"""
+    with _lock:
+        return {
+            "contadores": dict(_contadores),
+            "medidores": dict(_medidores),
+            "latencias": {nome: _resumo(amostras) for nome, amostras in _amostras.items()},
+        }
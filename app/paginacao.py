@@ -0,0 +1,95 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
+from typing import Optional
+import base64
+import json
+
+# Paginação por keyset em (criadoEm, _id), do mais recente para o mais antigo.
+# O cursor é opaco para o cliente: base64 de {"t": criadoEm, "id": _id, "d": direção}.
+# Custo de qualquer página = uma busca no índice (criadoEm, _id), sem skip().
+PROXIMA = "next"
+ANTERIOR = "prev"
+
+
+def codificar_cursor(doc: dict, direcao: str) -> str:
+    bruto = json.dumps({"t": doc["criadoEm"].isoformat(), "id": str(doc["_id"]), "d": direcao})
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> tuple[datetime, ObjectId, str]:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        dados = json.loads(bruto)
+        direcao = dados["d"]
+        if direcao not in (PROXIMA, ANTERIOR):
+            raise ValueError
+        return datetime.fromisoformat(dados["t"]), ObjectId(dados["id"]), direcao
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError("Cursor inválido")
+
+
+def filtro_cursor(cursor: Optional[str]) -> tuple[dict, int, str]:
+    """
+    Retorna (filtro, sentido da ordenação, direção) para o cursor recebido
+    - sem cursor: primeira página, mais recentes primeiro
+    - next: itens mais antigos que o cursor (ordem decrescente)
+    - prev: itens mais recentes que o cursor (ordem crescente, invertida depois)
+    """
+    if not cursor:
+        return {}, -1, PROXIMA
+
+    criado_em, _id, direcao = decodificar_cursor(cursor)
+    operador, sentido = ("$lt", -1) if direcao == PROXIMA else ("$gt", 1)
+    filtro = {"$or": [
+        {"criadoEm": {operador: criado_em}},
+        {"criadoEm": criado_em, "_id": {operador: _id}},
+    ]}
+    return filtro, sentido, direcao
+
+
+async def paginar(colecoes, filtro_base: dict, cursor: Optional[str], page_size: int,
+                  projecao: Optional[dict] = None) -> tuple[list[dict], Optional[str], Optional[str]]:
+    """
+    Lê uma página por keyset e retorna (documentos, proximoCursor, cursorAnterior)
+    - colecoes: uma coleção ou uma lista delas (ex.: pedidos + arquivo), intercaladas
+      pela mesma ordenação; cada uma custa uma busca no índice
+    - Lê page_size + 1 documentos para saber se existe mais uma página na direção pedida
+    """
+    if not isinstance(colecoes, (list, tuple)):
+        colecoes = [colecoes]
+
+    filtro_keyset, sentido, direcao = filtro_cursor(cursor)
+    filtro = {**filtro_base, **filtro_keyset} if filtro_keyset else filtro_base
+    if projecao is not None:
+        projecao = {**projecao, "criadoEm": 1}
+
+    docs = []
+    vistos = set()
+    for colecao in colecoes:
+        lidos = await colecao.find(filtro, projecao).sort(
+            [("criadoEm", sentido), ("_id", sentido)]
+        ).limit(page_size + 1).to_list(length=page_size + 1)
+        # Um documento sendo movido entre coleções pode aparecer nas duas
+        for doc in lidos:
+            if doc["_id"] not in vistos:
+                vistos.add(doc["_id"])
+                docs.append(doc)
+    if len(colecoes) > 1:
+        docs.sort(key=lambda doc: (doc["criadoEm"], doc["_id"]), reverse=sentido == -1)
+
+    tem_mais = len(docs) > page_size
+    docs = docs[:page_size]
+    if direcao == ANTERIOR:
+        docs.reverse()
+
+    if not docs:
+        return docs, None, None
+
+    if direcao == PROXIMA:
+        proximo = codificar_cursor(docs[-1], PROXIMA) if tem_mais else None
+        anterior = codificar_cursor(docs[0], ANTERIOR) if cursor else None
+    else:
+        proximo = codificar_cursor(docs[-1], PROXIMA)
+        anterior = codificar_cursor(docs[0], ANTERIOR) if tem_mais else None
+    return docs, proximo, anterior
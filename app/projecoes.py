@@ -0,0 +1,33 @@
+from typing import Iterable, Optional
+
+VISAO_COMPLETA = "full"
+VISAO_RESUMO = "summary"
+
+
+def montar_projecao(
+    view: Optional[str],
+    fields: Optional[str],
+    visoes: dict[str, Optional[Iterable[str]]],
+    permitidos: Iterable[str]
+) -> Optional[dict]:
+    """
+    Converte os parâmetros 'view' e 'fields' em uma projeção do MongoDB
+    - fields: lista separada por vírgula (tem prioridade sobre view)
+    - view: nome de uma visão pré-definida (ex.: summary, full)
+    - Retorna None quando todos os campos devem ser lidos
+    """
+    if fields:
+        campos = [campo.strip() for campo in fields.split(",") if campo.strip()]
+        invalidos = sorted(set(campos) - set(permitidos))
+        if invalidos:
+            raise ValueError(f"Campos inválidos: {', '.join(invalidos)}")
+        return {campo: 1 for campo in campos}
+
+    view = view or VISAO_COMPLETA
+    if view not in visoes:
+        raise ValueError(f"Visão inválida: {view}. Use uma de: {', '.join(visoes)}")
+
+    campos = visoes[view]
+    if campos is None:
+        return None
+    return {campo: 1 for campo in campos}
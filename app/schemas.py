@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import date, datetime
 from typing import List, Optional, Union
 from enum import Enum
@@ -86,6 +86,43 @@ class ProdutoOut(BaseModel):
     quantidade: int
     ativo: bool
 
+class ProdutoResumoOut(BaseModel):
+    # Usado quando o cliente pede só alguns campos (view/fields)
+    id: str
+    titulo: str | None = None
+    descricao: str | None = None
+    preco: float | None = None
+    imagem: str | None = None
+    categoria_id: str | None = None
+    quantidade: int | None = None
+    ativo: bool | None = None
+
+class PaginaProdutosOut(BaseModel):
+    produtos: List[Union[ProdutoOut, ProdutoResumoOut]]
+    proximoCursor: Optional[str] = None  # None quando não há próxima página
+    pageSize: int
+
+class ResultadoBuscaOut(BaseModel):
+    produtos: List[ProdutoOut]
+    total: int
+    page: int
+    pageSize: int
+    totalPages: int
+
+class ProdutoMenuOut(BaseModel):
+    id: str
+    titulo: str
+    preco: float
+    imagem: str | None = None
+
+class CategoriaMenuOut(BaseModel):
+    id: str
+    nome: str
+    produtos: List[ProdutoMenuOut]
+
+class MenuOut(BaseModel):
+    categorias: List[CategoriaMenuOut]
+
 class ProdutoUpdate(BaseModel):
     titulo: str | None = None
     descricao: str | None = None
@@ -166,6 +203,23 @@ class StatusPedido(str, Enum):
 class AtualizarStatusIn(BaseModel):
     status: StatusPedido
 
+class AtualizacaoStatusItemIn(BaseModel):
+    pedidoId: int
+    status: StatusPedido
+
+class AtualizarStatusLoteIn(BaseModel):
+    pedidos: List[AtualizacaoStatusItemIn] = Field(..., min_length=1, max_length=100)
+
+class ResultadoStatusOut(BaseModel):
+    pedidoId: int
+    resultado: str  # atualizado | inalterado | nao_encontrado | transicao_invalida | conflito
+    status: Optional[StatusPedido] = None  # status do pedido após a operação
+    detalhe: Optional[str] = None
+
+class AtualizarStatusLoteOut(BaseModel):
+    atualizados: int
+    resultados: List[ResultadoStatusOut]
+
 class StatusPagamento(str, Enum):
     PAGO = "pago"
     EXPIRADO = "expirado"
@@ -267,6 +321,8 @@ class PagamentoCartaoOut(BaseModel):
 class PagamentoWebhookIn(BaseModel):
     pedidoId: int
     status: StatusPagamento
+    eventoId: Optional[str] = None  # id do evento no provedor (deduplicação)
+    pagamentoId: Optional[int] = None  # qual PIX do pedido; sem ele, vale o PIX mais recente
 
 class PagamentoOut(BaseModel):
     id: str  # Mudado de int para str (ObjectId)
@@ -291,10 +347,12 @@ class PedidoListaOut(BaseModel):
 
 class PaginacaoPedidosOut(BaseModel):
     pedidos: List[PedidoListaOut]
-    total: int
-    page: int
+    total: Optional[int] = None  # None quando a contagem não foi pedida
+    page: Optional[int] = None  # deprecated: use proximoCursor/cursorAnterior
     pageSize: int
-    totalPages: int
+    totalPages: Optional[int] = None
+    proximoCursor: Optional[str] = None  # None quando não há pedidos mais antigos
+    cursorAnterior: Optional[str] = None  # None na primeira página
 
 
 # SCHEMAS DE CARTAO
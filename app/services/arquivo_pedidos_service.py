@@ -0,0 +1,123 @@
+from app.database import get_database
+from app.schemas import StatusPedido
+from app import metrics
+from app.services import pedido_stats_service
+from datetime import datetime, timedelta
+from pymongo.errors import BulkWriteError
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Pedidos concluídos há mais de PEDIDOS_ARQUIVO_DIAS saem de 'pedidos' e vão
+# para 'pedidos_arquivo', com esquema enxuto: endereço e pagamento embutidos
+# (a leitura é um find_one) e sem a cópia dos dados do produto em cada item.
+# Assim 'pedidos' e seus índices ficam do tamanho do movimento recente.
+COLECAO_ARQUIVO = "pedidos_arquivo"
+PEDIDOS_ARQUIVO_DIAS = int(os.getenv("PEDIDOS_ARQUIVO_DIAS", "30"))
+PEDIDOS_ARQUIVO_LOTE = int(os.getenv("PEDIDOS_ARQUIVO_LOTE", "500"))
+PEDIDOS_ARQUIVO_INTERVALO = float(os.getenv("PEDIDOS_ARQUIVO_INTERVALO", "3600"))
+PEDIDOS_ARQUIVO_RECONTAGEM_HORAS = float(os.getenv("PEDIDOS_ARQUIVO_RECONTAGEM_HORAS", "24"))
+
+CAMPOS_ITEM_ARQUIVO = (
+    "id", "produtoId", "quantidade", "observacoes", "precoUnitario", "precoTotal", "nomeProduto", "imagemProduto",
+)
+CAMPOS_PAGAMENTO_ARQUIVO = ("_id", "pagamentoId", "pedidoId", "metodo", "valor", "status", "transacaoId", "criadoEm")
+
+
+def documento_arquivo(pedido: dict, endereco: dict | None, pagamento: dict | None, agora: datetime) -> dict:
+    """Converte um pedido (com endereço e pagamento) para o esquema do arquivo"""
+    if endereco:
+        endereco = {campo: valor for campo, valor in endereco.items() if campo not in ("_id", "pedidoId")}
+    if pagamento:
+        pagamento = {campo: pagamento[campo] for campo in CAMPOS_PAGAMENTO_ARQUIVO if campo in pagamento}
+
+    return {
+        # Mesmo _id: o cursor das listagens continua válido depois do arquivamento
+        "_id": pedido["_id"],
+        "pedidoId": pedido["pedidoId"],
+        "usuarioId": pedido["usuarioId"],
+        "status": pedido["status"],
+        "total": pedido["total"],
+        "taxaEntrega": pedido.get("taxaEntrega", 0.0),
+        "metodoPagamento": pedido["metodoPagamento"],
+        "itens": [
+            {campo: item[campo] for campo in CAMPOS_ITEM_ARQUIVO if campo in item}
+            for item in pedido.get("itens", [])
+        ],
+        "endereco": endereco,
+        "pagamento": pagamento,
+        "criadoEm": pedido["criadoEm"],
+        "atualizadoEm": pedido.get("atualizadoEm", pedido["criadoEm"]),
+        "arquivadoEm": agora,
+    }
+
+
+async def arquivar_lote(limite: datetime, tamanho_lote: int = PEDIDOS_ARQUIVO_LOTE) -> int:
+    """
+    Move um lote de pedidos concluídos criados antes de 'limite' para o arquivo
+    - insert_many(ordered=False) e depois delete_many: se o processo cair no meio,
+      a próxima execução reinsere (duplicatas ignoradas pelo índice único) e apaga
+    - Os pagamentos continuam em 'pagamentos' (registro financeiro); o arquivo guarda uma cópia
+    - Apaga de 'pedidos' pelos _id copiados e só os que continuam concluídos: um
+      pedido que mudou de status no meio fica em 'pedidos' e sai do arquivo
+    """
+    db = await get_database()
+    pedidos = await db.pedidos.find(
+        {"status": StatusPedido.CONCLUIDO.value, "criadoEm": {"$lt": limite}}
+    ).sort("criadoEm", 1).limit(tamanho_lote).to_list(tamanho_lote)
+    if not pedidos:
+        return 0
+
+    ids = [pedido["pedidoId"] for pedido in pedidos]
+    enderecos = {doc["pedidoId"]: doc async for doc in db.enderecos.find({"pedidoId": {"$in": ids}})}
+    pagamentos = {doc["pedidoId"]: doc async for doc in db.pagamentos.find({"pedidoId": {"$in": ids}})}
+
+    agora = datetime.utcnow()
+    documentos = [
+        documento_arquivo(pedido, enderecos.get(pedido["pedidoId"]), pagamentos.get(pedido["pedidoId"]), agora)
+        for pedido in pedidos
+    ]
+
+    try:
+        await db[COLECAO_ARQUIVO].insert_many(documentos, ordered=False)
+    except BulkWriteError as e:
+        # Só aceita duplicatas (pedido já arquivado numa execução interrompida)
+        if any(erro.get("code") != 11000 for erro in e.details.get("writeErrors", [])):
+            raise
+
+    copiados = [pedido["_id"] for pedido in pedidos]
+    removidos = await db.pedidos.delete_many({"_id": {"$in": copiados}, "status": StatusPedido.CONCLUIDO.value})
+    ficaram = set()
+    if removidos.deleted_count < len(copiados):
+        ficaram = {doc["_id"] async for doc in db.pedidos.find({"_id": {"$in": copiados}}, {"_id": 1})}
+        if ficaram:
+            await db[COLECAO_ARQUIVO].delete_many({"_id": {"$in": list(ficaram)}})
+            logger.info(f"{len(ficaram)} pedidos mudaram de status durante o arquivamento e continuam em 'pedidos'")
+
+    arquivados = [pedido["pedidoId"] for pedido in pedidos if pedido["_id"] not in ficaram]
+    await db.enderecos.delete_many({"pedidoId": {"$in": arquivados}})
+    if removidos.deleted_count:
+        await pedido_stats_service.registrar_arquivamento(removidos.deleted_count)
+    metrics.incrementar("pedidos.arquivados", len(arquivados))
+    return len(pedidos)
+
+
+async def arquivar_pedidos(dias: int = PEDIDOS_ARQUIVO_DIAS) -> int:
+    """Arquiva, em lotes, todos os pedidos concluídos há mais de 'dias' dias"""
+    # Recontagem da base aqui (tarefa exclusiva) para não correr junto com os lotes
+    base = await pedido_stats_service.obter_base_arquivo()
+    if base.get("recontadoEm") is None or \
+            base["recontadoEm"] < datetime.utcnow() - timedelta(hours=PEDIDOS_ARQUIVO_RECONTAGEM_HORAS):
+        await pedido_stats_service.recontar_base_arquivo()
+
+    limite = datetime.utcnow() - timedelta(days=dias)
+    total = 0
+    while True:
+        arquivados = await arquivar_lote(limite)
+        total += arquivados
+        if arquivados < PEDIDOS_ARQUIVO_LOTE:
+            break
+    if total:
+        logger.info(f"{total} pedidos concluídos movidos para {COLECAO_ARQUIVO}")
+    return total
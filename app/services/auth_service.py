@@ -1,4 +1,5 @@
 import app.database as database
+from app import loaders
 from app.schemas import LoginIn, LoginOut, UsuarioOut, TokenData
 from passlib.context import CryptContext
 from jose import JWTError, jwt
@@ -56,7 +57,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 
 async def authenticate_user(email: str, password: str):
     """Autentica o usuário"""
-    user = await database.db["usuarios"].find_one({"email": email})
+    user = await loaders.carregador("usuarios").carregar(email)
     if not user:
         return False
     
@@ -86,7 +87,7 @@ async def get_current_user(token: str):
     except JWTError:
         raise credentials_exception
     
-    user = await database.db["usuarios"].find_one({"email": token_data.email})
+    user = await loaders.carregador("usuarios").carregar(token_data.email)
     if user is None:
         raise credentials_exception
     return user
@@ -113,7 +114,7 @@ async def login_user(login_data: LoginIn) -> LoginOut:
 
 async def get_user_by_email(email: str):
     """Busca usuário por email"""
-    user = await database.db["usuarios"].find_one({"email": email})
+    user = await loaders.carregador("usuarios").carregar(email)
     if user:
         return user_helper(user)
     return None
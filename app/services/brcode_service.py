@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Optional
+from app import metrics
+import qrcode
+import qrcode.image.svg
+import asyncio
+import base64
+import os
+import re
+import unicodedata
+
+# BR Code (padrão EMV-QRCPS do Banco Central) para PIX estático.
+# Cada campo é ID (2 dígitos) + tamanho (2 dígitos) + valor; o campo 63 fecha
+# o payload com o CRC16-CCITT (polinômio 0x1021, valor inicial 0xFFFF)
+# calculado sobre todo o texto anterior, incluindo "6304".
+PIX_CHAVE = os.getenv("PIX_CHAVE", "pix@kaiserhaus.com.br")
+PIX_NOME_RECEBEDOR = os.getenv("PIX_NOME_RECEBEDOR", "Kaiserhaus")
+PIX_CIDADE_RECEBEDOR = os.getenv("PIX_CIDADE_RECEBEDOR", "SAO PAULO")
+GUI_PIX = "br.gov.bcb.pix"
+
+# A renderização do QR é CPU pura (biblioteca qrcode): roda em processos
+# separados e o resultado fica em um LRU por payload
+QRCODE_PROCESSOS = int(os.getenv("QRCODE_PROCESSOS", "2"))
+QRCODE_CACHE_MAX = int(os.getenv("QRCODE_CACHE_MAX", "512"))
+FORMATOS_QRCODE = {"png": "image/png", "svg": "image/svg+xml"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_cache: OrderedDict = OrderedDict()
+# Renderizações em andamento: pedidos simultâneos do mesmo payload esperam a mesma
+_em_andamento: dict[tuple[str, str], asyncio.Future] = {}
+
+
+def crc16_ccitt(dados: bytes) -> int:
+    crc = 0xFFFF
+    for byte in dados:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return crc
+
+
+def _campo(id_campo: str, valor: str) -> str:
+    if len(valor) > 99:
+        raise ValueError(f"Campo {id_campo} do BR Code maior que 99 caracteres")
+    return f"{id_campo}{len(valor):02d}{valor}"
+
+
+def _texto_emv(texto: str, tamanho: int) -> str:
+    """Nome e cidade: sem acentos, em maiúsculas e no tamanho máximo do campo"""
+    sem_acento = unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode()
+    return sem_acento.upper()[:tamanho]
+
+
+def montar_brcode(chave: str, valor: float, nome: str, cidade: str, txid: str) -> str:
+    """Monta o payload 'copia e cola' do PIX com o CRC16 no final"""
+    txid = re.sub(r"[^A-Za-z0-9]", "", txid)[:25] or "***"
+    payload = "".join((
+        _campo("00", "01"),
+        _campo("26", _campo("00", GUI_PIX) + _campo("01", chave)),
+        _campo("52", "0000"),
+        _campo("53", "986"),  # BRL
+        _campo("54", f"{valor:.2f}"),
+        _campo("58", "BR"),
+        _campo("59", _texto_emv(nome, 25)),
+        _campo("60", _texto_emv(cidade, 15)),
+        _campo("62", _campo("05", txid)),
+        "6304",
+    ))
+    return f"{payload}{crc16_ccitt(payload.encode()):04X}"
+
+
+def validar_brcode(payload: str) -> bool:
+    """Confere o CRC16 de um payload"""
+    return len(payload) > 4 and f"{crc16_ccitt(payload[:-4].encode()):04X}" == payload[-4:].upper()
+
+
+def payload_pedido(pedido_id: int, valor: float) -> str:
+    """Payload determinístico do pedido: o mesmo em qualquer processo (cacheável)"""
+    return montar_brcode(PIX_CHAVE, valor, PIX_NOME_RECEBEDOR, PIX_CIDADE_RECEBEDOR, f"PED{pedido_id}")
+
+
+def renderizar_qrcode(payload: str, formato: str = "png") -> bytes:
+    """Gera o QR Code do payload (executada nos processos do pool)"""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=8, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    saida = BytesIO()
+    if formato == "svg":
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(saida)
+    else:
+        qr.make_image().save(saida, format="PNG")
+    return saida.getvalue()
+
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=QRCODE_PROCESSOS)
+    return _pool
+
+
+async def gerar_qrcode(payload: str, formato: str = "png") -> bytes:
+    """QR Code do payload, do cache ou renderizado no pool de processos"""
+    if formato not in FORMATOS_QRCODE:
+        raise ValueError(f"Formato de QR Code inválido: {formato}")
+
+    chave = (payload, formato)
+    if chave in _cache:
+        _cache.move_to_end(chave)
+        metrics.incrementar("qrcode.cache.hits")
+        return _cache[chave]
+
+    if chave in _em_andamento:
+        metrics.incrementar("qrcode.cache.hits")
+        return await asyncio.shield(_em_andamento[chave])
+
+    metrics.incrementar("qrcode.cache.misses")
+    loop = asyncio.get_running_loop()
+    futuro = loop.run_in_executor(_obter_pool(), renderizar_qrcode, payload, formato)
+    _em_andamento[chave] = futuro
+    try:
+        imagem = await asyncio.shield(futuro)
+    finally:
+        _em_andamento.pop(chave, None)
+
+    _cache[chave] = imagem
+    if len(_cache) > QRCODE_CACHE_MAX:
+        _cache.popitem(last=False)
+    return imagem
+
+
+async def qrcode_data_url(payload: str, formato: str = "png") -> str:
+    imagem = await gerar_qrcode(payload, formato)
+    return f"data:{FORMATOS_QRCODE[formato]};base64,{base64.b64encode(imagem).decode()}"
+
+
+def encerrar_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
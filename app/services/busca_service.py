@@ -0,0 +1,170 @@
+import app.database as database
+from app.schemas import ProdutoOut
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Iterable, Optional
+from app import metrics
+import logging
+import math
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Peso de cada campo no ranking
+PESO_TITULO = 3.0
+PESO_DESCRICAO = 1.0
+# Um termo que só casa por prefixo (digitação em andamento) vale menos que o termo exato
+FATOR_PREFIXO = 0.6
+
+STOPWORDS = {
+    "a", "o", "as", "os", "e", "de", "da", "do", "das", "dos", "com", "sem",
+    "em", "no", "na", "nos", "nas", "um", "uma", "para", "por", "ao", "ou",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e sem acentos: 'Pão de Queijo' -> 'pao de queijo'"""
+    decomposto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def tokenizar(texto: str) -> list[str]:
+    return [t for t in _TOKEN_RE.findall(normalizar(texto)) if t not in STOPWORDS]
+
+
+class IndiceInvertido:
+    """Índice invertido em memória sobre título e descrição dos produtos"""
+
+    def __init__(self):
+        self._postings: dict[str, dict[str, float]] = defaultdict(dict)
+        self._termos_por_produto: dict[str, set[str]] = {}
+        self._produtos: dict[str, ProdutoOut] = {}
+        self._termos_ordenados: list[str] = []
+        self._termos_desatualizados = False
+
+    def __len__(self) -> int:
+        return len(self._produtos)
+
+    def adicionar(self, produto: ProdutoOut) -> None:
+        self.remover(produto.id)
+
+        pesos: dict[str, float] = defaultdict(float)
+        for termo in tokenizar(produto.titulo):
+            pesos[termo] += PESO_TITULO
+        for termo in tokenizar(produto.descricao):
+            pesos[termo] += PESO_DESCRICAO
+
+        for termo, peso in pesos.items():
+            if termo not in self._postings:
+                self._termos_desatualizados = True
+            self._postings[termo][produto.id] = peso
+
+        self._termos_por_produto[produto.id] = set(pesos)
+        self._produtos[produto.id] = produto
+
+    def remover(self, produto_id: str) -> None:
+        for termo in self._termos_por_produto.pop(produto_id, ()):
+            postings = self._postings.get(termo)
+            if postings is None:
+                continue
+            postings.pop(produto_id, None)
+            if not postings:
+                del self._postings[termo]
+                self._termos_desatualizados = True
+        self._produtos.pop(produto_id, None)
+
+    def _termos_com_prefixo(self, prefixo: str) -> Iterable[str]:
+        if self._termos_desatualizados:
+            self._termos_ordenados = sorted(self._postings)
+            self._termos_desatualizados = False
+
+        i = bisect_left(self._termos_ordenados, prefixo)
+        while i < len(self._termos_ordenados) and self._termos_ordenados[i].startswith(prefixo):
+            yield self._termos_ordenados[i]
+            i += 1
+
+    def buscar(self, consulta: str, apenas_ativos: bool = True) -> list[ProdutoOut]:
+        """
+        Retorna os produtos que contêm todos os termos da consulta, do mais relevante ao menos
+        - Cada termo casa de forma exata ou como prefixo (para busca enquanto digita)
+        - Relevância: peso do campo x raridade do termo (idf)
+        """
+        termos = tokenizar(consulta)
+        if not termos:
+            return []
+
+        total_produtos = max(len(self._produtos), 1)
+        pontuacao: Optional[dict[str, float]] = None
+
+        for termo in termos:
+            pontos_termo: dict[str, float] = {}
+            for candidato in self._termos_com_prefixo(termo):
+                postings = self._postings[candidato]
+                idf = math.log(1 + total_produtos / len(postings))
+                fator = 1.0 if candidato == termo else FATOR_PREFIXO
+                for produto_id, peso in postings.items():
+                    pontos = peso * idf * fator
+                    if pontos > pontos_termo.get(produto_id, 0.0):
+                        pontos_termo[produto_id] = pontos
+
+            if pontuacao is None:
+                pontuacao = pontos_termo
+            else:
+                pontuacao = {
+                    produto_id: pontos + pontos_termo[produto_id]
+                    for produto_id, pontos in pontuacao.items()
+                    if produto_id in pontos_termo
+                }
+            if not pontuacao:
+                return []
+
+        resultados = [
+            self._produtos[produto_id]
+            for produto_id, _ in sorted(pontuacao.items(), key=lambda item: (-item[1], item[0]))
+        ]
+        if apenas_ativos:
+            resultados = [produto for produto in resultados if produto.ativo]
+        return resultados
+
+
+_indice = IndiceInvertido()
+
+
+async def construir_indice() -> None:
+    """(Re)constrói o índice a partir da coleção de produtos"""
+    from app.services.produto_service import product_helper
+
+    global _indice
+    novo = IndiceInvertido()
+    async for prod in database.db["produtos"].find():
+        novo.adicionar(product_helper(prod))
+    _indice = novo
+    metrics.incrementar("busca.reconstrucoes")
+    logger.info(f"Índice de busca construído com {len(novo)} produtos")
+
+
+def atualizar_produto(produto: Optional[ProdutoOut]) -> None:
+    """Atualiza um produto no índice após uma escrita"""
+    if produto is not None:
+        _indice.adicionar(produto)
+
+
+def remover_produto(produto_id: str) -> None:
+    _indice.remover(produto_id)
+
+
+def buscar(consulta: str, page: int = 1, page_size: int = 20) -> dict:
+    """Busca paginada nos produtos ativos"""
+    resultados = _indice.buscar(consulta)
+    metrics.incrementar("busca.consultas")
+    inicio = (page - 1) * page_size
+    return {
+        "produtos": resultados[inicio:inicio + page_size],
+        "total": len(resultados),
+        "page": page,
+        "pageSize": page_size,
+        "totalPages": math.ceil(len(resultados) / page_size),
+    }
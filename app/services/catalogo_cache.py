@@ -0,0 +1,146 @@
+import app.database as database
+from collections import OrderedDict, defaultdict
+from threading import Lock
+from typing import Any, Awaitable, Callable, Hashable
+from pymongo import ReturnDocument
+from app import metrics
+import os
+import time
+
+# Configurações
+CATALOGO_CACHE_TTL = float(os.getenv("CATALOGO_CACHE_TTL", "60"))
+CATALOGO_CACHE_MAX_ITENS = int(os.getenv("CATALOGO_CACHE_MAX_ITENS", "1024"))
+CATALOGO_SYNC_INTERVALO = float(os.getenv("CATALOGO_SYNC_INTERVALO", "5"))
+
+AUSENTE = object()
+
+
+class CacheTTL:
+    """Cache LRU com expiração por tempo (TTL)"""
+
+    def __init__(self, ttl: float, max_itens: int):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._itens: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def obter(self, chave: Hashable) -> Any:
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                return AUSENTE
+
+            expira_em, valor = item
+            if expira_em < time.monotonic():
+                del self._itens[chave]
+                return AUSENTE
+
+            self._itens.move_to_end(chave)
+            return valor
+
+    def guardar(self, chave: Hashable, valor: Any) -> None:
+        with self._lock:
+            self._itens[chave] = (time.monotonic() + self.ttl, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                metrics.incrementar("catalogo_cache.evictions")
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+
+_cache = CacheTTL(CATALOGO_CACHE_TTL, CATALOGO_CACHE_MAX_ITENS)
+
+# Cada coleção tem uma versão que faz parte da chave do cache e da ETag.
+# Incrementar a versão invalida todas as entradas antigas de uma vez
+# (elas deixam de ser encontradas e saem pelo LRU/TTL).
+# A versão oficial fica na coleção 'catalogo_versoes' do Mongo, para que
+# todos os workers concordem; cada processo guarda uma cópia local que é
+# atualizada nas próprias escritas e sincronizada periodicamente.
+_versoes: dict[str, int] = {}
+
+# Funções chamadas quando outro worker altera uma coleção (ex.: reconstruir o índice de busca)
+_ouvintes: dict[str, list[Callable[[], Awaitable]]] = defaultdict(list)
+
+
+def versao(colecao: str) -> int:
+    """Retorna a versão atual de uma coleção do catálogo"""
+    return _versoes.get(colecao, 0)
+
+
+def obter(colecao: str, chave: Hashable) -> Any:
+    """Busca um valor no cache; retorna AUSENTE em caso de miss"""
+    valor = _cache.obter((colecao, versao(colecao), chave))
+    if valor is AUSENTE:
+        metrics.incrementar("catalogo_cache.misses")
+    else:
+        metrics.incrementar("catalogo_cache.hits")
+    return valor
+
+
+def guardar(colecao: str, chave: Hashable, valor: Any, versao_lida: int | None = None) -> None:
+    """
+    Guarda um valor no cache na versão atual da coleção
+    - versao_lida: versão observada antes da leitura no banco; se uma escrita
+      aconteceu no meio, o valor já nasceu velho e não é guardado
+    """
+    atual = versao(colecao)
+    if versao_lida is not None and versao_lida != atual:
+        return
+    _cache.guardar((colecao, atual, chave), valor)
+
+
+def etag(*colecoes: str) -> str:
+    """ETag forte derivada das versões das coleções (não acessa o banco)"""
+    return '"' + "-".join(f"{colecao}.v{versao(colecao)}" for colecao in colecoes) + '"'
+
+
+def _atualizar_versao_local(colecao: str, nova_versao: int) -> bool:
+    if nova_versao > versao(colecao):
+        _versoes[colecao] = nova_versao
+        return True
+    return False
+
+
+async def _avisar_ouvintes(colecao: str) -> None:
+    metrics.incrementar("catalogo_cache.invalidacoes_remotas")
+    for callback in _ouvintes[colecao]:
+        await callback()
+
+
+async def invalidar(colecao: str) -> None:
+    """Invalida todas as entradas de uma coleção (chamar após qualquer escrita)"""
+    anterior = versao(colecao)
+    doc = await database.db["catalogo_versoes"].find_one_and_update(
+        {"_id": colecao},
+        {"$inc": {"versao": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _atualizar_versao_local(colecao, doc["versao"])
+    metrics.incrementar("catalogo_cache.invalidacoes")
+    # Pulou versões: outro worker escreveu antes da próxima sincronização, e
+    # sincronizar_versoes não vai mais ver essa mudança como remota
+    if doc["versao"] > anterior + 1:
+        await _avisar_ouvintes(colecao)
+
+
+def ao_mudar_remotamente(colecao: str, callback: Callable[[], Awaitable]) -> None:
+    """Registra uma função a ser chamada quando a versão mudar por escrita de outro worker"""
+    _ouvintes[colecao].append(callback)
+
+
+async def sincronizar_versoes() -> None:
+    """Traz as versões gravadas por outros workers"""
+    async for doc in database.db["catalogo_versoes"].find():
+        if _atualizar_versao_local(doc["_id"], doc["versao"]):
+            await _avisar_ouvintes(doc["_id"])
+
+
+def tamanho() -> int:
+    return len(_cache)
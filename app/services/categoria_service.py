@@ -1,5 +1,6 @@
 import app.database as database
 from app.schemas import CategoriaIn, CategoriaOut, CategoriaUpdate
+from app.services import catalogo_cache
 from bson import ObjectId
 
 def categoria_helper(cat) -> CategoriaOut:
@@ -13,15 +14,23 @@ def categoria_helper(cat) -> CategoriaOut:
 async def create_categoria(cat: CategoriaIn) -> CategoriaOut:
     cat_dict = cat.dict()
     result = await database.db["categorias"].insert_one(cat_dict)
+    await catalogo_cache.invalidar("categorias")
     cat_dict["_id"] = result.inserted_id
     return categoria_helper(cat_dict)
 
 
 async def get_categorias() -> list[CategoriaOut]:
+    cache = catalogo_cache.obter("categorias", "lista")
+    if cache is not catalogo_cache.AUSENTE:
+        return list(cache)
+
+    versao_lida = catalogo_cache.versao("categorias")
     categorias = []
     async for cat in database.db["categorias"].find():
         categorias.append(categoria_helper(cat))
-    return categorias
+
+    catalogo_cache.guardar("categorias", "lista", categorias, versao_lida)
+    return list(categorias)
 
 
 async def get_categoria_by_id(cat_id: str) -> CategoriaOut | None:
@@ -35,6 +44,7 @@ async def update_categoria(cat_id: str, cat: CategoriaUpdate) -> CategoriaOut |
     result = await database.db["categorias"].update_one(
         {"_id": ObjectId(cat_id)}, {"$set": update_data}
     )
+    await catalogo_cache.invalidar("categorias")
 
     if result.modified_count == 1:
         return await get_categoria_by_id(cat_id)
@@ -42,4 +52,5 @@ async def update_categoria(cat_id: str, cat: CategoriaUpdate) -> CategoriaOut |
 
 async def delete_categoria(cat_id: str) -> bool:
     result = await database.db["categorias"].delete_one({"_id": ObjectId(cat_id)})
+    await catalogo_cache.invalidar("categorias")
     return result.deleted_count == 1
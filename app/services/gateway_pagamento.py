@@ -0,0 +1,312 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app import metrics
+from app.database import get_database
+import httpx
+import asyncio
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Adaptador do adquirente de cartão. O backend é escolhido por GATEWAY_BACKEND:
+# - simulado: aprovação aleatória, guardada no Mongo (desenvolvimento)
+# - http: API do adquirente (ou o scripts/gateway_fake.py) com um AsyncClient
+#   compartilhado (pool de conexões), prazo por chamada, retentativas com
+#   jitter só em operações idempotentes e disjuntor (circuit breaker)
+GATEWAY_BACKEND = os.getenv("GATEWAY_BACKEND", "simulado")
+GATEWAY_URL = os.getenv("GATEWAY_URL", "http://127.0.0.1:8081")
+GATEWAY_TOKEN = os.getenv("GATEWAY_TOKEN", "")
+GATEWAY_CONEXOES_MAX = int(os.getenv("GATEWAY_CONEXOES_MAX", "20"))
+# Timeout de cada tentativa e prazo total da chamada (somando as retentativas)
+GATEWAY_TIMEOUT = float(os.getenv("GATEWAY_TIMEOUT", "3"))
+GATEWAY_PRAZO = float(os.getenv("GATEWAY_PRAZO", "8"))
+GATEWAY_TENTATIVAS = int(os.getenv("GATEWAY_TENTATIVAS", "3"))
+GATEWAY_BACKOFF_BASE = float(os.getenv("GATEWAY_BACKOFF_BASE", "0.2"))
+GATEWAY_BACKOFF_MAX = float(os.getenv("GATEWAY_BACKOFF_MAX", "2"))
+# Disjuntor: abre após N falhas seguidas e só deixa uma chamada de teste passar depois do intervalo
+GATEWAY_CIRCUITO_FALHAS = int(os.getenv("GATEWAY_CIRCUITO_FALHAS", "5"))
+GATEWAY_CIRCUITO_ABERTO = float(os.getenv("GATEWAY_CIRCUITO_ABERTO", "30"))
+GATEWAY_SIMULADO_APROVACAO = float(os.getenv("GATEWAY_SIMULADO_APROVACAO", "0.9"))
+GATEWAY_SIMULADO_LATENCIA_MS = float(os.getenv("GATEWAY_SIMULADO_LATENCIA_MS", "0"))
+COLECAO_SIMULADO = "gateway_simulado"
+
+# Respostas que valem nova tentativa (o adquirente não processou ou pediu para esperar)
+STATUS_RETENTAVEIS = {429, 502, 503, 504}
+
+
+class GatewayIndisponivel(Exception):
+    """O adquirente não respondeu a tempo ou o disjuntor está aberto"""
+
+
+class Disjuntor:
+    """Circuit breaker por contagem de falhas seguidas (fechado -> aberto -> meio aberto)"""
+
+    def __init__(self, falhas_max: int, intervalo: float):
+        self.falhas_max = falhas_max
+        self.intervalo = intervalo
+        self.falhas = 0
+        self.aberto_ate: Optional[float] = None
+        self._teste_em_andamento = False
+
+    @property
+    def estado(self) -> str:
+        if self.aberto_ate is None:
+            return "fechado"
+        if time.monotonic() < self.aberto_ate:
+            return "aberto"
+        return "meio_aberto"
+
+    def permitir(self) -> bool:
+        estado = self.estado
+        if estado == "fechado":
+            return True
+        if estado == "meio_aberto" and not self._teste_em_andamento:
+            self._teste_em_andamento = True
+            return True
+        return False
+
+    def liberar(self) -> None:
+        """Chamada interrompida sem resultado (ex.: cancelada): outra pode testar o adquirente"""
+        self._teste_em_andamento = False
+
+    def sucesso(self) -> None:
+        if self.aberto_ate is not None:
+            logger.info("Disjuntor do gateway de pagamento fechado")
+        self.falhas = 0
+        self.aberto_ate = None
+        self._teste_em_andamento = False
+        metrics.definir("gateway.circuito.aberto", 0)
+
+    def falha(self) -> None:
+        self.falhas += 1
+        self._teste_em_andamento = False
+        if self.aberto_ate is not None or self.falhas >= self.falhas_max:
+            self.aberto_ate = time.monotonic() + self.intervalo
+            metrics.incrementar("gateway.circuito.aberturas")
+            metrics.definir("gateway.circuito.aberto", 1)
+            logger.warning(f"Disjuntor do gateway de pagamento aberto por {self.intervalo:.0f}s após {self.falhas} falhas")
+
+
+class GatewayPagamento(ABC):
+    """Interface do adquirente; a latência de cada operação vai para as métricas"""
+
+    async def iniciar(self) -> None:
+        pass
+
+    async def parar(self) -> None:
+        pass
+
+    async def autorizar(self, transacao_id: str, pedido_id: int, valor: float, cartao_id: int) -> dict:
+        """
+        Autoriza a cobrança; retorna {"transacaoId", "aprovado", "mensagem"}
+        - transacao_id é a chave de idempotência: repetir a chamada não cobra duas vezes
+        """
+        inicio = time.perf_counter()
+        try:
+            return await self._autorizar(transacao_id, pedido_id, valor, cartao_id)
+        finally:
+            metrics.observar("gateway.autorizar.latencia_ms", (time.perf_counter() - inicio) * 1000)
+
+    async def consultar(self, transacao_id: str) -> Optional[dict]:
+        """Situação de uma autorização já enviada (None se o adquirente não a conhece)"""
+        inicio = time.perf_counter()
+        try:
+            return await self._consultar(transacao_id)
+        finally:
+            metrics.observar("gateway.consultar.latencia_ms", (time.perf_counter() - inicio) * 1000)
+
+    @abstractmethod
+    async def _autorizar(self, transacao_id: str, pedido_id: int, valor: float, cartao_id: int) -> dict:
+        ...
+
+    @abstractmethod
+    async def _consultar(self, transacao_id: str) -> Optional[dict]:
+        ...
+
+
+class GatewaySimulado(GatewayPagamento):
+    """
+    Aprovação aleatória (GATEWAY_SIMULADO_APROVACAO) sem sair da aplicação
+    - As autorizações ficam na coleção 'gateway_simulado' (_id = transacaoId), não
+      na memória do processo: a consulta feita por outro worker (ex.: a tarefa que
+      resolve cartões pendentes) enxerga a autorização
+    """
+
+    async def _autorizar(self, transacao_id: str, pedido_id: int, valor: float, cartao_id: int) -> dict:
+        if GATEWAY_SIMULADO_LATENCIA_MS:
+            await asyncio.sleep(GATEWAY_SIMULADO_LATENCIA_MS / 1000)
+        aprovado = random.random() < GATEWAY_SIMULADO_APROVACAO
+        db = await get_database()
+        try:
+            # Mesma chave devolve sempre a primeira resposta
+            autorizacao = await db[COLECAO_SIMULADO].find_one_and_update(
+                {"_id": transacao_id},
+                {"$setOnInsert": {
+                    "aprovado": aprovado,
+                    "mensagem": "Aprovado" if aprovado else "Não autorizado",
+                    "criadoEm": datetime.utcnow(),
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Upsert simultâneo da mesma chave: o outro gravou primeiro
+            autorizacao = await db[COLECAO_SIMULADO].find_one({"_id": transacao_id})
+        return self._resposta(autorizacao)
+
+    async def _consultar(self, transacao_id: str) -> Optional[dict]:
+        db = await get_database()
+        autorizacao = await db[COLECAO_SIMULADO].find_one({"_id": transacao_id})
+        return self._resposta(autorizacao) if autorizacao else None
+
+    @staticmethod
+    def _resposta(autorizacao: dict) -> dict:
+        return {
+            "transacaoId": autorizacao["_id"],
+            "aprovado": autorizacao["aprovado"],
+            "mensagem": autorizacao["mensagem"],
+        }
+
+
+class GatewayHttp(GatewayPagamento):
+    """
+    Cliente HTTP do adquirente
+    - POST /autorizacoes com o header Idempotency-Key; GET /autorizacoes/{transacaoId}
+    - Timeouts, 5xx e 429 contam como falha para o disjuntor e são repetidos com
+      backoff exponencial com jitter (até GATEWAY_TENTATIVAS e dentro de GATEWAY_PRAZO)
+    - Outros 4xx são erro nosso: viram ValueError, sem retentativa
+    """
+
+    def __init__(self, url: str = GATEWAY_URL):
+        self.url = url
+        self.disjuntor = Disjuntor(GATEWAY_CIRCUITO_FALHAS, GATEWAY_CIRCUITO_ABERTO)
+        self._cliente: Optional[httpx.AsyncClient] = None
+
+    async def iniciar(self) -> None:
+        if self._cliente is None:
+            headers = {"Authorization": f"Bearer {GATEWAY_TOKEN}"} if GATEWAY_TOKEN else {}
+            self._cliente = httpx.AsyncClient(
+                base_url=self.url,
+                headers=headers,
+                timeout=httpx.Timeout(GATEWAY_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=GATEWAY_CONEXOES_MAX,
+                    max_keepalive_connections=GATEWAY_CONEXOES_MAX
+                ),
+            )
+
+    async def parar(self) -> None:
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+
+    def _espera(self, tentativa: int) -> float:
+        # "Full jitter": espalha as retentativas de vários workers
+        return random.uniform(0, min(GATEWAY_BACKOFF_MAX, GATEWAY_BACKOFF_BASE * 2 ** tentativa))
+
+    async def _requisitar(self, operacao: str, metodo: str, caminho: str, idempotente: bool, **kwargs) -> httpx.Response:
+        await self.iniciar()
+        tentativas = GATEWAY_TENTATIVAS if idempotente else 1
+        limite = time.monotonic() + GATEWAY_PRAZO
+        ultimo_erro = "sem tentativas"
+
+        for tentativa in range(tentativas):
+            if not self.disjuntor.permitir():
+                metrics.incrementar("gateway.circuito.rejeitadas")
+                raise GatewayIndisponivel("Gateway de pagamento indisponível, tente novamente em instantes")
+
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            if tentativa:
+                metrics.incrementar(f"gateway.{operacao}.retentativas")
+
+            inicio = time.perf_counter()
+            try:
+                resposta = await asyncio.wait_for(self._cliente.request(metodo, caminho, **kwargs), restante)
+            except (httpx.TransportError, asyncio.TimeoutError) as e:
+                ultimo_erro = type(e).__name__
+            except BaseException:
+                self.disjuntor.liberar()
+                raise
+            else:
+                if resposta.status_code not in STATUS_RETENTAVEIS and resposta.status_code < 500:
+                    self.disjuntor.sucesso()
+                    metrics.observar(f"gateway.{operacao}.tentativa_ms", (time.perf_counter() - inicio) * 1000)
+                    return resposta
+                ultimo_erro = f"HTTP {resposta.status_code}"
+
+            metrics.observar(f"gateway.{operacao}.tentativa_ms", (time.perf_counter() - inicio) * 1000)
+            metrics.incrementar(f"gateway.{operacao}.falhas")
+            self.disjuntor.falha()
+            logger.warning(f"Gateway de pagamento: {operacao} falhou na tentativa {tentativa + 1} ({ultimo_erro})")
+
+            espera = self._espera(tentativa)
+            if tentativa + 1 < tentativas and time.monotonic() + espera < limite:
+                await asyncio.sleep(espera)
+            else:
+                break
+
+        raise GatewayIndisponivel(f"Gateway de pagamento não respondeu ({ultimo_erro})")
+
+    async def _autorizar(self, transacao_id: str, pedido_id: int, valor: float, cartao_id: int) -> dict:
+        resposta = await self._requisitar(
+            "autorizar", "POST", "/autorizacoes", idempotente=True,
+            headers={"Idempotency-Key": transacao_id},
+            json={"transacaoId": transacao_id, "pedidoId": pedido_id, "valor": round(valor, 2), "cartaoId": cartao_id},
+        )
+        if resposta.status_code >= 400:
+            raise ValueError(f"Autorização recusada pelo gateway: HTTP {resposta.status_code}")
+        dados = resposta.json()
+        return {
+            "transacaoId": dados.get("transacaoId", transacao_id),
+            "aprovado": bool(dados.get("aprovado")),
+            "mensagem": dados.get("mensagem", ""),
+        }
+
+    async def _consultar(self, transacao_id: str) -> Optional[dict]:
+        resposta = await self._requisitar("consultar", "GET", f"/autorizacoes/{transacao_id}", idempotente=True)
+        if resposta.status_code == 404:
+            return None
+        if resposta.status_code >= 400:
+            raise ValueError(f"Consulta recusada pelo gateway: HTTP {resposta.status_code}")
+        return resposta.json()
+
+
+GATEWAYS = {
+    "simulado": GatewaySimulado,
+    "http": GatewayHttp,
+}
+
+_gateway: Optional[GatewayPagamento] = None
+
+
+async def iniciar(gateway: Optional[GatewayPagamento] = None) -> None:
+    global _gateway
+    if gateway is None:
+        if GATEWAY_BACKEND not in GATEWAYS:
+            raise ValueError(f"GATEWAY_BACKEND inválido: {GATEWAY_BACKEND}")
+        gateway = GATEWAYS[GATEWAY_BACKEND]()
+    _gateway = gateway
+    await _gateway.iniciar()
+    logger.info(f"Pagamentos com cartão usando o gateway '{type(_gateway).__name__}'")
+
+
+async def parar() -> None:
+    global _gateway
+    if _gateway is not None:
+        await _gateway.parar()
+        _gateway = None
+
+
+async def obter() -> GatewayPagamento:
+    """Gateway configurado (iniciado sob demanda fora do servidor, ex.: scripts)"""
+    if _gateway is None:
+        await iniciar()
+    return _gateway
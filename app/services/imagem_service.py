@@ -0,0 +1,268 @@
+import app.database as database
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from typing import AsyncIterator, Optional, Union
+from app import metrics
+from app.services import imagem_variantes
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import math
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Imagens ficam no GridFS (bucket "imagens"), uma única vez por conteúdo.
+# O nome do arquivo é o SHA-256 dos bytes, que também serve de referência
+# nos documentos de produtos. As variantes (thumb, card, full) ficam ao lado,
+# com o nome <hash>.<variante>.
+# O índice único em imagens.files.filename (app/indices.py) garante uma cópia
+# só mesmo com dois uploads simultâneos do mesmo conteúdo.
+BUCKET_IMAGENS = "imagens"
+TAMANHO_MAXIMO_IMAGEM = 5 * 1024 * 1024  # 5MB
+PREFIXO_URL = "/images/"
+# Imagens cujas variantes não puderam ser geradas: não tenta de novo a cada
+# leitura durante esse tempo (cache negativo por processo)
+VARIANTES_FALHA_TTL = float(os.getenv("VARIANTES_FALHA_TTL", "3600"))
+VARIANTES_FALHA_MAXIMO = 10_000
+
+_falhas_variantes: dict[str, float] = {}
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URL_RE = re.compile(r"^data:(?P<tipo>[\w/+.-]+)?(;[\w=-]+)*;base64,", re.IGNORECASE)
+
+
+def _bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(database.db, bucket_name=BUCKET_IMAGENS)
+
+
+def eh_hash(valor: Optional[str]) -> bool:
+    return bool(valor) and bool(_HASH_RE.match(valor))
+
+
+def eh_data_url(valor: Optional[str]) -> bool:
+    return bool(valor) and valor.startswith("data:")
+
+
+def mensagem_tamanho_maximo(limite: int = TAMANHO_MAXIMO_IMAGEM) -> str:
+    """Mensagem de erro com o limite configurado (em MB, ou KB se não for múltiplo de MB)"""
+    if limite % (1024 * 1024) == 0:
+        return f"Imagem muito grande. Máximo {limite // (1024 * 1024)}MB"
+    return f"Imagem muito grande. Máximo {math.ceil(limite / 1024)}KB"
+
+
+class LeitorBuffer(io.RawIOBase):
+    """Arquivo somente leitura sobre um buffer (bytes/bytearray), sem copiá-lo"""
+
+    def __init__(self, dados):
+        self._dados = memoryview(dados)
+        self._posicao = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, destino) -> int:
+        n = max(0, min(len(destino), len(self._dados) - self._posicao))
+        destino[:n] = self._dados[self._posicao:self._posicao + n]
+        self._posicao += n
+        return n
+
+    def seek(self, posicao: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._posicao, io.SEEK_END: len(self._dados)}[whence]
+        self._posicao = max(0, base + posicao)
+        return self._posicao
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def close(self) -> None:
+        if not self.closed:
+            self._dados.release()
+        super().close()
+
+
+def calcular_hash(dados: bytes) -> str:
+    return hashlib.sha256(dados).hexdigest()
+
+
+def url_imagem(referencia: Optional[str]) -> Optional[str]:
+    """
+    Converte a referência armazenada em uma URL para o cliente
+    - hash: /images/<hash>
+    - data URL antiga ou URL externa: devolvida como está
+    """
+    if eh_hash(referencia):
+        return f"{PREFIXO_URL}{referencia}"
+    return referencia
+
+
+def decodificar_imagem(valor: str) -> tuple[bytes, str]:
+    """Decodifica uma data URL (ou base64 puro) e retorna (bytes, content-type)"""
+    content_type = "application/octet-stream"
+    match = _DATA_URL_RE.match(valor)
+    if match:
+        content_type = match.group("tipo") or content_type
+        valor = valor[match.end():]
+
+    try:
+        dados = base64.b64decode(valor, validate=False)
+    except (binascii.Error, ValueError):
+        raise ValueError("Formato base64 inválido")
+
+    if len(dados) == 0:
+        raise ValueError("Imagem base64 inválida")
+    if len(dados) > TAMANHO_MAXIMO_IMAGEM:
+        raise ValueError(mensagem_tamanho_maximo())
+
+    return dados, content_type
+
+
+def nome_arquivo(hash_imagem: str, variante: Optional[str] = None) -> str:
+    return f"{hash_imagem}.{variante}" if variante else hash_imagem
+
+
+async def _existe(nome: str) -> bool:
+    existente = await database.db[f"{BUCKET_IMAGENS}.files"].find_one(
+        {"filename": nome}, {"_id": 1}
+    )
+    return existente is not None
+
+
+async def _gravar(nome: str, conteudo, metadata: dict) -> bool:
+    """
+    Grava um arquivo no bucket; False se outro upload gravou o mesmo nome antes
+    - O documento em imagens.files é inserido por último: na colisão do índice
+      único, os chunks já gravados com este file_id são apagados
+    """
+    file_id = ObjectId()
+    try:
+        await _bucket().upload_from_stream_with_id(file_id, nome, conteudo, metadata=metadata)
+    except DuplicateKeyError:
+        await database.db[f"{BUCKET_IMAGENS}.chunks"].delete_many({"files_id": file_id})
+        metrics.incrementar("imagens.uploads_duplicados")
+        return False
+    return True
+
+
+async def salvar_variantes(hash_imagem: str, dados: bytes) -> bool:
+    """Gera as variantes no pool de processos e grava no GridFS"""
+    try:
+        variantes = await imagem_variantes.processar_variantes(dados)
+    except Exception as e:
+        # Bytes que o Pillow não entende: a imagem fica só com o original
+        logger.warning(f"Não foi possível gerar variantes da imagem {hash_imagem}: {e}")
+        metrics.incrementar("imagens.variantes.falhas")
+        if len(_falhas_variantes) >= VARIANTES_FALHA_MAXIMO:
+            _falhas_variantes.clear()
+        _falhas_variantes[hash_imagem] = time.monotonic() + VARIANTES_FALHA_TTL
+        return False
+
+    for variante, conteudo in variantes.items():
+        await _gravar(
+            nome_arquivo(hash_imagem, variante),
+            conteudo,
+            {"contentType": imagem_variantes.CONTENT_TYPE_VARIANTES, "variante": variante}
+        )
+    metrics.incrementar("imagens.variantes.geradas", len(variantes))
+    return True
+
+
+async def salvar_imagem(dados: Union[bytes, bytearray], content_type: str) -> str:
+    """Salva a imagem e suas variantes no GridFS (se ainda não existir) e retorna o hash"""
+    hash_imagem = calcular_hash(dados)
+
+    if not await _existe(hash_imagem):
+        # bytearray do upload multipart: lido em chunks, sem cópia inteira
+        with LeitorBuffer(dados) as leitor:
+            gravado = await _gravar(hash_imagem, leitor, {"contentType": content_type})
+        # Upload simultâneo do mesmo conteúdo: quem gravou primeiro gera as variantes
+        if gravado:
+            await salvar_variantes(hash_imagem, dados)
+    return hash_imagem
+
+
+async def normalizar_referencia(valor: Optional[str]) -> Optional[str]:
+    """
+    Converte o valor recebido no campo 'imagem' para a referência armazenada
+    - data URL / base64: salva no GridFS e retorna o hash
+    - /images/<hash> ou <hash>: retorna o hash
+    - qualquer outra coisa (ex.: URL externa): mantém
+    """
+    if not valor:
+        return valor
+    if valor.startswith(PREFIXO_URL) and eh_hash(valor[len(PREFIXO_URL):]):
+        return valor[len(PREFIXO_URL):]
+    if eh_hash(valor) or valor.startswith(("http://", "https://")):
+        return valor
+
+    dados, content_type = decodificar_imagem(valor)
+    return await salvar_imagem(dados, content_type)
+
+
+async def _abrir(nome: str):
+    try:
+        return await _bucket().open_download_stream_by_name(nome)
+    except NoFile:
+        return None
+
+
+def _falha_recente(hash_imagem: str) -> bool:
+    expira = _falhas_variantes.get(hash_imagem)
+    if expira is None:
+        return False
+    if expira < time.monotonic():
+        _falhas_variantes.pop(hash_imagem, None)
+        return False
+    return True
+
+
+async def abrir_imagem(hash_imagem: str, variante: Optional[str] = None) -> tuple[Optional[object], bool]:
+    """
+    Abre o arquivo da imagem (ou de uma variante) no GridFS
+    - Retorna (arquivo, substituta); arquivo None se não existir
+    - Imagens antigas sem variantes têm as variantes geradas na primeira leitura
+    - Se não for possível gerar a variante, devolve o original com substituta=True
+      (não pode ser servido com o ETag nem o cache imutável da variante); a falha
+      fica em cache por VARIANTES_FALHA_TTL para não decodificar de novo a cada leitura
+    """
+    if not variante:
+        return await _abrir(hash_imagem), False
+
+    arquivo = await _abrir(nome_arquivo(hash_imagem, variante))
+    if arquivo is not None:
+        return arquivo, False
+
+    original = await _abrir(hash_imagem)
+    if original is None:
+        return None, False
+
+    if _falha_recente(hash_imagem):
+        metrics.incrementar("imagens.variantes.falhas_em_cache")
+        return original, True
+
+    if await salvar_variantes(hash_imagem, await original.read()):
+        return await _abrir(nome_arquivo(hash_imagem, variante)), False
+
+    original.seek(0)
+    return original, True
+
+
+async def ler_intervalo(arquivo, inicio: int, fim: int, tamanho_bloco: int = 256 * 1024) -> AsyncIterator[bytes]:
+    """Lê os bytes [inicio, fim] do arquivo em blocos, sem carregar tudo em memória"""
+    arquivo.seek(inicio)
+    restante = fim - inicio + 1
+    while restante > 0:
+        bloco = await arquivo.read(min(tamanho_bloco, restante))
+        if not bloco:
+            break
+        restante -= len(bloco)
+        yield bloco
@@ -0,0 +1,122 @@
+from typing import Optional, Union
+from multipart.multipart import MultipartParser, parse_options_header
+from PIL import Image
+from app.services.imagem_service import TAMANHO_MAXIMO_IMAGEM, LeitorBuffer, mensagem_tamanho_maximo
+import asyncio
+
+# Assinaturas (magic bytes) dos formatos aceitos
+_ASSINATURAS = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+BYTES_PARA_DETECCAO = 12
+
+
+class ImagemMuitoGrande(ValueError):
+    pass
+
+
+class FormatoNaoSuportado(ValueError):
+    pass
+
+
+def detectar_formato(inicio: bytes) -> Optional[str]:
+    """Identifica o formato da imagem pelos primeiros bytes"""
+    for assinatura, content_type in _ASSINATURAS:
+        if inicio.startswith(assinatura):
+            return content_type
+    if inicio[:4] == b"RIFF" and inicio[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def extrair_boundary(content_type_header: str) -> bytes:
+    tipo, parametros = parse_options_header(content_type_header)
+    if tipo != b"multipart/form-data" or not parametros.get(b"boundary"):
+        raise ValueError("Envie a imagem como multipart/form-data")
+    return parametros[b"boundary"]
+
+
+class UploadImagemStream:
+    """
+    Recebe o corpo multipart em pedaços e guarda só os bytes do campo da imagem
+    - Aborta assim que o limite de tamanho é ultrapassado
+    - Detecta o formato pelos magic bytes logo no primeiro pedaço
+    """
+
+    def __init__(self, boundary: bytes, campo: str = "file", limite: int = TAMANHO_MAXIMO_IMAGEM):
+        self.campo = campo.encode()
+        self.limite = limite
+        self.dados = bytearray()
+        self.content_type: Optional[str] = None
+        self.encontrado = False
+
+        self._header_atual = b""
+        self._valor_atual = b""
+        self._parte_eh_imagem = False
+
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._inicio_parte,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_part_data": self._dados_parte,
+        })
+
+    def _inicio_parte(self):
+        self._parte_eh_imagem = False
+
+    def _header_field(self, data: bytes, start: int, end: int):
+        self._header_atual += data[start:end]
+
+    def _header_value(self, data: bytes, start: int, end: int):
+        self._valor_atual += data[start:end]
+
+    def _header_end(self):
+        if self._header_atual.lower() == b"content-disposition":
+            _, parametros = parse_options_header(self._valor_atual)
+            if parametros.get(b"name") == self.campo:
+                self._parte_eh_imagem = True
+                self.encontrado = True
+        self._header_atual = b""
+        self._valor_atual = b""
+
+    def _dados_parte(self, data: bytes, start: int, end: int):
+        if not self._parte_eh_imagem:
+            return
+
+        if len(self.dados) + (end - start) > self.limite:
+            raise ImagemMuitoGrande(mensagem_tamanho_maximo(self.limite))
+        self.dados += data[start:end]
+
+        if self.content_type is None and len(self.dados) >= BYTES_PARA_DETECCAO:
+            self.content_type = detectar_formato(bytes(self.dados[:BYTES_PARA_DETECCAO]))
+            if self.content_type is None:
+                raise FormatoNaoSuportado("Formato de imagem não suportado. Use PNG, JPEG, GIF ou WebP")
+
+    def escrever(self, pedaco: bytes):
+        self._parser.write(pedaco)
+
+    def finalizar(self) -> tuple[bytearray, str]:
+        """Retorna o próprio buffer (sem copiar) e o content-type"""
+        self._parser.finalize()
+        if not self.encontrado or not self.dados:
+            raise ValueError(f"Campo '{self.campo.decode()}' com a imagem não encontrado")
+        if self.content_type is None:
+            raise FormatoNaoSuportado("Formato de imagem não suportado. Use PNG, JPEG, GIF ou WebP")
+        return self.dados, self.content_type
+
+
+def _verificar_imagem(dados: Union[bytes, bytearray]) -> None:
+    with LeitorBuffer(dados) as leitor, Image.open(leitor) as imagem:
+        imagem.verify()
+
+
+async def verificar_imagem(dados: Union[bytes, bytearray]) -> None:
+    """Confere se os bytes decodificam como imagem (em uma thread, fora do event loop)"""
+    try:
+        await asyncio.to_thread(_verificar_imagem, dados)
+    except Exception:
+        raise ValueError("Imagem corrompida ou inválida")
@@ -0,0 +1,60 @@
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Optional
+from PIL import Image, ImageOps
+import asyncio
+import os
+
+# Variantes geradas a partir de cada imagem enviada: nome -> caixa máxima (largura, altura)
+# Ordenadas da maior para a menor: cada uma é reduzida a partir da anterior
+VARIANTES = {
+    "full": (1600, 1600),
+    "card": (480, 480),
+    "thumb": (160, 160),
+}
+FORMATO_VARIANTES = "WEBP"
+CONTENT_TYPE_VARIANTES = "image/webp"
+QUALIDADE_VARIANTES = 80
+
+IMAGENS_PROCESSOS = int(os.getenv("IMAGENS_PROCESSOS", str(os.cpu_count() or 1)))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def gerar_variantes(dados: bytes) -> dict[str, bytes]:
+    """
+    Decodifica a imagem uma única vez e gera todas as variantes em WebP
+    - Executada nos processos do pool (não depende do banco nem do event loop)
+    - Lança OSError/ValueError se os bytes não forem uma imagem válida
+    """
+    with Image.open(BytesIO(dados)) as original:
+        imagem = ImageOps.exif_transpose(original)
+        imagem = imagem.convert("RGBA" if "A" in imagem.getbands() else "RGB")
+
+    variantes = {}
+    for nome, caixa in VARIANTES.items():
+        imagem.thumbnail(caixa, Image.Resampling.LANCZOS)
+        saida = BytesIO()
+        imagem.save(saida, FORMATO_VARIANTES, quality=QUALIDADE_VARIANTES, method=4)
+        variantes[nome] = saida.getvalue()
+    return variantes
+
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGENS_PROCESSOS)
+    return _pool
+
+
+async def processar_variantes(dados: bytes) -> dict[str, bytes]:
+    """Gera as variantes no pool de processos, sem bloquear o event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_obter_pool(), gerar_variantes, dados)
+
+
+def encerrar_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,57 @@
+import app.database as database
+from app.schemas import MenuOut, CategoriaMenuOut, ProdutoMenuOut
+from app.services import catalogo_cache
+from app.services.imagem_service import url_imagem
+
+# Uma única agregação: categorias -> produtos ativos de cada uma, só com os campos do cardápio
+PIPELINE_MENU = [
+    {"$addFields": {"categoria_id": {"$toString": "$_id"}}},
+    {"$lookup": {
+        "from": "produtos",
+        "localField": "categoria_id",
+        "foreignField": "categoria_id",
+        "pipeline": [
+            {"$match": {"ativo": {"$ne": False}}},
+            {"$project": {"_id": 0, "id": {"$toString": "$_id"}, "titulo": 1, "preco": 1, "imagem": 1}},
+        ],
+        "as": "produtos",
+    }},
+    {"$match": {"produtos.0": {"$exists": True}}},
+    {"$project": {"_id": 0, "id": "$categoria_id", "nome": 1, "produtos": 1}},
+]
+
+
+def menu_helper(categorias: list[dict]) -> MenuOut:
+    return MenuOut(categorias=[
+        CategoriaMenuOut(
+            id=cat["id"],
+            nome=cat["nome"],
+            produtos=[
+                ProdutoMenuOut(
+                    id=prod["id"],
+                    titulo=prod["titulo"],
+                    preco=prod["preco"],
+                    imagem=url_imagem(prod.get("imagem"))
+                )
+                for prod in cat["produtos"]
+            ]
+        )
+        for cat in categorias
+    ])
+
+
+async def obter_menu() -> MenuOut:
+    """Cardápio agrupado por categoria, com apenas produtos ativos"""
+    # O menu depende das duas coleções: a versão de categorias entra na chave
+    # e a de produtos vem do próprio cache
+    chave = ("menu", catalogo_cache.versao("categorias"))
+    cache = catalogo_cache.obter("produtos", chave)
+    if cache is not catalogo_cache.AUSENTE:
+        return cache
+
+    versao_lida = catalogo_cache.versao("produtos")
+    categorias = await database.db["categorias"].aggregate(PIPELINE_MENU).to_list(None)
+    menu = menu_helper(categorias)
+
+    catalogo_cache.guardar("produtos", chave, menu, versao_lida)
+    return menu
@@ -3,12 +3,29 @@ from app.schemas import (
     PagamentoPixIn, PagamentoPixOut, PagamentoCartaoIn, PagamentoCartaoOut,
     PagamentoWebhookIn, PagamentoOut, StatusPagamento, MetodoPagamento
 )
+from app.services.sequencia_service import proximo_pagamento_id
+from app.services import brcode_service, gateway_pagamento
+from app import eventos, metrics
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
 from typing import Optional
-import uuid
-import base64
+import logging
 import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Validade do PIX; depois disso o varredor marca o pagamento como expirado
+PIX_EXPIRACAO_MINUTOS = int(os.getenv("PIX_EXPIRACAO_MINUTOS", "30"))
+PIX_EXPIRACAO_INTERVALO = float(os.getenv("PIX_EXPIRACAO_INTERVALO", "60"))
+PIX_EXPIRACAO_LOTE = int(os.getenv("PIX_EXPIRACAO_LOTE", "500"))
+
+# Cartão pendente há mais que isso (bem acima de GATEWAY_PRAZO) é resolvido
+# consultando o adquirente pelo transacaoId
+CARTAO_PENDENTE_SEGUNDOS = float(os.getenv("CARTAO_PENDENTE_SEGUNDOS", "60"))
+CARTAO_RESOLUCAO_INTERVALO = float(os.getenv("CARTAO_RESOLUCAO_INTERVALO", "60"))
+CARTAO_RESOLUCAO_LOTE = int(os.getenv("CARTAO_RESOLUCAO_LOTE", "100"))
 
 
 # HELPERS PARA MONGODB
@@ -32,17 +49,18 @@ def pagamento_helper(pagamento) -> dict:
 # OPERAÇÕES DE PAGAMENTO PIX
 async def criar_pagamento_pix(pagamento_data: PagamentoPixIn, usuario_id: str) -> PagamentoPixOut:
     """Cria um pagamento PIX com QR Code e código copia e cola"""
-    from app.services.pedido_service import verificar_se_pedido_existe, obter_total_pedido
+    from app.services.pedido_service import obter_pedido_resumo
     
     db = await get_database()
     pagamentos = db.pagamentos
     
-    # Valida se o pedido existe
-    if not await verificar_se_pedido_existe(pagamento_data.pedidoId):
+    # Valida se o pedido existe (uma leitura só, pelo carregador da requisição)
+    pedido = await obter_pedido_resumo(pagamento_data.pedidoId)
+    if pedido is None:
         raise ValueError("Pedido não encontrado")
     
     # Valida se o valor bate com o total do pedido
-    total_pedido = await obter_total_pedido(pagamento_data.pedidoId)
+    total_pedido = pedido.get("total")
     if total_pedido is None:
         raise ValueError("Não foi possível obter o total do pedido")
     
@@ -50,15 +68,15 @@ async def criar_pagamento_pix(pagamento_data: PagamentoPixIn, usuario_id: str) -
         raise ValueError(f"Valor do pagamento ({pagamento_data.valor}) não confere com o total do pedido ({total_pedido})")
     
     # Gera próximo ID do pagamento
-    ultimo_pagamento = await pagamentos.find_one(sort=[("pagamentoId", -1)])
-    proximo_id = (ultimo_pagamento["pagamentoId"] + 1) if ultimo_pagamento else 1
+    proximo_id = await proximo_pagamento_id()
     
     agora = datetime.utcnow()
-    expira_em = int((agora + timedelta(minutes=30)).timestamp())  # Expira em 30 minutos
+    expira_em_data = agora + timedelta(minutes=PIX_EXPIRACAO_MINUTOS)
+    expira_em = int(expira_em_data.timestamp())
     
-    # Gera dados do PIX (mock)
+    # BR Code do PIX; o QR Code não é gravado, é renderizado (com cache) na leitura
     copia_e_cola = gerar_copia_e_cola(pagamento_data.pedidoId, pagamento_data.valor)
-    qrcode_base64 = gerar_qrcode_mock(copia_e_cola)
+    qrcode_base64 = await brcode_service.qrcode_data_url(copia_e_cola)
     
     # Cria o pagamento
     pagamento_doc = {
@@ -67,12 +85,18 @@ async def criar_pagamento_pix(pagamento_data: PagamentoPixIn, usuario_id: str) -
         "metodo": MetodoPagamento.PIX,
         "valor": pagamento_data.valor,
         "status": StatusPagamento.PENDENTE,
-        "qrcode": qrcode_base64,
         "copiaECola": copia_e_cola,
-        "criadoEm": agora
+        "criadoEm": agora,
+        "expiraEm": expira_em_data
     }
     
     await pagamentos.insert_one(pagamento_doc)
+    await eventos.publicar(eventos.PAGAMENTO_CRIADO, {
+        "pedidoId": pagamento_data.pedidoId,
+        "pagamentoId": proximo_id,
+        "metodo": MetodoPagamento.PIX.value,
+        "status": StatusPagamento.PENDENTE.value,
+    })
     
     return PagamentoPixOut(
         pedidoId=pagamento_data.pedidoId,
@@ -101,6 +125,12 @@ async def processar_webhook_pix(webhook_data: PagamentoWebhookIn) -> bool:
     
     if resultado.modified_count == 0:
         return False
+
+    await eventos.publicar(eventos.PAGAMENTO_ATUALIZADO, {
+        "pedidoId": webhook_data.pedidoId,
+        "metodo": MetodoPagamento.PIX.value,
+        "status": StatusPagamento(webhook_data.status).value,
+    })
     
     # Se o pagamento foi aprovado, atualiza o status do pedido
     if webhook_data.status == StatusPagamento.PAGO:
@@ -109,59 +139,176 @@ async def processar_webhook_pix(webhook_data: PagamentoWebhookIn) -> bool:
     
     return True
 
+async def _reservar_pagamento_cartao(db, pedido_id: int, valor: float, cartao_id: int) -> dict:
+    """Grava o pagamento 'pendente' com a chave de idempotência antes de chamar o adquirente"""
+    tentativa = await db.pagamentos.count_documents(
+        {"pedidoId": pedido_id, "metodo": MetodoPagamento.CARTAO.value}
+    ) + 1
+    pagamento_doc = {
+        "pagamentoId": await proximo_pagamento_id(),
+        "pedidoId": pedido_id,
+        "metodo": MetodoPagamento.CARTAO.value,
+        "valor": valor,
+        "status": StatusPagamento.PENDENTE.value,
+        "transacaoId": f"PED{pedido_id}-{tentativa}",
+        "cartaoId": cartao_id,
+        "criadoEm": datetime.utcnow()
+    }
+    try:
+        await db.pagamentos.insert_one(pagamento_doc)
+    except DuplicateKeyError:
+        # Requisição simultânea do mesmo pedido gravou a mesma tentativa
+        raise ValueError("Já existe um pagamento com cartão em andamento para este pedido")
+
+    await eventos.publicar(eventos.PAGAMENTO_CRIADO, {
+        "pedidoId": pedido_id,
+        "pagamentoId": pagamento_doc["pagamentoId"],
+        "metodo": MetodoPagamento.CARTAO.value,
+        "status": StatusPagamento.PENDENTE.value,
+    })
+    return pagamento_doc
+
+async def _aplicar_resultado_cartao(db, pagamento: dict, resultado: Optional[dict]) -> StatusPagamento:
+    """
+    Grava a resposta do adquirente no pagamento
+    - resultado None: o adquirente não conhece a transação (nunca chegou), vira expirado
+    - O adquirente manda: só um pagamento já 'pago' não é sobrescrito
+    - O pedido passa de pendente para em_preparacao só quando esta chamada gravou a aprovação
+    """
+    from app.services.pedido_service import atualizar_status_pedidos_lote
+    from app.schemas import StatusPedido
+
+    aprovado = bool(resultado and resultado["aprovado"])
+    status = StatusPagamento.PAGO if aprovado else StatusPagamento.EXPIRADO
+    atualizacao = {"status": status.value, "atualizadoEm": datetime.utcnow()}
+    if resultado:
+        atualizacao["mensagemGateway"] = resultado.get("mensagem", "")
+
+    gravado = await db.pagamentos.update_one(
+        {"_id": pagamento["_id"], "status": {"$in": [StatusPagamento.PENDENTE.value, StatusPagamento.EXPIRADO.value]}},
+        {"$set": atualizacao}
+    )
+    if gravado.modified_count:
+        await eventos.publicar(eventos.PAGAMENTO_ATUALIZADO, {
+            "pedidoId": pagamento["pedidoId"],
+            "pagamentoId": pagamento["pagamentoId"],
+            "metodo": MetodoPagamento.CARTAO.value,
+            "status": status.value,
+        })
+        if aprovado:
+            # Só quem gravou a aprovação move o pedido, e só se ainda estiver pendente
+            # (a atualização em lote é condicional ao status lido)
+            await atualizar_status_pedidos_lote([(pagamento["pedidoId"], StatusPedido.EM_PREPARACAO)])
+    return status
+
+async def _autorizar_cartao(pagamento: dict, cartao_id: int) -> Optional[dict]:
+    """
+    Autoriza no adquirente; se a resposta não vier, consulta pela mesma chave
+    - Retorna None se o resultado continua indeterminado (o pagamento fica pendente)
+    """
+    gateway = await gateway_pagamento.obter()
+    try:
+        return await gateway.autorizar(pagamento["transacaoId"], pagamento["pedidoId"], pagamento["valor"], cartao_id)
+    except gateway_pagamento.GatewayIndisponivel:
+        try:
+            return await gateway.consultar(pagamento["transacaoId"])
+        except gateway_pagamento.GatewayIndisponivel:
+            return None
+
 async def criar_pagamento_cartao(pagamento_data: PagamentoCartaoIn, usuario_id: str) -> PagamentoCartaoOut:
-    """Cria um pagamento via cartão (simulado)"""
-    from app.services.pedido_service import verificar_se_pedido_existe, obter_total_pedido
+    """
+    Cria um pagamento via cartão, autorizado pelo gateway configurado
+    - O pagamento é gravado 'pendente' com o transacaoId ("PED<pedidoId>-<tentativa>")
+      antes da chamada; o transacaoId é a chave de idempotência no adquirente
+    - Nova chamada com o mesmo cartão reusa a tentativa pendente (não cobra duas vezes)
+    - Lança GatewayIndisponivel se o resultado ficar indeterminado; o pagamento
+      continua pendente e é resolvido depois por resolver_pagamentos_cartao
+    """
+    from app.services.pedido_service import obter_pedido_resumo
     
     db = await get_database()
     pagamentos = db.pagamentos
     
-    # Valida se o pedido existe
-    if not await verificar_se_pedido_existe(pagamento_data.pedidoId):
+    # Valida se o pedido existe (uma leitura só, pelo carregador da requisição)
+    pedido = await obter_pedido_resumo(pagamento_data.pedidoId)
+    if pedido is None:
         raise ValueError("Pedido não encontrado")
     
     # Obtém o total do pedido
-    total_pedido = await obter_total_pedido(pagamento_data.pedidoId)
+    total_pedido = pedido.get("total")
     if total_pedido is None:
         raise ValueError("Não foi possível obter o total do pedido")
-    
-    # Gera próximo ID do pagamento
-    ultimo_pagamento = await pagamentos.find_one(sort=[("pagamentoId", -1)])
-    proximo_id = (ultimo_pagamento["pagamentoId"] + 1) if ultimo_pagamento else 1
-    
-    agora = datetime.utcnow()
-    
-    # Simula processamento do cartão (90% de aprovação)
-    import random
-    aprovado = random.random() < 0.9
-    status = StatusPagamento.PAGO if aprovado else StatusPagamento.EXPIRADO
-    transacao_id = str(uuid.uuid4())
-    
-    # Cria o pagamento
-    pagamento_doc = {
-        "pagamentoId": proximo_id,
+
+    if await pagamentos.find_one({"pedidoId": pagamento_data.pedidoId, "status": StatusPagamento.PAGO.value}, {"_id": 1}):
+        raise ValueError("Pedido já está pago")
+
+    pagamento = await pagamentos.find_one({
         "pedidoId": pagamento_data.pedidoId,
-        "metodo": MetodoPagamento.CARTAO,
-        "valor": total_pedido,
-        "status": status,
-        "transacaoId": transacao_id,
-        "criadoEm": agora
-    }
-    
-    await pagamentos.insert_one(pagamento_doc)
-    
-    # Se aprovado, atualiza status do pedido
-    if aprovado:
-        from app.services.pedido_service import atualizar_status_pedido
-        from app.schemas import StatusPedido
-        await atualizar_status_pedido(pagamento_data.pedidoId, StatusPedido.EM_PREPARACAO)
-    
+        "metodo": MetodoPagamento.CARTAO.value,
+        "status": StatusPagamento.PENDENTE.value
+    })
+    if pagamento is not None and pagamento.get("cartaoId") != pagamento_data.cartaoId:
+        # Outro cartão: a tentativa anterior precisa ser resolvida antes de abrir outra
+        if pagamento["criadoEm"] > datetime.utcnow() - timedelta(seconds=CARTAO_PENDENTE_SEGUNDOS):
+            raise ValueError("Já existe um pagamento com cartão em andamento para este pedido")
+        status_anterior = await _resolver_pagamento_cartao(db, pagamento)
+        if status_anterior is None:
+            raise gateway_pagamento.GatewayIndisponivel("Gateway de pagamento indisponível, tente novamente em instantes")
+        if status_anterior == StatusPagamento.PAGO:
+            raise ValueError("Pedido já está pago")
+        pagamento = None
+
+    if pagamento is None:
+        pagamento = await _reservar_pagamento_cartao(db, pagamento_data.pedidoId, total_pedido, pagamento_data.cartaoId)
+
+    resultado = await _autorizar_cartao(pagamento, pagamento_data.cartaoId)
+    if resultado is None:
+        metrics.incrementar("pagamentos.cartao.indeterminados")
+        raise gateway_pagamento.GatewayIndisponivel(
+            "Gateway de pagamento não respondeu; tente novamente (a cobrança não será duplicada)"
+        )
+    status = await _aplicar_resultado_cartao(db, pagamento, resultado)
+
     return PagamentoCartaoOut(
         pedidoId=pagamento_data.pedidoId,
         status=status,
-        transacaoId=transacao_id
+        transacaoId=pagamento["transacaoId"]
     )
 
+async def _resolver_pagamento_cartao(db, pagamento: dict) -> Optional[StatusPagamento]:
+    """Consulta o adquirente pela chave do pagamento pendente; None se não respondeu"""
+    gateway = await gateway_pagamento.obter()
+    try:
+        resultado = await gateway.consultar(pagamento["transacaoId"])
+    except gateway_pagamento.GatewayIndisponivel:
+        return None
+    return await _aplicar_resultado_cartao(db, pagamento, resultado)
+
+async def resolver_pagamentos_cartao() -> int:
+    """
+    Resolve os pagamentos com cartão que ficaram pendentes (tarefa periódica)
+    - Só os criados há mais de CARTAO_PENDENTE_SEGUNDOS (a requisição já desistiu)
+    - Consulta o adquirente pelo transacaoId; transação desconhecida vira expirada
+    - Para na primeira falha do gateway: o resto fica para a próxima rodada
+    """
+    db = await get_database()
+    limite = datetime.utcnow() - timedelta(seconds=CARTAO_PENDENTE_SEGUNDOS)
+    pendentes = await db.pagamentos.find({
+        "status": StatusPagamento.PENDENTE.value,
+        "metodo": MetodoPagamento.CARTAO.value,
+        "criadoEm": {"$lte": limite}
+    }).sort("criadoEm", 1).limit(CARTAO_RESOLUCAO_LOTE).to_list(CARTAO_RESOLUCAO_LOTE)
+
+    resolvidos = 0
+    for pagamento in pendentes:
+        if await _resolver_pagamento_cartao(db, pagamento) is None:
+            break
+        resolvidos += 1
+    if resolvidos:
+        metrics.incrementar("pagamentos.cartao.resolvidos", resolvidos)
+        logger.info(f"{resolvidos} pagamentos com cartão pendentes resolvidos no gateway")
+    return resolvidos
+
 async def obter_pagamento_por_pedido(pedido_id: int) -> Optional[PagamentoOut]:
     """Obtém informações de pagamento de um pedido"""
     db = await get_database()
@@ -170,52 +317,92 @@ async def obter_pagamento_por_pedido(pedido_id: int) -> Optional[PagamentoOut]:
     pagamento = await pagamentos.find_one({"pedidoId": pedido_id})
     if not pagamento:
         return None
-    
-    return PagamentoOut(**pagamento_helper(pagamento))
+
+    dados = pagamento_helper(pagamento)
+    if dados["copiaECola"] and not dados["qrcode"]:
+        dados["qrcode"] = await brcode_service.qrcode_data_url(dados["copiaECola"])
+    return PagamentoOut(**dados)
 
 
 # FUNÇÕES AUXILIARES
 def gerar_copia_e_cola(pedido_id: int, valor: float) -> str:
-    """Gera um código PIX copia e cola (mock)"""
-    # Em uma implementação real, isso seria feito por um provedor PIX
-    # Aqui estamos simulando o formato básico
-    timestamp = int(datetime.utcnow().timestamp())
-    
-    # Simula um código PIX básico (formato simplificado)
-    copia_e_cola = f"00020126580014br.gov.bcb.pix0136{pedido_id}520400005303986540{valor:.2f}5802BR5913Kaiserhaus6009SAO PAULO62070503***6304"
-    
-    # Adiciona checksum (simulado)
-    checksum = str(hash(copia_e_cola) % 10000).zfill(4)
-    copia_e_cola += checksum
-    
-    return copia_e_cola
-
-def gerar_qrcode_mock(copia_e_cola: str) -> str:
-    """Gera um QR Code mock em base64"""
-    # Em uma implementação real, isso seria feito por uma biblioteca como qrcode
-    # Aqui estamos simulando um QR Code simples
-    
-    # Cria um QR Code mock (imagem 200x200 pixels simples)
-    # Em produção, usar: qrcode.make(copia_e_cola)
-    
-    # Simula uma imagem PNG simples (1x1 pixel branco)
-    # Em produção, usar a biblioteca qrcode para gerar o QR Code real
-    qr_mock = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS\xde\x00\x00\x00\tpHYs\x00\x00\x0b\x13\x00\x00\x0b\x13\x01\x00\x9a\x9c\x18\x00\x00\x00\nIDATx\x9cc\xf8\x00\x00\x00\x01\x00\x01\x00\x00\x00\x00IEND\xaeB`\x82'
-    
-    return f"data:image/png;base64,{base64.b64encode(qr_mock).decode()}"
+    """Gera o código PIX copia e cola (BR Code com CRC16)"""
+    return brcode_service.payload_pedido(pedido_id, valor)
 
 async def verificar_pagamento_pendente(pedido_id: int) -> bool:
     """Verifica se existe um pagamento pendente para o pedido"""
     db = await get_database()
     pagamentos = db.pagamentos
     
+    # Vencido mas ainda não varrido também não conta como pendente
     pagamento = await pagamentos.find_one({
         "pedidoId": pedido_id,
-        "status": StatusPagamento.PENDENTE
+        "status": StatusPagamento.PENDENTE,
+        "$or": [{"expiraEm": {"$gt": datetime.utcnow()}}, {"expiraEm": {"$exists": False}}]
     })
     
     return pagamento is not None
 
+async def expirar_pagamentos_pix() -> int:
+    """
+    Marca como expirados os PIX pendentes com expiraEm vencido (tarefa periódica)
+    - Lotes de até PIX_EXPIRACAO_LOTE: um find no índice (status, expiraEm) e um update_many
+    - O filtro do update repete status pendente: um webhook 'pago' que chegou no meio prevalece
+    - Pagamentos antigos sem expiraEm recebem criadoEm + validade antes da varredura
+    """
+    db = await get_database()
+    pagamentos = db.pagamentos
+    inicio = time.perf_counter()
+    # Truncado em milissegundos (precisão do BSON) para reconhecer os gravados por esta varredura
+    agora = datetime.utcnow()
+    agora = agora.replace(microsecond=agora.microsecond // 1000 * 1000)
+
+    await pagamentos.update_many(
+        {"status": StatusPagamento.PENDENTE.value, "expiraEm": {"$exists": False}, "metodo": MetodoPagamento.PIX.value},
+        [{"$set": {"expiraEm": {"$add": ["$criadoEm", PIX_EXPIRACAO_MINUTOS * 60 * 1000]}}}]
+    )
+
+    total = 0
+    while True:
+        lote = await pagamentos.find(
+            {"status": StatusPagamento.PENDENTE.value, "expiraEm": {"$lte": agora}},
+            {"_id": 1, "pedidoId": 1, "pagamentoId": 1}
+        ).sort("expiraEm", 1).limit(PIX_EXPIRACAO_LOTE).to_list(PIX_EXPIRACAO_LOTE)
+        if not lote:
+            break
+
+        resultado = await pagamentos.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in lote]}, "status": StatusPagamento.PENDENTE.value},
+            {"$set": {"status": StatusPagamento.EXPIRADO.value, "atualizadoEm": agora}}
+        )
+        total += resultado.modified_count
+
+        # Relê só se algum mudou no meio (ex.: pago); no caso comum todos expiraram
+        expirados = lote
+        if resultado.modified_count != len(lote):
+            expirados = await pagamentos.find(
+                {"_id": {"$in": [doc["_id"] for doc in lote]}, "status": StatusPagamento.EXPIRADO.value, "atualizadoEm": agora},
+                {"pedidoId": 1, "pagamentoId": 1}
+            ).to_list(None)
+        for doc in expirados:
+            await eventos.publicar(eventos.PAGAMENTO_ATUALIZADO, {
+                "pedidoId": doc["pedidoId"],
+                "pagamentoId": doc.get("pagamentoId"),
+                "metodo": MetodoPagamento.PIX.value,
+                "status": StatusPagamento.EXPIRADO.value,
+            })
+
+        if len(lote) < PIX_EXPIRACAO_LOTE:
+            break
+
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    metrics.observar("pix.expiracao.duracao_ms", duracao_ms)
+    metrics.definir("pix.expiracao.ultima_duracao_ms", duracao_ms)
+    if total:
+        metrics.incrementar("pix.expirados", total)
+        logger.info(f"{total} pagamentos PIX expirados em {duracao_ms:.0f} ms")
+    return total
+
 async def cancelar_pagamentos_pendentes(pedido_id: int) -> bool:
     """Cancela pagamentos pendentes de um pedido"""
     db = await get_database()
@@ -233,5 +420,11 @@ async def cancelar_pagamentos_pendentes(pedido_id: int) -> bool:
             }
         }
     )
+
+    if resultado.modified_count > 0:
+        await eventos.publicar(eventos.PAGAMENTO_ATUALIZADO, {
+            "pedidoId": pedido_id,
+            "status": StatusPagamento.EXPIRADO.value,
+        })
     
     return resultado.modified_count > 0
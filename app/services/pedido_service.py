@@ -1,13 +1,50 @@
 from app.database import get_database
 from app.schemas import (
     PedidoCheckoutIn, PedidoCheckoutOut, PedidoDetalhadoOut, 
-    ItemPedidoOut, StatusPedido, TipoEntrega, MetodoPagamento
+    ItemPedidoOut, StatusPedido, TipoEntrega, MetodoPagamento, UsuarioOut
 )
 from bson import ObjectId
 from datetime import datetime
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
+from app import metrics
+from app.services.imagem_service import url_imagem, normalizar_referencia, eh_hash, eh_data_url, PREFIXO_URL
+from app.services.sequencia_service import proximo_pedido_id
+from app.services import pedido_stats_service, brcode_service, catalogo_cache
+from app.services.arquivo_pedidos_service import COLECAO_ARQUIVO
+from app import eventos, loaders, tarefas
+from app.paginacao import paginar, codificar_cursor, PROXIMA, ANTERIOR
+from pymongo import ReturnDocument, UpdateOne
+import logging
 import math
 
+logger = logging.getLogger(__name__)
+
+# Hierarquias que podem ver pedidos de outros usuários
+HIERARQUIAS_EQUIPE = ("funcionario", "admin", "colaborador")
+
+# Migração das imagens dos itens dos pedidos: uma execução por vez no cluster
+LEASE_MIGRACAO_IMAGENS = "migracao:imagens-pedidos"
+LEASE_MIGRACAO_IMAGENS_DURACAO = 300
+
+# Transições de status aceitas na atualização em lote (cozinha/equipe)
+TRANSICOES_PERMITIDAS = {
+    StatusPedido.PENDENTE: {StatusPedido.EM_PREPARACAO},
+    StatusPedido.EM_PREPARACAO: {StatusPedido.SAIU_PARA_ENTREGA, StatusPedido.CONCLUIDO},
+    StatusPedido.SAIU_PARA_ENTREGA: {StatusPedido.CONCLUIDO},
+    StatusPedido.CONCLUIDO: set(),
+}
+
+# Visões das listagens de pedidos (view=summary|full)
+# summary deixa de fora imagens e o subdocumento 'produto' de cada item
+VISOES_PEDIDO = {
+    "summary": (
+        "pedidoId", "usuarioId", "status", "total", "metodoPagamento", "criadoEm", "atualizadoEm",
+        "itens.id", "itens.produtoId", "itens.quantidade", "itens.observacoes",
+        "itens.precoUnitario", "itens.precoTotal", "itens.nomeProduto",
+    ),
+    "full": None,
+}
+
 
 def resolver_produto_id(produto_id: Union[str, int]) -> dict:
     """
@@ -52,6 +89,31 @@ def item_pedido_helper(item) -> dict:
         }
     return None
 
+async def referencia_imagem_item(imagem: Optional[str]) -> Optional[str]:
+    """
+    Referência imutável da imagem guardada no item do pedido (hash ou URL externa)
+    - Produto ainda com data URL: a imagem vai para o armazenamento e o item guarda o hash
+    """
+    try:
+        return await normalizar_referencia(imagem)
+    except ValueError:
+        return None
+
+def item_pedido_out(item: dict) -> ItemPedidoOut:
+    """
+    Monta o item para a resposta resolvendo a referência da imagem em URL
+    - Itens antigos podem ter a imagem em produto.imagem; é usada se não houver imagemProduto
+    """
+    item = dict(item)
+    produto = dict(item["produto"]) if item.get("produto") else None
+    imagem = url_imagem(item.get("imagemProduto")) or (produto or {}).get("imagem")
+    if "imagemProduto" in item:
+        item["imagemProduto"] = imagem
+    if produto is not None:
+        produto["imagem"] = imagem
+        item["produto"] = produto
+    return ItemPedidoOut(**item)
+
 def endereco_helper(endereco) -> dict:
     if endereco:
         return {
@@ -81,28 +143,89 @@ def pagamento_helper(pagamento) -> dict:
     return None
 
 
-async def validar_produtos_existentes(produto_ids: List[Union[str, int]]) -> bool:
-    """Valida se todos os produtos existem e estão ativos"""
-    db = await get_database()
-    produtos = db.produtos
-    
-    for produto_id in produto_ids:
+async def carregar_produtos(produto_ids: List[Union[str, int]]) -> Dict[Union[str, int], dict]:
+    """
+    Carrega em lote os produtos ativos do checkout (pelos carregadores da requisição)
+    - Uma consulta $in para os ObjectIds e outra para os produtoId numéricos
+    - Retorna um dicionário indexado pelo ID recebido (produtos ausentes ficam de fora)
+    """
+    object_ids = {}
+    ids_numericos = set()
+    for produto_id in set(produto_ids):
         query = resolver_produto_id(produto_id)
-        produto = await produtos.find_one(query)
-        if not produto:
-            return False
-    return True
+        if "_id" in query:
+            object_ids[produto_id] = query["_id"]
+        else:
+            ids_numericos.add(produto_id)
+
+    encontrados: Dict[Union[str, int], dict] = {}
+
+    if object_ids:
+        metrics.incrementar("checkout.produtos.consultas")
+        por_object_id = await loaders.carregador("produtos").carregar_varios(object_ids.values())
+        for produto_id, object_id in object_ids.items():
+            if object_id in por_object_id:
+                encontrados[produto_id] = por_object_id[object_id]
+
+    if ids_numericos:
+        metrics.incrementar("checkout.produtos.consultas")
+        encontrados.update(await loaders.carregador("produtos_por_produtoId").carregar_varios(ids_numericos))
+
+    await normalizar_imagens_produtos(encontrados.values())
+    metrics.incrementar("checkout.produtos.carregamentos")
+    return encontrados
+
+async def normalizar_imagens_produtos(produtos) -> None:
+    """
+    Produto ainda com a imagem em data URL: grava a imagem no armazenamento e o
+    produto passa a guardar o hash (na primeira vez que aparece no checkout)
+    - Atualiza o documento carregado, então os próximos passos já veem o hash
+    - update_one condicionado à imagem lida, para não sobrescrever uma edição
+    """
+    referencias: Dict[str, str] = {}
+    normalizados = 0
+    for produto in produtos:
+        imagem = produto.get("imagem")
+        if not eh_data_url(imagem):
+            continue
+        if imagem not in referencias:
+            try:
+                referencias[imagem] = await normalizar_referencia(imagem)
+            except ValueError:
+                # Imagem corrompida: fica como está (referencia_imagem_item devolve None)
+                continue
+        db = await get_database()
+        await db.produtos.update_one({"_id": produto["_id"], "imagem": imagem}, {"$set": {"imagem": referencias[imagem]}})
+        produto["imagem"] = referencias[imagem]
+        normalizados += 1
+
+    if normalizados:
+        metrics.incrementar("produtos.imagens_normalizadas", normalizados)
+        await catalogo_cache.invalidar("produtos")
+
+async def validar_produtos_existentes(
+    produto_ids: List[Union[str, int]],
+    produtos_carregados: Optional[Dict[Union[str, int], dict]] = None
+) -> bool:
+    """Valida se todos os produtos existem e estão ativos"""
+    if produtos_carregados is None:
+        produtos_carregados = await carregar_produtos(produto_ids)
+
+    return all(produto_id in produtos_carregados for produto_id in produto_ids)
 
-async def calcular_totais(itens: List[dict], tipo_entrega: str) -> dict:
+async def calcular_totais(
+    itens: List[dict],
+    tipo_entrega: str,
+    produtos_carregados: Optional[Dict[Union[str, int], dict]] = None
+) -> dict:
     """Calcula total de produtos, taxa de entrega e total final"""
-    db = await get_database()
-    produtos = db.produtos
+    if produtos_carregados is None:
+        produtos_carregados = await carregar_produtos([item["produtoId"] for item in itens])
     
     total_produtos = 0.0
     
     for item in itens:
-        query = resolver_produto_id(item["produtoId"])
-        produto = await produtos.find_one(query)
+        produto = produtos_carregados.get(item["produtoId"])
         
         if not produto:
             raise ValueError(f"Produto {item['produtoId']} não encontrado ou inativo")
@@ -144,20 +267,20 @@ async def criar_pedido(pedido_data: PedidoCheckoutIn, usuario_id: str) -> Pedido
             raise ValueError("Quantidade deve ser maior que 0")
     
     produto_ids = [item.produtoId for item in pedido_data.itens]
-    if not await validar_produtos_existentes(produto_ids):
+    produtos_carregados = await carregar_produtos(produto_ids)
+    if not await validar_produtos_existentes(produto_ids, produtos_carregados):
         raise ValueError("Um ou mais produtos não existem ou estão inativos")
     
     itens_dict = [item.dict() for item in pedido_data.itens]
-    totais = await calcular_totais(itens_dict, pedido_data.entrega.tipo)
+    totais = await calcular_totais(itens_dict, pedido_data.entrega.tipo, produtos_carregados)
     
-    ultimo_pedido = await pedidos.find_one(sort=[("pedidoId", -1)])
-    proximo_id = (ultimo_pedido["pedidoId"] + 1) if ultimo_pedido else 1
+    proximo_id = await proximo_pedido_id()
     
     agora = datetime.utcnow()
     
     itens_com_id = []
     for i, item in enumerate(totais["itens"]):
-        produto = await db.produtos.find_one(resolver_produto_id(item["produtoId"]))
+        produto = produtos_carregados.get(item["produtoId"])
         
         item_com_id = {
             "id": f"item_{proximo_id}_{i}",
@@ -167,11 +290,10 @@ async def criar_pedido(pedido_data: PedidoCheckoutIn, usuario_id: str) -> Pedido
             "precoUnitario": item["precoUnitario"],
             "precoTotal": item["precoTotal"],
             "nomeProduto": item["nomeProduto"],
-            "imagemProduto": item.get("imagemProduto"),
+            "imagemProduto": await referencia_imagem_item(item.get("imagemProduto")),
             "produto": {
                 "nome": produto["titulo"] if produto else "Produto não encontrado",
                 "preco": produto["preco"] if produto else 0.0,
-                "imagem": produto.get("imagem") if produto else None,
                 "categoria": produto.get("categoria_id") if produto else None
             }
         }
@@ -191,6 +313,7 @@ async def criar_pedido(pedido_data: PedidoCheckoutIn, usuario_id: str) -> Pedido
     
     resultado_pedido = await pedidos.insert_one(pedido_doc)
     pedido_id = resultado_pedido.inserted_id
+    await pedido_stats_service.registrar_criacao(StatusPedido.PENDENTE)
     
     endereco_doc = {
         "pedidoId": proximo_id,
@@ -203,7 +326,15 @@ async def criar_pedido(pedido_data: PedidoCheckoutIn, usuario_id: str) -> Pedido
         "complemento": pedido_data.entrega.endereco.complemento
     }
     await enderecos.insert_one(endereco_doc)
-    itens_response = [ItemPedidoOut(**item) for item in itens_com_id]
+    await eventos.publicar(eventos.PEDIDO_CRIADO, {
+        "pedidoId": proximo_id,
+        "usuarioId": usuario_id,
+        "status": StatusPedido.PENDENTE.value,
+        "total": totais["total"],
+        "metodoPagamento": pedido_data.pagamento.metodo.value,
+        "criadoEm": agora,
+    })
+    itens_response = [item_pedido_out(item) for item in itens_com_id]
     
     return PedidoCheckoutOut(
         pedidoId=proximo_id,
@@ -216,48 +347,54 @@ async def criar_pedido(pedido_data: PedidoCheckoutIn, usuario_id: str) -> Pedido
         atualizadoEm=agora
     )
 
-async def obter_pedido_por_id(pedido_id: int, usuario_id: str) -> Optional[PedidoDetalhadoOut]:
+def pipeline_pedido_detalhado(pedido_id: int) -> list:
+    """Pedido + endereço + pagamento em uma única agregação"""
+    return [
+        {"$match": {"pedidoId": pedido_id}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "enderecos",
+            "localField": "pedidoId",
+            "foreignField": "pedidoId",
+            "pipeline": [{"$limit": 1}],
+            "as": "endereco",
+        }},
+        {"$lookup": {
+            "from": "pagamentos",
+            "localField": "pedidoId",
+            "foreignField": "pedidoId",
+            "pipeline": [{"$limit": 1}],
+            "as": "pagamento",
+        }},
+    ]
+
+async def obter_pedido_por_id(pedido_id: int, usuario: UsuarioOut) -> Optional[PedidoDetalhadoOut]:
     """Obtém um pedido específico (dono, funcionário ou admin podem ver)"""
     db = await get_database()
     pedidos = db.pedidos
-    enderecos = db.enderecos
-    pagamentos = db.pagamentos
-    
-    print(f"DEBUG: Buscando pedido {pedido_id} para usuário {usuario_id}")
-    
-    pedido = await pedidos.find_one({"pedidoId": pedido_id})
-    if not pedido:
-        print(f"DEBUG: Pedido {pedido_id} não encontrado no banco de dados")
-        # Vamos verificar quantos pedidos existem no total
-        total_pedidos = await pedidos.count_documents({})
-        print(f"DEBUG: Total de pedidos no banco: {total_pedidos}")
-        return None
-    
-    print(f"DEBUG: Pedido {pedido_id} encontrado, dono: {pedido['usuarioId']}")
-    
-    # Verificar se o usuário é o dono do pedido ou se é funcionário/admin
-    usuario = await db.usuarios.find_one({"_id": ObjectId(usuario_id)})
-    if not usuario:
-        print(f"DEBUG: Usuário {usuario_id} não encontrado")
-        raise PermissionError("Usuário não encontrado")
     
-    user_hierarchy = usuario.get("hierarquia", "usuario")
-    print(f"DEBUG: Usuário {usuario_id} tem hierarquia: {user_hierarchy}")
+    resultado = await pedidos.aggregate(pipeline_pedido_detalhado(pedido_id)).to_list(1)
+    if resultado:
+        pedido = resultado[0]
+    else:
+        # Pedido antigo: está no arquivo, com endereço e pagamento embutidos
+        pedido = await db[COLECAO_ARQUIVO].find_one({"pedidoId": pedido_id})
+        if not pedido:
+            return None
+        pedido["endereco"] = [pedido["endereco"]] if pedido.get("endereco") else []
+        pedido["pagamento"] = [pedido["pagamento"]] if pedido.get("pagamento") else []
     
     # Permitir acesso se for o dono do pedido, funcionário ou admin
-    if pedido["usuarioId"] != usuario_id and user_hierarchy not in ["funcionario", "admin", "colaborador"]:
-        print(f"DEBUG: Acesso negado - usuário {usuario_id} não é dono nem funcionário/admin")
+    if pedido["usuarioId"] != usuario.id and usuario.hierarquia not in HIERARQUIAS_EQUIPE:
         raise PermissionError("Você não tem permissão para ver este pedido")
     
-    print(f"DEBUG: Acesso permitido para usuário {usuario_id}")
-    
-    itens = [ItemPedidoOut(**item) for item in pedido.get("itens", [])]
+    itens = [item_pedido_out(item) for item in pedido.get("itens", [])]
     
-    endereco_doc = await enderecos.find_one({"pedidoId": pedido_id})
-    endereco = endereco_helper(endereco_doc) if endereco_doc else None
-    
-    pagamento_doc = await pagamentos.find_one({"pedidoId": pedido_id})
-    pagamento = pagamento_helper(pagamento_doc) if pagamento_doc else None
+    endereco = endereco_helper(pedido["endereco"][0]) if pedido["endereco"] else None
+    pagamento = pagamento_helper(pedido["pagamento"][0]) if pedido["pagamento"] else None
+    if pagamento and pagamento["copiaECola"] and not pagamento["qrcode"]:
+        # QR Code do PIX não é gravado: vem do cache de renderização
+        pagamento["qrcode"] = await brcode_service.qrcode_data_url(pagamento["copiaECola"])
     
     return PedidoDetalhadoOut(
         id=pedido["pedidoId"],
@@ -273,22 +410,51 @@ async def obter_pedido_por_id(pedido_id: int, usuario_id: str) -> Optional[Pedid
         pagamento=pagamento
     )
 
-async def listar_pedidos_usuario(usuario_id: str, page: int = 1, page_size: int = 10) -> dict:
-    """Lista pedidos de um usuário com paginação"""
+async def _pagina_pedidos(
+    filtro: dict,
+    page: int,
+    page_size: int,
+    projecao: Optional[dict],
+    cursor: Optional[str]
+) -> tuple[list[dict], Optional[str], Optional[str]]:
+    """
+    Lê uma página de pedidos (mais recentes primeiro)
+    - cursor (ou primeira página): keyset em (criadoEm, _id) sobre pedidos + arquivo, custo constante
+    - page > 1 sem cursor: skip(), mantido só por compatibilidade (deprecated; só pedidos recentes)
+    """
+    db = await get_database()
+    if cursor or page == 1:
+        return await paginar([db.pedidos, db[COLECAO_ARQUIVO]], filtro, cursor, page_size, projecao)
+
+    docs = await db.pedidos.find(filtro, projecao).sort(
+        [("criadoEm", -1), ("_id", -1)]
+    ).skip((page - 1) * page_size).limit(page_size).to_list(length=page_size)
+    if not docs:
+        return docs, None, None
+    proximo = codificar_cursor(docs[-1], PROXIMA) if len(docs) == page_size else None
+    return docs, proximo, codificar_cursor(docs[0], ANTERIOR)
+
+async def listar_pedidos_usuario(
+    usuario_id: str,
+    page: int = 1,
+    page_size: int = 10,
+    projecao: Optional[dict] = None,
+    cursor: Optional[str] = None,
+    incluir_total: Optional[bool] = None
+) -> dict:
+    """
+    Lista pedidos de um usuário com paginação por cursor
+    - incluir_total: conta os pedidos do usuário; por padrão só na primeira página
+    """
     db = await get_database()
     pedidos = db.pedidos
-    
-    skip = (page - 1) * page_size
-    
-    pedidos_cursor = pedidos.find(
-        {"usuarioId": usuario_id}
-    ).sort("criadoEm", -1).skip(skip).limit(page_size)
-    
+    filtro = {"usuarioId": usuario_id}
+
+    docs, proximo, anterior = await _pagina_pedidos(filtro, page, page_size, projecao, cursor)
+
     pedidos_lista = []
-    total_pedidos = await pedidos.count_documents({"usuarioId": usuario_id})
-    
-    async for pedido in pedidos_cursor:
-        itens = [ItemPedidoOut(**item) for item in pedido.get("itens", [])]
+    for pedido in docs:
+        itens = [item_pedido_out(item) for item in pedido.get("itens", [])]
         
         pedidos_lista.append({
             "id": pedido["pedidoId"],
@@ -298,15 +464,21 @@ async def listar_pedidos_usuario(usuario_id: str, page: int = 1, page_size: int
             "criadoEm": pedido["criadoEm"],
             "itens": itens
         })
-    
-    total_pages = math.ceil(total_pedidos / page_size)
+
+    if incluir_total is None:
+        incluir_total = not cursor
+    total_pedidos = None
+    if incluir_total:
+        total_pedidos = await pedidos.count_documents(filtro) + await db[COLECAO_ARQUIVO].count_documents(filtro)
     
     return {
         "pedidos": pedidos_lista,
         "total": total_pedidos,
-        "page": page,
+        "page": None if cursor else page,
         "pageSize": page_size,
-        "totalPages": total_pages
+        "totalPages": math.ceil(total_pedidos / page_size) if total_pedidos is not None else None,
+        "proximoCursor": proximo,
+        "cursorAnterior": anterior
     }
 
 async def atualizar_status_pedido(pedido_id: int, novo_status: StatusPedido) -> bool:
@@ -314,46 +486,163 @@ async def atualizar_status_pedido(pedido_id: int, novo_status: StatusPedido) ->
     db = await get_database()
     pedidos = db.pedidos
     
-    resultado = await pedidos.update_one(
+    # BEFORE devolve o status anterior para mover o pedido entre os contadores
+    anterior = await pedidos.find_one_and_update(
         {"pedidoId": pedido_id},
         {
             "$set": {
                 "status": novo_status,
                 "atualizadoEm": datetime.utcnow()
             }
-        }
+        },
+        projection={"status": 1},
+        return_document=ReturnDocument.BEFORE
     )
-    
-    return resultado.modified_count > 0
+    if anterior is None:
+        return False
+
+    loaders.invalidar("pedidos", pedido_id)
+    await pedido_stats_service.registrar_transicao(anterior["status"], novo_status)
+    await eventos.publicar(eventos.PEDIDO_STATUS_ALTERADO, {
+        "pedidoId": pedido_id,
+        "status": StatusPedido(novo_status).value,
+        "statusAnterior": anterior["status"],
+    })
+    return True
+
+def _status_conhecido(status) -> Optional[StatusPedido]:
+    """StatusPedido do valor gravado; None para status antigo fora do enum"""
+    try:
+        return StatusPedido(status)
+    except ValueError:
+        logger.warning(f"Pedido com status desconhecido: {status!r}")
+        return None
+
+async def atualizar_status_pedidos_lote(atualizacoes: List[tuple[int, StatusPedido]]) -> List[dict]:
+    """
+    Atualiza o status de vários pedidos com um único bulk_write
+    - Cada update só casa se o pedido ainda estiver no status lido (filtro condicional),
+      então uma mudança concorrente vira 'conflito' em vez de ser sobrescrita
+    - Transições fora de TRANSICOES_PERMITIDAS viram 'transicao_invalida', assim como
+      pedidos com status antigo que não existe mais no enum (status None no resultado)
+    - Retorna um resultado por pedido, na ordem recebida
+    """
+    ids = [pedido_id for pedido_id, _ in atualizacoes]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Cada pedido pode aparecer apenas uma vez no lote")
 
-async def verificar_se_pedido_existe(pedido_id: int) -> bool:
-    """Verifica se um pedido existe"""
     db = await get_database()
     pedidos = db.pedidos
-    
-    pedido = await pedidos.find_one({"pedidoId": pedido_id})
-    return pedido is not None
+
+    atuais: Dict[int, Optional[StatusPedido]] = {}
+    desconhecidos: Dict[int, str] = {}
+    for pedido_id, doc in (await loaders.carregador("pedidos").carregar_varios(ids)).items():
+        atuais[pedido_id] = _status_conhecido(doc["status"])
+        if atuais[pedido_id] is None:
+            desconhecidos[pedido_id] = doc["status"]
+
+    agora = datetime.utcnow()
+    # Marca única deste lote: a releitura reconhece só os updates que ele aplicou
+    lote = ObjectId()
+    resultados: Dict[int, dict] = {}
+    operacoes = []
+    ids_operacoes = []
+    for pedido_id, novo_status in atualizacoes:
+        atual = atuais.get(pedido_id)
+        if pedido_id in desconhecidos:
+            resultados[pedido_id] = {
+                "pedidoId": pedido_id,
+                "resultado": "transicao_invalida",
+                "detalhe": f"Status atual desconhecido: {desconhecidos[pedido_id]!r}",
+            }
+        elif atual is None:
+            resultados[pedido_id] = {"pedidoId": pedido_id, "resultado": "nao_encontrado"}
+        elif atual == novo_status:
+            resultados[pedido_id] = {"pedidoId": pedido_id, "resultado": "inalterado", "status": atual}
+        elif novo_status not in TRANSICOES_PERMITIDAS[atual]:
+            resultados[pedido_id] = {
+                "pedidoId": pedido_id,
+                "resultado": "transicao_invalida",
+                "status": atual,
+                "detalhe": f"Não é possível passar de {atual.value} para {novo_status.value}",
+            }
+        else:
+            operacoes.append(UpdateOne(
+                {"pedidoId": pedido_id, "status": atual},
+                {"$set": {"status": novo_status, "atualizadoEm": agora, "ultimoLoteStatus": lote}}
+            ))
+            ids_operacoes.append(pedido_id)
+
+    aplicados = []
+    if operacoes:
+        resultado_bulk = await pedidos.bulk_write(operacoes, ordered=False)
+
+        if resultado_bulk.modified_count == len(operacoes):
+            aplicados = ids_operacoes
+        else:
+            # Descobre quais updates casaram: só eles têm a marca deste lote
+            async for doc in pedidos.find({"pedidoId": {"$in": ids_operacoes}}, {"pedidoId": 1, "status": 1, "ultimoLoteStatus": 1}):
+                if doc.get("ultimoLoteStatus") == lote:
+                    aplicados.append(doc["pedidoId"])
+                else:
+                    resultados[doc["pedidoId"]] = {
+                        "pedidoId": doc["pedidoId"],
+                        "resultado": "conflito",
+                        "status": _status_conhecido(doc["status"]),
+                        "detalhe": "O status do pedido mudou durante a atualização",
+                    }
+
+    novos = dict(atualizacoes)
+    for pedido_id in ids_operacoes:
+        loaders.invalidar("pedidos", pedido_id)
+    for pedido_id in aplicados:
+        resultados[pedido_id] = {"pedidoId": pedido_id, "resultado": "atualizado", "status": novos[pedido_id]}
+
+    await pedido_stats_service.registrar_transicoes([(atuais[pedido_id], novos[pedido_id]) for pedido_id in aplicados])
+    for pedido_id in aplicados:
+        await eventos.publicar(eventos.PEDIDO_STATUS_ALTERADO, {
+            "pedidoId": pedido_id,
+            "status": novos[pedido_id].value,
+            "statusAnterior": atuais[pedido_id].value,
+        })
+
+    # Pedido removido entre a leitura e o bulk_write não aparece na releitura
+    return [resultados.get(pedido_id, {"pedidoId": pedido_id, "resultado": "nao_encontrado"}) for pedido_id in ids]
+
+async def obter_pedido_resumo(pedido_id: int) -> Optional[dict]:
+    """
+    Campos básicos do pedido (pedidoId, usuarioId, status, total, metodoPagamento)
+    - Lido pelo carregador da requisição: os services compartilham uma única leitura
+    """
+    return await loaders.carregador("pedidos").carregar(pedido_id)
+
+async def verificar_se_pedido_existe(pedido_id: int) -> bool:
+    """Verifica se um pedido existe"""
+    return await obter_pedido_resumo(pedido_id) is not None
 
 async def obter_total_pedido(pedido_id: int) -> Optional[float]:
     """Obtém o total de um pedido"""
-    db = await get_database()
-    pedidos = db.pedidos
-    
-    pedido = await pedidos.find_one({"pedidoId": pedido_id})
+    pedido = await obter_pedido_resumo(pedido_id)
     return pedido["total"] if pedido else None
 
-async def listar_todos_pedidos_admin(page: int = 1, page_size: int = 10) -> list[dict]:
-    """Lista todos os pedidos do sistema (apenas para admin)"""
+async def listar_todos_pedidos_admin(
+    page: int = 1,
+    page_size: int = 10,
+    projecao: Optional[dict] = None,
+    cursor: Optional[str] = None
+) -> dict:
+    """
+    Lista todos os pedidos do sistema (apenas para admin) com paginação por cursor
+    - totalEstimado vem dos metadados da coleção (não conta documentos)
+    """
     db = await get_database()
     pedidos = db.pedidos
     
-    offset = (page - 1) * page_size
-    
-    pedidos_cursor = pedidos.find().sort("criadoEm", -1).skip(offset).limit(page_size)
+    docs, proximo, anterior = await _pagina_pedidos({}, page, page_size, projecao, cursor)
     
     pedidos_lista = []
-    async for pedido in pedidos_cursor:
-        itens = [ItemPedidoOut(**item) for item in pedido.get("itens", [])]
+    for pedido in docs:
+        itens = [item_pedido_out(item) for item in pedido.get("itens", [])]
 
         pedidos_lista.append({
             "id": pedido["pedidoId"],
@@ -366,24 +655,82 @@ async def listar_todos_pedidos_admin(page: int = 1, page_size: int = 10) -> list
             "itens": itens
         })
     
-    return pedidos_lista
+    return {
+        "pedidos": pedidos_lista,
+        "proximoCursor": proximo,
+        "cursorAnterior": anterior,
+        "totalEstimado": await pedidos.estimated_document_count() + await db[COLECAO_ARQUIVO].estimated_document_count()
+    }
 
-async def obter_contadores_pedidos() -> dict:
-    """Retorna contadores de pedidos por status"""
+async def migrar_imagens_pedidos(tamanho_lote: int = 100) -> int:
+    """
+    Troca as imagens copiadas nos itens dos pedidos antigos por referências
+    - data URL em imagemProduto: vai para o armazenamento de imagens, o item guarda o hash
+    - /images/<hash>: vira só o hash
+    - produto.imagem (cópia duplicada) é removido
+    - Percorre em lotes por _id; cada lote é gravado com um bulk_write
+    - Uma execução por vez (lease renovado a cada lote); se outra estiver rodando, retorna 0
+    """
+    if not await tarefas.adquirir_lease(LEASE_MIGRACAO_IMAGENS, LEASE_MIGRACAO_IMAGENS_DURACAO):
+        logger.info("Migração das imagens dos pedidos já em andamento em outro processo")
+        return 0
+    try:
+        return await _migrar_imagens_pedidos(tamanho_lote)
+    finally:
+        await tarefas.liberar_lease(LEASE_MIGRACAO_IMAGENS)
+
+async def _migrar_imagens_pedidos(tamanho_lote: int) -> int:
     db = await get_database()
     pedidos = db.pedidos
-    
-    # Contar pedidos por status
-    pendentes = await pedidos.count_documents({"status": "pendente"})
-    em_preparacao = await pedidos.count_documents({"status": "em_preparacao"})
-    saiu_para_entrega = await pedidos.count_documents({"status": "saiu_para_entrega"})
-    concluidos = await pedidos.count_documents({"status": "concluido"})
-    total = await pedidos.count_documents({})
-    
-    return {
-        "pendentes": pendentes,
-        "em_preparacao": em_preparacao,
-        "saiu_para_entrega": saiu_para_entrega,
-        "concluidos": concluidos,
-        "total": total
-    }
\ No newline at end of file
+    filtro = {"$or": [
+        {"itens.imagemProduto": {"$regex": "^(data:|/images/)"}},
+        {"itens.produto.imagem": {"$exists": True}},
+    ]}
+    # A mesma foto aparece em muitos pedidos: converte cada data URL uma vez só
+    referencias: Dict[str, Optional[str]] = {}
+    migrados = 0
+    ultimo_id = None
+
+    async def referencia(imagem: Optional[str]) -> Optional[str]:
+        if not imagem or eh_hash(imagem):
+            return imagem
+        if imagem.startswith(PREFIXO_URL) and eh_hash(imagem[len(PREFIXO_URL):]):
+            return imagem[len(PREFIXO_URL):]
+        if imagem not in referencias:
+            referencias[imagem] = await referencia_imagem_item(imagem)
+        return referencias[imagem]
+
+    while True:
+        filtro_lote = {**filtro, "_id": {"$gt": ultimo_id}} if ultimo_id else filtro
+        lote = await pedidos.find(filtro_lote, {"itens": 1}).sort("_id", 1).limit(tamanho_lote).to_list(tamanho_lote)
+        if not lote:
+            break
+        ultimo_id = lote[-1]["_id"]
+
+        operacoes = []
+        for pedido in lote:
+            itens = []
+            for item in pedido.get("itens", []):
+                item = dict(item)
+                produto = dict(item.get("produto") or {})
+                imagem = item.get("imagemProduto") or produto.get("imagem")
+                item["imagemProduto"] = await referencia(imagem)
+                if produto:
+                    produto.pop("imagem", None)
+                    item["produto"] = produto
+                itens.append(item)
+            operacoes.append(UpdateOne({"_id": pedido["_id"]}, {"$set": {"itens": itens}}))
+
+        await pedidos.bulk_write(operacoes, ordered=False)
+        migrados += len(operacoes)
+        metrics.incrementar("pedidos.imagens_migradas", len(operacoes))
+        if not await tarefas.adquirir_lease(LEASE_MIGRACAO_IMAGENS, LEASE_MIGRACAO_IMAGENS_DURACAO):
+            logger.warning("Lease da migração das imagens perdido; interrompendo")
+            break
+
+    logger.info(f"Imagens dos itens migradas em {migrados} pedidos")
+    return migrados
+
+async def obter_contadores_pedidos() -> dict:
+    """Retorna contadores de pedidos por status (documento mantido em pedido_stats)"""
+    return await pedido_stats_service.obter()
@@ -0,0 +1,173 @@
+from app.database import get_database
+from app.schemas import StatusPedido
+from app import metrics
+from collections import defaultdict
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from typing import Optional
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Contadores de pedidos por status mantidos incrementalmente em um único
+# documento (coleção 'pedido_stats'), para o painel da equipe ler com um
+# find_one por _id em vez de contar a coleção inteira a cada consulta.
+# A reconciliação periódica recalcula tudo com um $group e corrige desvios
+# (ex.: processo que caiu entre a escrita do pedido e o $inc).
+# Todo $inc também soma 1 em 'versao': a reconciliação só substitui o documento
+# se a versão não mudou durante o $group, então nenhum incremento se perde.
+# Os pedidos arquivados entram por uma base pronta (documento "arquivo"),
+# somada a cada lote arquivado e recontada pela tarefa de arquivamento, para a
+# reconciliação não varrer 'pedidos_arquivo' inteira.
+STATS_ID = "contadores"
+BASE_ARQUIVO_ID = "arquivo"
+PEDIDO_STATS_RECONCILIACAO_INTERVALO = float(os.getenv("PEDIDO_STATS_RECONCILIACAO_INTERVALO", "300"))
+PEDIDO_STATS_RECONCILIACAO_TENTATIVAS = 3
+
+# status -> chave na resposta de obter_contadores_pedidos
+CHAVES_CONTADORES = {
+    StatusPedido.PENDENTE.value: "pendentes",
+    StatusPedido.EM_PREPARACAO.value: "em_preparacao",
+    StatusPedido.SAIU_PARA_ENTREGA.value: "saiu_para_entrega",
+    StatusPedido.CONCLUIDO.value: "concluidos",
+}
+
+
+def _valor_status(status) -> Optional[str]:
+    """Valor do status; None (com aviso) para status antigo que não existe mais"""
+    try:
+        return StatusPedido(status).value
+    except ValueError:
+        logger.warning(f"Status de pedido desconhecido ignorado nos contadores: {status!r}")
+        return None
+
+
+async def registrar_criacao(status: StatusPedido) -> None:
+    """Conta um pedido novo"""
+    incrementos = {"total": 1, "versao": 1}
+    valor = _valor_status(status)
+    if valor is not None:
+        incrementos[valor] = 1
+    db = await get_database()
+    await db.pedido_stats.update_one({"_id": STATS_ID}, {"$inc": incrementos}, upsert=True)
+
+
+async def registrar_transicao(anterior: StatusPedido, novo: StatusPedido) -> None:
+    """Move um pedido de um contador de status para outro"""
+    await registrar_transicoes([(anterior, novo)])
+
+
+async def registrar_transicoes(transicoes: list[tuple[StatusPedido, StatusPedido]]) -> None:
+    """Aplica várias transições (ex.: atualização em lote) em um único $inc"""
+    incrementos: dict[str, int] = defaultdict(int)
+    for anterior, novo in transicoes:
+        anterior, novo = _valor_status(anterior), _valor_status(novo)
+        if anterior != novo:
+            # Status desconhecido não tem contador: só o outro lado muda
+            if anterior is not None:
+                incrementos[anterior] -= 1
+            if novo is not None:
+                incrementos[novo] += 1
+
+    incrementos = {status: n for status, n in incrementos.items() if n}
+    if not incrementos:
+        return
+    incrementos["versao"] = 1
+    db = await get_database()
+    await db.pedido_stats.update_one({"_id": STATS_ID}, {"$inc": incrementos}, upsert=True)
+
+
+async def registrar_arquivamento(quantidade: int) -> None:
+    """Soma pedidos concluídos movidos para o arquivo à base e avisa a reconciliação"""
+    db = await get_database()
+    await db.pedido_stats.update_one(
+        {"_id": BASE_ARQUIVO_ID},
+        {"$inc": {StatusPedido.CONCLUIDO.value: quantidade, "total": quantidade}},
+        upsert=True
+    )
+    # Uma contagem em andamento pode ter lido 'pedidos' antes da remoção
+    await db.pedido_stats.update_one({"_id": STATS_ID}, {"$inc": {"versao": 1}}, upsert=True)
+
+
+async def obter_base_arquivo() -> dict:
+    db = await get_database()
+    return await db.pedido_stats.find_one({"_id": BASE_ARQUIVO_ID}) or {}
+
+
+async def recontar_base_arquivo() -> dict:
+    """Recalcula a base com um $group em 'pedidos_arquivo' (corrige lote interrompido)"""
+    db = await get_database()
+    base = {"_id": BASE_ARQUIVO_ID, "total": 0}
+    async for grupo in db.pedidos_arquivo.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+        base[grupo["_id"]] = grupo["n"]
+        base["total"] += grupo["n"]
+    base["recontadoEm"] = datetime.utcnow()
+    await db.pedido_stats.replace_one({"_id": BASE_ARQUIVO_ID}, base, upsert=True)
+    return base
+
+
+async def _contar(db) -> dict:
+    contagens = {status: 0 for status in CHAVES_CONTADORES}
+    total = 0
+    async for grupo in db.pedidos.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+        if grupo["_id"] in contagens:
+            contagens[grupo["_id"]] = grupo["n"]
+        total += grupo["n"]
+
+    # Pedidos arquivados continuam contando, pela base
+    base = await db.pedido_stats.find_one({"_id": BASE_ARQUIVO_ID})
+    if base is None:
+        base = await recontar_base_arquivo()
+    for status in contagens:
+        contagens[status] += base.get(status, 0)
+    return {**contagens, "total": total + base.get("total", 0)}
+
+
+async def reconciliar() -> Optional[dict]:
+    """
+    Recalcula os contadores a partir da coleção de pedidos (um único $group)
+    - Substitui o documento só se 'versao' não mudou durante a contagem; senão
+      conta de novo (até PEDIDO_STATS_RECONCILIACAO_TENTATIVAS vezes)
+    - Retorna None se não conseguiu (muita escrita); a próxima execução tenta de novo
+    """
+    db = await get_database()
+    for _ in range(PEDIDO_STATS_RECONCILIACAO_TENTATIVAS):
+        anterior = await db.pedido_stats.find_one({"_id": STATS_ID})
+        contagem = await _contar(db)
+
+        if anterior is None:
+            doc = {"_id": STATS_ID, **contagem, "versao": 0}
+            try:
+                await db.pedido_stats.insert_one(doc)
+            except DuplicateKeyError:
+                # Um $inc criou o documento durante a contagem
+                continue
+        else:
+            versao = anterior.get("versao")
+            doc = {"_id": STATS_ID, **contagem, "versao": (versao or 0) + 1}
+            filtro = {"_id": STATS_ID, "versao": versao if versao is not None else {"$exists": False}}
+            if await db.pedido_stats.find_one_and_replace(filtro, doc) is None:
+                metrics.incrementar("pedidos.stats.reconciliacoes_repetidas")
+                continue
+
+        metrics.incrementar("pedidos.stats.reconciliacoes")
+        if anterior is not None and any(anterior.get(campo, 0) != valor for campo, valor in contagem.items()):
+            metrics.incrementar("pedidos.stats.correcoes")
+            logger.warning(f"Contadores de pedidos corrigidos: {anterior} -> {doc}")
+        return doc
+
+    logger.warning("Reconciliação dos contadores de pedidos adiada: contadores mudaram durante todas as contagens")
+    return None
+
+
+async def obter() -> dict:
+    """Lê os contadores; na primeira vez (documento inexistente) calcula a partir dos pedidos"""
+    db = await get_database()
+    doc = await db.pedido_stats.find_one({"_id": STATS_ID})
+    if doc is None:
+        doc = await reconciliar() or await db.pedido_stats.find_one({"_id": STATS_ID}) or {}
+
+    contadores = {chave: max(doc.get(status, 0), 0) for status, chave in CHAVES_CONTADORES.items()}
+    contadores["total"] = max(doc.get("total", 0), 0)
+    return contadores
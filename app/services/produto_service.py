@@ -1,6 +1,18 @@
 import app.database as database
-from app.schemas import ProdutoIn, ProdutoOut, ProdutoUpdate
+from app.schemas import ProdutoIn, ProdutoOut, ProdutoUpdate, ProdutoResumoOut, PaginaProdutosOut
+from app.services import catalogo_cache, imagem_service, busca_service
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING
+from typing import AsyncIterator, Optional
+
+PRODUTOS_PAGE_SIZE_MAX = 100
+
+CAMPOS_PRODUTO = ("titulo", "descricao", "preco", "imagem", "categoria_id", "quantidade", "ativo")
+VISOES_PRODUTO = {
+    "summary": ("titulo", "preco", "imagem", "categoria_id", "ativo"),
+    "full": None,
+}
 
 def product_helper(prod) -> ProdutoOut:
     return ProdutoOut(
@@ -8,45 +20,142 @@ def product_helper(prod) -> ProdutoOut:
         titulo=prod["titulo"],
         descricao=prod["descricao"],
         preco=prod["preco"],
-        imagem=prod["imagem"],
+        imagem=imagem_service.url_imagem(prod["imagem"]),
         categoria_id=prod["categoria_id"],
         quantidade=prod.get("quantidade", 0),
         ativo=prod.get("ativo", True)
     )
 
 
+def produto_resumo_helper(prod) -> ProdutoResumoOut:
+    """Monta a saída só com os campos que vieram da projeção"""
+    dados = {campo: prod[campo] for campo in CAMPOS_PRODUTO if campo in prod}
+    if "imagem" in dados:
+        dados["imagem"] = imagem_service.url_imagem(dados["imagem"])
+    return ProdutoResumoOut(id=str(prod["_id"]), **dados)
+
+
+def _helper_para(projecao: Optional[dict]):
+    return product_helper if projecao is None else produto_resumo_helper
+
+
+def _chave_projecao(projecao: Optional[dict]):
+    return tuple(sorted(projecao)) if projecao else None
+
+
 async def create_product(prod: ProdutoIn) -> ProdutoOut:
     prod_dict = prod.dict()
+    prod_dict.setdefault("ativo", True)
+    prod_dict["imagem"] = await imagem_service.normalizar_referencia(prod_dict["imagem"])
     result = await database.db["produtos"].insert_one(prod_dict)
+    await catalogo_cache.invalidar("produtos")
     prod_dict["_id"] = result.inserted_id
-    return product_helper(prod_dict)
+    produto = product_helper(prod_dict)
+    busca_service.atualizar_produto(produto)
+    return produto
+
+
+def montar_filtro_produtos(
+    categoria_id: Optional[str] = None,
+    ativo: Optional[bool] = None,
+    cursor: Optional[str] = None
+) -> dict:
+    """
+    Monta o filtro da listagem de produtos
+    - cursor: último _id da página anterior (paginação por keyset)
+    - ativo=True também considera produtos antigos sem o campo 'ativo'
+    """
+    filtro = {}
+    if categoria_id is not None:
+        filtro["categoria_id"] = categoria_id
+    if ativo is True:
+        filtro["ativo"] = {"$ne": False}
+    elif ativo is False:
+        filtro["ativo"] = False
+    if cursor:
+        try:
+            filtro["_id"] = {"$gt": ObjectId(cursor)}
+        except (InvalidId, TypeError):
+            raise ValueError("Cursor inválido")
+    return filtro
+
+
+async def iterar_produtos(filtro: dict, limite: int, projecao: Optional[dict] = None) -> AsyncIterator[dict]:
+    """Percorre os produtos em ordem de _id direto do cursor do Motor"""
+    cursor = database.db["produtos"].find(filtro, projecao).sort("_id", ASCENDING).limit(limite)
+    async for prod in cursor:
+        yield prod
+
 
+async def get_products(
+    categoria_id: Optional[str] = None,
+    ativo: Optional[bool] = None,
+    cursor: Optional[str] = None,
+    page_size: int = 50,
+    projecao: Optional[dict] = None
+) -> PaginaProdutosOut:
+    page_size = max(1, min(page_size, PRODUTOS_PAGE_SIZE_MAX))
+    chave = ("pagina", categoria_id, ativo, cursor, page_size, _chave_projecao(projecao))
 
-async def get_products() -> list[ProdutoOut]:
+    cache = catalogo_cache.obter("produtos", chave)
+    if cache is not catalogo_cache.AUSENTE:
+        return cache
+
+    versao_lida = catalogo_cache.versao("produtos")
+    filtro = montar_filtro_produtos(categoria_id, ativo, cursor)
+
+    # Busca um item a mais só para saber se existe próxima página
+    helper = _helper_para(projecao)
     produtos = []
-    async for prod in database.db["produtos"].find():
-        produtos.append(product_helper(prod))
-    return produtos
+    tem_mais = False
+    async for prod in iterar_produtos(filtro, page_size + 1, projecao):
+        if len(produtos) == page_size:
+            tem_mais = True
+            break
+        produtos.append(helper(prod))
+
+    pagina = PaginaProdutosOut(
+        produtos=produtos,
+        proximoCursor=produtos[-1].id if tem_mais else None,
+        pageSize=page_size
+    )
+    catalogo_cache.guardar("produtos", chave, pagina, versao_lida)
+    return pagina
 
 
-async def get_product_by_id(prod_id: str) -> ProdutoOut | None:
-    prod = await database.db["produtos"].find_one({"_id": ObjectId(prod_id)})
+async def get_product_by_id(prod_id: str, projecao: Optional[dict] = None) -> ProdutoOut | ProdutoResumoOut | None:
+    chave = ("id", prod_id, _chave_projecao(projecao))
+    cache = catalogo_cache.obter("produtos", chave)
+    if cache is not catalogo_cache.AUSENTE:
+        return cache
+
+    versao_lida = catalogo_cache.versao("produtos")
+    prod = await database.db["produtos"].find_one({"_id": ObjectId(prod_id)}, projecao)
     if prod:
-        return product_helper(prod)
+        produto = _helper_para(projecao)(prod)
+        catalogo_cache.guardar("produtos", chave, produto, versao_lida)
+        return produto
 
 
 async def update_product(prod_id: str, prod: ProdutoUpdate) -> ProdutoOut | None:
     update_data = {k: v for k, v in prod.dict().items() if v is not None}
+    if "imagem" in update_data:
+        update_data["imagem"] = await imagem_service.normalizar_referencia(update_data["imagem"])
     result = await database.db["produtos"].update_one(
         {"_id": ObjectId(prod_id)}, {"$set": update_data}
     )
+    await catalogo_cache.invalidar("produtos")
 
     if result.modified_count == 1:
-        return await get_product_by_id(prod_id)
+        produto = await get_product_by_id(prod_id)
+        busca_service.atualizar_produto(produto)
+        return produto
 
 
 async def delete_product(prod_id: str) -> bool:
     result = await database.db["produtos"].delete_one({"_id": ObjectId(prod_id)})
+    await catalogo_cache.invalidar("produtos")
+    busca_service.remover_produto(prod_id)
     return result.deleted_count == 1
 
 
@@ -65,9 +174,12 @@ async def alterar_quantidade_produto(produto_id: str, quantidade_alteracao: int)
         {"_id": ObjectId(produto_id)},
         {"$inc": {"quantidade": quantidade_alteracao}}
     )
+    await catalogo_cache.invalidar("produtos")
     
     if result.modified_count == 1:
-        return await get_product_by_id(produto_id)
+        produto = await get_product_by_id(produto_id)
+        busca_service.atualizar_produto(produto)
+        return produto
     return None
 
 async def verificar_estoque_disponivel(produto_id: str, quantidade_desejada: int) -> bool:
@@ -86,9 +198,12 @@ async def alterar_status_produto(produto_id: str, ativo: bool) -> ProdutoOut | N
         {"_id": ObjectId(produto_id)},
         {"$set": {"ativo": ativo}}
     )
+    await catalogo_cache.invalidar("produtos")
     
     if result.modified_count == 1:
-        return await get_product_by_id(produto_id)
+        produto = await get_product_by_id(produto_id)
+        busca_service.atualizar_produto(produto)
+        return produto
     return None
 
 async def migrar_produtos_existentes():
@@ -97,4 +212,46 @@ async def migrar_produtos_existentes():
         {"quantidade": {"$exists": False}},
         {"$set": {"quantidade": 0}}
     )
-    return result.modified_count
+    result_ativo = await database.db["produtos"].update_many(
+        {"ativo": {"$exists": False}},
+        {"$set": {"ativo": True}}
+    )
+    await catalogo_cache.invalidar("produtos")
+    await busca_service.construir_indice()
+    return result.modified_count + result_ativo.modified_count
+
+
+async def migrar_imagens_produtos(tamanho_lote: int = 50) -> int:
+    """
+    Move as imagens base64 embutidas nos produtos para o armazenamento de imagens
+    - Processa em lotes para não carregar o catálogo inteiro em memória
+    - Cada produto passa a guardar só o hash da imagem
+    """
+    produtos = database.db["produtos"]
+    migrados = 0
+    ignorados = []
+
+    while True:
+        filtro = {"imagem": {"$regex": "^data:"}, "_id": {"$nin": ignorados}}
+        lote = await produtos.find(filtro, {"imagem": 1}).limit(tamanho_lote).to_list(tamanho_lote)
+        if not lote:
+            break
+
+        for prod in lote:
+            try:
+                referencia = await imagem_service.normalizar_referencia(prod["imagem"])
+            except ValueError:
+                # Imagem corrompida: mantém como está
+                ignorados.append(prod["_id"])
+                continue
+
+            await produtos.update_one(
+                {"_id": prod["_id"], "imagem": prod["imagem"]},
+                {"$set": {"imagem": referencia}}
+            )
+            migrados += 1
+
+    if migrados:
+        await catalogo_cache.invalidar("produtos")
+        await busca_service.construir_indice()
+    return migrados
@@ -0,0 +1,286 @@
+from app.database import get_database
+from app.schemas import StatusPedido, StatusPagamento, MetodoPagamento
+from app.services.arquivo_pedidos_service import COLECAO_ARQUIVO
+from app import metrics
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+from pymongo import UpdateOne
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Reconciliação pagamentos x pedidos, em duas passadas por execução:
+# - Novos: percorre 'pedidos' e 'pedidos_arquivo' em ordem de pedidoId a partir
+#   do checkpoint (uma agregação com $lookup em 'pagamentos' por coleção,
+#   intercaladas como um merge de cursores), com memória constante. Para no
+#   primeiro pedido criado há menos de RECONCILIACAO_ASSENTAMENTO_MINUTOS (PIX
+#   ainda em aberto não é divergência) e o checkpoint não passa dele. Como os
+#   blocos de IDs (sequencia_service) duram SEQUENCIA_BLOCO_TTL segundos, um
+#   pedidoId menor ainda não gravado não fica para trás se a janela for maior que isso.
+# - Alterados: pedidos já passados pelo checkpoint que mudaram (o próprio pedido
+#   ou um pagamento dele) desde a execução anterior, mais as divergências em
+#   aberto, são conferidos de novo.
+# Divergências vão para 'reconciliacao_divergencias' (_id "<pedidoId>:<tipo>",
+# então rodar de novo não duplica); a que deixa de valer fica com resolvida=True.
+COLECAO_DIVERGENCIAS = "reconciliacao_divergencias"
+COLECAO_CHECKPOINTS = "checkpoints"
+CHECKPOINT_ID = "reconciliacao_pagamentos"
+RECONCILIACAO_INTERVALO = float(os.getenv("RECONCILIACAO_INTERVALO", "3600"))
+RECONCILIACAO_LOTE = int(os.getenv("RECONCILIACAO_LOTE", "1000"))
+RECONCILIACAO_ASSENTAMENTO_MINUTOS = int(os.getenv("RECONCILIACAO_ASSENTAMENTO_MINUTOS", "60"))
+TOLERANCIA_VALOR = 0.01
+
+SEM_PAGAMENTO_CONFIRMADO = "sem_pagamento_confirmado"
+VALOR_DIVERGENTE = "valor_divergente"
+
+# Pedidos que só saem de 'pendente' depois do pagamento confirmado
+STATUS_PAGOS = [
+    StatusPedido.EM_PREPARACAO.value,
+    StatusPedido.SAIU_PARA_ENTREGA.value,
+    StatusPedido.CONCLUIDO.value,
+]
+
+
+def _pipeline(filtro: dict) -> list[dict]:
+    return [
+        {"$match": filtro},
+        {"$sort": {"pedidoId": 1}},
+        {"$project": {"_id": 0, "pedidoId": 1, "status": 1, "total": 1, "metodoPagamento": 1, "criadoEm": 1}},
+        {"$lookup": {
+            "from": "pagamentos",
+            "localField": "pedidoId",
+            "foreignField": "pedidoId",
+            "pipeline": [{"$project": {"_id": 0, "pagamentoId": 1, "metodo": 1, "valor": 1, "status": 1}}],
+            "as": "pagamentos",
+        }},
+    ]
+
+
+async def _proximo(cursor) -> Optional[dict]:
+    try:
+        return await cursor.next()
+    except StopAsyncIteration:
+        return None
+
+
+async def percorrer_pedidos(db, filtro: dict) -> AsyncIterator[dict]:
+    """Pedidos das duas coleções com seus pagamentos, em ordem de pedidoId e sem repetição"""
+    cursores = [
+        db[colecao].aggregate(_pipeline(filtro), batchSize=RECONCILIACAO_LOTE)
+        for colecao in ("pedidos", COLECAO_ARQUIVO)
+    ]
+    atuais = [await _proximo(cursor) for cursor in cursores]
+    ultimo = None
+    while any(doc is not None for doc in atuais):
+        indice = min(
+            (i for i, doc in enumerate(atuais) if doc is not None),
+            key=lambda i: atuais[i]["pedidoId"]
+        )
+        doc = atuais[indice]
+        atuais[indice] = await _proximo(cursores[indice])
+        # Pedido no meio do arquivamento aparece nas duas coleções
+        if doc["pedidoId"] != ultimo:
+            ultimo = doc["pedidoId"]
+            yield doc
+
+
+def divergencias_pedido(pedido: dict) -> list[tuple[str, dict]]:
+    """Confere um pedido com seus pagamentos; retorna [(tipo, detalhes)]"""
+    pagos = [p for p in pedido["pagamentos"] if p.get("status") == StatusPagamento.PAGO.value]
+    encontradas = []
+
+    if (
+        pedido["status"] in STATUS_PAGOS
+        and pedido.get("metodoPagamento") != MetodoPagamento.DINHEIRO.value
+        and not pagos
+    ):
+        encontradas.append((SEM_PAGAMENTO_CONFIRMADO, {}))
+
+    for pagamento in pagos:
+        if abs((pagamento.get("valor") or 0) - pedido["total"]) > TOLERANCIA_VALOR:
+            encontradas.append((VALOR_DIVERGENTE, {"valorPagamento": pagamento.get("valor")}))
+            break
+
+    return encontradas
+
+
+async def _gravar_conferencia(db, pedidos: list[dict], agora: datetime) -> int:
+    """
+    Grava o resultado de um lote de pedidos conferidos; retorna quantas divergências há
+    - Upsert das divergências encontradas (reabre uma que já tinha sido resolvida)
+    - As em aberto desses pedidos que não apareceram mais ficam resolvidas
+    """
+    operacoes, encontradas = [], []
+    for pedido in pedidos:
+        for tipo, detalhes in divergencias_pedido(pedido):
+            encontradas.append(f"{pedido['pedidoId']}:{tipo}")
+            operacoes.append(UpdateOne(
+                {"_id": encontradas[-1]},
+                {
+                    "$set": {
+                        "pedidoId": pedido["pedidoId"],
+                        "tipo": tipo,
+                        "statusPedido": pedido["status"],
+                        "metodoPagamento": pedido.get("metodoPagamento"),
+                        "totalPedido": pedido["total"],
+                        "pagamentos": pedido["pagamentos"],
+                        "resolvida": False,
+                        "atualizadoEm": agora,
+                        **detalhes,
+                    },
+                    "$setOnInsert": {"detectadoEm": agora},
+                    "$unset": {"resolvidaEm": ""},
+                },
+                upsert=True
+            ))
+
+    if operacoes:
+        await db[COLECAO_DIVERGENCIAS].bulk_write(operacoes, ordered=False)
+    if pedidos:
+        await db[COLECAO_DIVERGENCIAS].update_many(
+            {
+                "pedidoId": {"$in": [pedido["pedidoId"] for pedido in pedidos]},
+                "_id": {"$nin": encontradas},
+                "resolvida": {"$ne": True},
+            },
+            {"$set": {"resolvida": True, "resolvidaEm": agora}}
+        )
+    return len(operacoes)
+
+
+async def _salvar_checkpoint(db, atualizacao: dict) -> None:
+    await db[COLECAO_CHECKPOINTS].update_one(
+        {"_id": CHECKPOINT_ID},
+        {**atualizacao, "$set": {**atualizacao.get("$set", {}), "atualizadoEm": datetime.utcnow()}},
+        upsert=True
+    )
+
+
+async def obter_checkpoint() -> dict:
+    """{"ultimoPedidoId", "verificadoAte"} da execução anterior (vazio na primeira)"""
+    db = await get_database()
+    return await db[COLECAO_CHECKPOINTS].find_one({"_id": CHECKPOINT_ID}) or {}
+
+
+async def reiniciar_checkpoint() -> None:
+    """A próxima execução volta a conferir todos os pedidos"""
+    db = await get_database()
+    await db[COLECAO_CHECKPOINTS].delete_one({"_id": CHECKPOINT_ID})
+
+
+async def _conferir_novos(db, depois_de: int, limite: datetime, agora: datetime) -> tuple[int, int, int]:
+    """Passada dos pedidos acima do checkpoint; retorna (processados, divergências, novo checkpoint)"""
+    processados = divergencias = 0
+    ultimo_pedido_id = depois_de
+    lote: list[dict] = []
+
+    async for pedido in percorrer_pedidos(db, {"pedidoId": {"$gt": depois_de}}):
+        if pedido["criadoEm"] > limite:
+            # Ainda dentro da janela: ele e os seguintes ficam para a próxima execução
+            break
+        lote.append(pedido)
+        if len(lote) == RECONCILIACAO_LOTE:
+            divergencias += await _gravar_conferencia(db, lote, agora)
+            processados += len(lote)
+            ultimo_pedido_id = lote[-1]["pedidoId"]
+            # $max: uma execução manual em paralelo não faz o checkpoint voltar
+            await _salvar_checkpoint(db, {"$max": {"ultimoPedidoId": ultimo_pedido_id}})
+            lote = []
+
+    if lote:
+        divergencias += await _gravar_conferencia(db, lote, agora)
+        processados += len(lote)
+        ultimo_pedido_id = lote[-1]["pedidoId"]
+        await _salvar_checkpoint(db, {"$max": {"ultimoPedidoId": ultimo_pedido_id}})
+    return processados, divergencias, ultimo_pedido_id
+
+
+async def _pedidos_alterados(db, ate_pedido_id: int, desde: datetime, limite: datetime) -> AsyncIterator[int]:
+    """pedidoIds já passados pelo checkpoint para conferir de novo (podem repetir)"""
+    janela = {"$gt": desde, "$lte": limite}
+    async for doc in db.pedidos.find({"atualizadoEm": janela, "pedidoId": {"$lte": ate_pedido_id}}, {"pedidoId": 1}):
+        yield doc["pedidoId"]
+    async for doc in db.pagamentos.find({"atualizadoEm": janela, "pedidoId": {"$lte": ate_pedido_id}}, {"pedidoId": 1}):
+        yield doc["pedidoId"]
+    async for doc in db[COLECAO_DIVERGENCIAS].find({"resolvida": {"$ne": True}}, {"pedidoId": 1}):
+        yield doc["pedidoId"]
+
+
+async def _conferir_alterados(db, ate_pedido_id: int, desde: datetime, limite: datetime, agora: datetime) -> tuple[int, int]:
+    """Passada dos pedidos alterados; retorna (processados, divergências)"""
+    processados = divergencias = 0
+    ids: set[int] = set()
+
+    async def conferir(ids_lote: set[int]) -> None:
+        nonlocal processados, divergencias
+        pedidos = [pedido async for pedido in percorrer_pedidos(db, {"pedidoId": {"$in": list(ids_lote)}})]
+        divergencias += await _gravar_conferencia(db, pedidos, agora)
+        processados += len(pedidos)
+
+    async for pedido_id in _pedidos_alterados(db, ate_pedido_id, desde, limite):
+        ids.add(pedido_id)
+        if len(ids) == RECONCILIACAO_LOTE:
+            await conferir(ids)
+            ids = set()
+    if ids:
+        await conferir(ids)
+    return processados, divergencias
+
+
+async def reconciliar_pagamentos() -> dict:
+    """
+    Confere os pedidos novos e os alterados desde a execução anterior e grava as divergências
+    - sem_pagamento_confirmado: pedido já em preparação (ou adiante) sem pagamento 'pago' (exceto dinheiro)
+    - valor_divergente: pagamento 'pago' com valor diferente do total do pedido
+    """
+    db = await get_database()
+    inicio = time.perf_counter()
+    checkpoint = await obter_checkpoint()
+    depois_de = checkpoint.get("ultimoPedidoId", 0)
+    agora = datetime.utcnow()
+    limite = agora - timedelta(minutes=RECONCILIACAO_ASSENTAMENTO_MINUTOS)
+
+    # Alterados antes dos novos: as divergências em aberto são só as de execuções anteriores
+    reconferidos = divergencias = 0
+    if checkpoint.get("verificadoAte"):
+        reconferidos, divergencias = await _conferir_alterados(
+            db, depois_de, checkpoint["verificadoAte"], limite, agora
+        )
+
+    processados, divergencias_novos, ultimo_pedido_id = await _conferir_novos(db, depois_de, limite, agora)
+    divergencias += divergencias_novos
+    await _salvar_checkpoint(db, {"$max": {"verificadoAte": limite}})
+
+    duracao = time.perf_counter() - inicio
+    documentos = processados + reconferidos
+    docs_por_segundo = documentos / duracao if duracao > 0 else 0.0
+    metrics.incrementar("reconciliacao.pedidos", documentos)
+    metrics.incrementar("reconciliacao.divergencias", divergencias)
+    metrics.definir("reconciliacao.docs_por_segundo", round(docs_por_segundo, 1))
+    metrics.observar("reconciliacao.duracao_ms", duracao * 1000)
+
+    if documentos:
+        logger.info(
+            f"Reconciliação: {processados} pedidos novos ({depois_de + 1}..{ultimo_pedido_id}), "
+            f"{reconferidos} reconferidos, {divergencias} divergências, {docs_por_segundo:.0f} docs/s"
+        )
+    return {
+        "processados": processados,
+        "reconferidos": reconferidos,
+        "divergencias": divergencias,
+        "checkpoint": ultimo_pedido_id,
+        "duracaoSegundos": round(duracao, 3),
+        "docsPorSegundo": round(docs_por_segundo, 1),
+    }
+
+
+async def listar_divergencias(tipo: Optional[str] = None, limite: int = 100, resolvidas: bool = False) -> list[dict]:
+    """Divergências em aberto (ou já resolvidas), mais recentes primeiro"""
+    db = await get_database()
+    filtro = {"resolvida": True} if resolvidas else {"resolvida": {"$ne": True}}
+    if tipo:
+        filtro["tipo"] = tipo
+    cursor = db[COLECAO_DIVERGENCIAS].find(filtro).sort("pedidoId", -1).limit(limite)
+    return [{**doc, "_id": str(doc["_id"])} async for doc in cursor]
@@ -0,0 +1,71 @@
+from app.database import get_database
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app import metrics
+import asyncio
+import os
+import time
+
+# Cada worker reserva blocos de IDs na coleção 'counters' com um $inc atômico
+# e entrega os IDs do bloco a partir da memória. IDs nunca se repetem entre
+# workers; podem sobrar lacunas (blocos não usados até o fim).
+SEQUENCIA_BLOCO = int(os.getenv("SEQUENCIA_BLOCO", "10"))
+# Bloco reservado há mais tempo que isso é descartado, para que um worker
+# parado não entregue depois IDs muito menores que os dos outros
+SEQUENCIA_BLOCO_TTL = float(os.getenv("SEQUENCIA_BLOCO_TTL", "60"))
+
+# nome -> [próximo id, último id do bloco, reservado em]
+_blocos: dict[str, list] = {}
+_locks: dict[str, asyncio.Lock] = {}
+_semeadas: set[str] = set()
+
+
+async def _semear(nome: str, colecao: str, campo: str) -> None:
+    """Garante que o contador começa depois do maior ID já existente na coleção"""
+    db = await get_database()
+    ultimo = await db[colecao].find_one({}, {campo: 1}, sort=[(campo, -1)])
+    maior = ultimo[campo] if ultimo else 0
+
+    try:
+        await db.counters.update_one({"_id": nome}, {"$max": {"valor": maior}}, upsert=True)
+    except DuplicateKeyError:
+        # Outro worker criou o contador ao mesmo tempo
+        await db.counters.update_one({"_id": nome}, {"$max": {"valor": maior}})
+
+
+async def _reservar_bloco(nome: str) -> list:
+    db = await get_database()
+    doc = await db.counters.find_one_and_update(
+        {"_id": nome},
+        {"$inc": {"valor": SEQUENCIA_BLOCO}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    metrics.incrementar(f"sequencias.{nome}.blocos_reservados")
+    return [doc["valor"] - SEQUENCIA_BLOCO + 1, doc["valor"], time.monotonic()]
+
+
+async def proximo_id(nome: str, colecao: str, campo: str) -> int:
+    """Retorna o próximo ID da sequência 'nome' (baseada em colecao.campo)"""
+    lock = _locks.setdefault(nome, asyncio.Lock())
+    async with lock:
+        if nome not in _semeadas:
+            await _semear(nome, colecao, campo)
+            _semeadas.add(nome)
+
+        bloco = _blocos.get(nome)
+        if bloco is None or bloco[0] > bloco[1] or time.monotonic() - bloco[2] > SEQUENCIA_BLOCO_TTL:
+            bloco = await _reservar_bloco(nome)
+            _blocos[nome] = bloco
+
+        valor = bloco[0]
+        bloco[0] += 1
+        return valor
+
+
+async def proximo_pedido_id() -> int:
+    return await proximo_id("pedidoId", "pedidos", "pedidoId")
+
+
+async def proximo_pagamento_id() -> int:
+    return await proximo_id("pagamentoId", "pagamentos", "pagamentoId")
@@ -0,0 +1,253 @@
+from app.database import get_database
+from app.schemas import PagamentoWebhookIn, StatusPagamento, StatusPedido, MetodoPagamento
+from app import metrics, eventos
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Fila de webhooks PIX na coleção 'webhooks_pix'. O endpoint só valida e grava
+# (resposta 202); o consumidor em segundo plano aplica em lotes.
+# - _id é a chave de deduplicação: eventoId do provedor ou
+#   "<pedidoId>:<pagamentoId>:<status>" (um segundo PIX do mesmo pedido, gerado
+#   depois que o primeiro expirou, tem outra chave), então retentativas do
+#   provedor não geram uma segunda aplicação
+# - Cada worker reserva documentos empurrando proximaTentativaEm para o futuro
+#   (WEBHOOK_RESERVA); se o worker cair, o documento volta para a fila sozinho
+# - Falhas tentam de novo com backoff exponencial; após WEBHOOK_TENTATIVAS_MAX o
+#   documento fica com estado "morto" (com o último erro) para análise
+COLECAO_WEBHOOKS = "webhooks_pix"
+WEBHOOK_INTERVALO = float(os.getenv("WEBHOOK_INTERVALO", "1"))
+WEBHOOK_LOTE = int(os.getenv("WEBHOOK_LOTE", "50"))
+WEBHOOK_TENTATIVAS_MAX = int(os.getenv("WEBHOOK_TENTATIVAS_MAX", "8"))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "2"))
+WEBHOOK_BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", "600"))
+WEBHOOK_RESERVA = float(os.getenv("WEBHOOK_RESERVA", "60"))
+
+PENDENTE = "pendente"
+APLICADO = "aplicado"
+MORTO = "morto"
+
+
+def chave_deduplicacao(webhook: PagamentoWebhookIn, pagamento_id: int) -> str:
+    if webhook.eventoId:
+        return f"evento:{webhook.eventoId}"
+    return f"{webhook.pedidoId}:{pagamento_id}:{StatusPagamento(webhook.status).value}"
+
+
+async def _pix_mais_recente(db, pedidos_ids: list[int]) -> dict[int, int]:
+    """pedidoId -> pagamentoId do último PIX gerado para o pedido"""
+    ultimos: dict[int, int] = {}
+    async for doc in db.pagamentos.find(
+        {"pedidoId": {"$in": pedidos_ids}, "metodo": MetodoPagamento.PIX.value},
+        {"pedidoId": 1, "pagamentoId": 1}
+    ):
+        ultimos[doc["pedidoId"]] = max(doc["pagamentoId"], ultimos.get(doc["pedidoId"], 0))
+    return ultimos
+
+
+async def enfileirar(webhook: PagamentoWebhookIn) -> bool:
+    """
+    Grava o webhook na fila; retorna False se for uma repetição já recebida
+    - Sem pagamentoId no corpo, o webhook vale para o PIX mais recente do pedido
+    - Lança ValueError se o pedido não tem PIX
+    """
+    db = await get_database()
+    agora = datetime.utcnow()
+    pagamento_id = webhook.pagamentoId
+    if pagamento_id is None:
+        pagamento_id = (await _pix_mais_recente(db, [webhook.pedidoId])).get(webhook.pedidoId)
+        if pagamento_id is None:
+            raise ValueError("Pagamento PIX não encontrado")
+    try:
+        await db[COLECAO_WEBHOOKS].insert_one({
+            "_id": chave_deduplicacao(webhook, pagamento_id),
+            "pedidoId": webhook.pedidoId,
+            "pagamentoId": pagamento_id,
+            "status": StatusPagamento(webhook.status).value,
+            "estado": PENDENTE,
+            "tentativas": 0,
+            "recebidoEm": agora,
+            "proximaTentativaEm": agora,
+        })
+    except DuplicateKeyError:
+        metrics.incrementar("webhooks_pix.duplicados")
+        return False
+    metrics.incrementar("webhooks_pix.recebidos")
+    return True
+
+
+def _backoff(tentativas: int) -> float:
+    return min(WEBHOOK_BACKOFF_BASE ** tentativas, WEBHOOK_BACKOFF_MAX)
+
+
+async def _reservar_lote(db, agora: datetime) -> list[dict]:
+    """Reserva até WEBHOOK_LOTE webhooks prontos; cada reserva é atômica entre workers"""
+    lote = []
+    while len(lote) < WEBHOOK_LOTE:
+        doc = await db[COLECAO_WEBHOOKS].find_one_and_update(
+            {"estado": PENDENTE, "proximaTentativaEm": {"$lte": agora}},
+            {"$set": {"proximaTentativaEm": agora + timedelta(seconds=WEBHOOK_RESERVA)}},
+            sort=[("proximaTentativaEm", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if doc is None:
+            break
+        lote.append(doc)
+    return lote
+
+
+async def aplicar_lote(lote: list[dict]) -> tuple[list[dict], dict]:
+    """
+    Aplica um lote de webhooks; retorna (aplicados, {_id: erro} dos que falharam)
+    - Pagamentos: um find + um bulk_write por pagamentoId; pagamento já pago não volta para expirado
+    - Pedidos: todo webhook 'pago' do lote gera a transição pendente -> em_preparacao, mesmo
+      que o pagamento já esteja pago (lote reaplicado depois de uma falha no meio);
+      a atualização em lote ignora pedidos que já saíram de pendente
+    - Falha ao mover um pedido vira falha só dos webhooks 'pago' daquele pedido
+    """
+    db = await get_database()
+    pagamentos = db.pagamentos
+    agora = datetime.utcnow()
+
+    # Webhooks enfileirados antes do pagamentoId valem para o PIX mais recente do pedido
+    sem_pagamento = list({doc["pedidoId"] for doc in lote if not doc.get("pagamentoId")})
+    ultimos = await _pix_mais_recente(db, sem_pagamento) if sem_pagamento else {}
+    alvos = {doc["_id"]: doc.get("pagamentoId") or ultimos.get(doc["pedidoId"]) for doc in lote}
+
+    atuais = {
+        doc["pagamentoId"]: doc
+        async for doc in pagamentos.find(
+            {"pagamentoId": {"$in": [alvo for alvo in alvos.values() if alvo]}, "metodo": MetodoPagamento.PIX.value},
+            {"pagamentoId": 1, "pedidoId": 1, "status": 1}
+        )
+    }
+
+    aplicados, falhas = [], {}
+    # Em ordem de chegada: o último status recebido prevalece, mas 'pago' não é desfeito
+    finais: dict[int, str] = {}
+    webhooks_pagos: dict[int, list[dict]] = {}
+    for doc in sorted(lote, key=lambda d: d["recebidoEm"]):
+        pagamento = atuais.get(alvos[doc["_id"]])
+        if pagamento is None:
+            falhas[doc["_id"]] = "Pagamento PIX não encontrado"
+            continue
+        pagamento_id = pagamento["pagamentoId"]
+        if pagamento["status"] != StatusPagamento.PAGO.value and finais.get(pagamento_id) != StatusPagamento.PAGO.value:
+            finais[pagamento_id] = doc["status"]
+        if doc["status"] == StatusPagamento.PAGO.value:
+            webhooks_pagos.setdefault(pagamento["pedidoId"], []).append(doc)
+        aplicados.append(doc)
+
+    alterados = {pagamento_id: status for pagamento_id, status in finais.items() if atuais[pagamento_id]["status"] != status}
+    if alterados:
+        await pagamentos.bulk_write([
+            UpdateOne(
+                {"pagamentoId": pagamento_id, "status": {"$ne": StatusPagamento.PAGO.value}},
+                {"$set": {"status": status, "atualizadoEm": agora}}
+            )
+            for pagamento_id, status in alterados.items()
+        ], ordered=False)
+        for pagamento_id, status in alterados.items():
+            await eventos.publicar(eventos.PAGAMENTO_ATUALIZADO, {
+                "pedidoId": atuais[pagamento_id]["pedidoId"],
+                "pagamentoId": pagamento_id,
+                "metodo": MetodoPagamento.PIX.value,
+                "status": status,
+            })
+
+    # Pedido que não pôde ser movido: só os webhooks 'pago' dele voltam para a fila
+    for pedido_id, erro in (await _mover_pedidos_pagos(set(webhooks_pagos))).items():
+        for doc in webhooks_pagos[pedido_id]:
+            aplicados.remove(doc)
+            falhas[doc["_id"]] = erro
+
+    return aplicados, falhas
+
+
+async def _mover_pedidos_pagos(pedido_ids: set[int]) -> dict[int, str]:
+    """
+    Passa os pedidos pagos de pendente para em_preparacao; retorna {pedidoId: erro} dos que falharam
+    - Se a atualização em lote falhar, tenta pedido a pedido para isolar o que deu erro
+    - 'conflito' (status mudou durante a atualização) também volta para a fila
+    """
+    from app.services.pedido_service import atualizar_status_pedidos_lote
+
+    if not pedido_ids:
+        return {}
+    try:
+        resultados = await atualizar_status_pedidos_lote([(pedido_id, StatusPedido.EM_PREPARACAO) for pedido_id in pedido_ids])
+    except Exception:
+        logger.exception("Erro movendo pedidos pagos em lote; tentando pedido a pedido")
+        resultados, erros = [], {}
+        for pedido_id in pedido_ids:
+            try:
+                resultados += await atualizar_status_pedidos_lote([(pedido_id, StatusPedido.EM_PREPARACAO)])
+            except Exception as e:
+                erros[pedido_id] = f"Erro ao atualizar o pedido: {e}"
+    else:
+        erros = {}
+
+    for resultado in resultados:
+        if resultado["resultado"] == "conflito":
+            erros[resultado["pedidoId"]] = resultado.get("detalhe") or "Conflito ao atualizar o pedido"
+    return erros
+
+
+async def _registrar_falhas(db, falhas: dict, tentativas: dict, agora: datetime) -> None:
+    operacoes = []
+    for _id, erro in falhas.items():
+        numero = tentativas[_id] + 1
+        if numero >= WEBHOOK_TENTATIVAS_MAX:
+            atualizacao = {"estado": MORTO, "tentativas": numero, "erro": erro, "mortoEm": agora}
+            metrics.incrementar("webhooks_pix.mortos")
+            logger.error(f"Webhook PIX {_id} descartado após {numero} tentativas: {erro}")
+        else:
+            atualizacao = {
+                "tentativas": numero,
+                "erro": erro,
+                "proximaTentativaEm": agora + timedelta(seconds=_backoff(numero)),
+            }
+            metrics.incrementar("webhooks_pix.falhas")
+        operacoes.append(UpdateOne({"_id": _id}, {"$set": atualizacao}))
+    if operacoes:
+        await db[COLECAO_WEBHOOKS].bulk_write(operacoes, ordered=False)
+
+
+async def processar_fila() -> int:
+    """Consome a fila em lotes até esvaziar o que está pronto; retorna quantos foram aplicados"""
+    db = await get_database()
+    total = 0
+    while True:
+        agora = datetime.utcnow()
+        lote = await _reservar_lote(db, agora)
+        if not lote:
+            break
+
+        tentativas = {doc["_id"]: doc.get("tentativas", 0) for doc in lote}
+        try:
+            aplicados, falhas = await aplicar_lote(lote)
+        except Exception as e:
+            logger.exception("Erro aplicando lote de webhooks PIX")
+            aplicados, falhas = [], {doc["_id"]: str(e) for doc in lote}
+
+        fim = datetime.utcnow()
+        if aplicados:
+            await db[COLECAO_WEBHOOKS].update_many(
+                {"_id": {"$in": [doc["_id"] for doc in aplicados]}},
+                {"$set": {"estado": APLICADO, "aplicadoEm": fim}, "$unset": {"erro": ""}}
+            )
+            for doc in aplicados:
+                metrics.observar("webhooks_pix.latencia_aplicacao_ms", (fim - doc["recebidoEm"]).total_seconds() * 1000)
+            metrics.incrementar("webhooks_pix.aplicados", len(aplicados))
+            total += len(aplicados)
+        await _registrar_falhas(db, falhas, tentativas, fim)
+
+        if len(lote) < WEBHOOK_LOTE:
+            break
+
+    metrics.definir("webhooks_pix.fila", await db[COLECAO_WEBHOOKS].count_documents({"estado": PENDENTE}))
+    return total
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from pymongo.errors import DuplicateKeyError
+from app.database import get_database
+
+logger = logging.getLogger(__name__)
+
+# Tarefas em segundo plano iniciadas no lifespan da aplicação
+_tarefas: list[asyncio.Task] = []
+
+# Identifica este processo como dono de leases na coleção 'leases'
+ID_PROCESSO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def adquirir_lease(nome: str, duracao: float) -> bool:
+    """
+    Tenta assumir (ou renovar) o lease 'nome' por 'duracao' segundos
+    - Só um processo tem o lease por vez; ele expira sozinho se o dono parar de renovar
+    """
+    db = await get_database()
+    agora = datetime.utcnow()
+    try:
+        await db.leases.find_one_and_update(
+            {"_id": nome, "$or": [{"dono": ID_PROCESSO}, {"expiraEm": {"$lt": agora}}]},
+            {"$set": {"dono": ID_PROCESSO, "expiraEm": agora + timedelta(seconds=duracao)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # O documento existe com outro dono ainda válido: o upsert colide no _id
+        return False
+
+
+async def liberar_lease(nome: str) -> None:
+    """Solta o lease 'nome' se este processo for o dono"""
+    db = await get_database()
+    await db.leases.delete_one({"_id": nome, "dono": ID_PROCESSO})
+
+
+def iniciar_tarefa_periodica(
+    nome: str,
+    intervalo: float,
+    funcao: Callable[[], Awaitable],
+    exclusiva: bool = False,
+    duracao_lease: Optional[float] = None
+) -> asyncio.Task:
+    """
+    Executa 'funcao' a cada 'intervalo' segundos até a aplicação ser encerrada
+    - exclusiva: com vários workers, só o que tiver o lease 'tarefa:<nome>' executa
+      (eleição de líder); o lease é renovado a cada execução
+    """
+    duracao_lease = duracao_lease or intervalo * 3
+
+    async def _loop():
+        while True:
+            try:
+                if not exclusiva or await adquirir_lease(f"tarefa:{nome}", duracao_lease):
+                    await funcao()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Erro na tarefa periódica '{nome}'")
+            await asyncio.sleep(intervalo)
+
+    tarefa = asyncio.create_task(_loop(), name=nome)
+    _tarefas.append(tarefa)
+    return tarefa
+
+
+async def parar_tarefas():
+    """Cancela todas as tarefas em segundo plano e libera os leases deste processo"""
+    for tarefa in _tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*_tarefas, return_exceptions=True)
+    _tarefas.clear()
+
+    try:
+        db = await get_database()
+        await db.leases.delete_many({"dono": ID_PROCESSO})
+    except Exception:
+        logger.exception("Não foi possível liberar os leases")
@@ -1,17 +1,73 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import conectar_db, fechar_db
+from app.database import conectar_db, fechar_db, get_database
+from app.indices import garantir_indices
+from app.services import catalogo_cache, imagem_variantes, busca_service, pedido_stats_service, arquivo_pedidos_service, webhook_service, pagamento_service, brcode_service, gateway_pagamento, reconciliacao_service
+from app.tarefas import iniciar_tarefa_periodica, parar_tarefas
+from app import eventos
+from app.loaders import EscopoCarregadoresMiddleware
 
-from app.controllers import user_controller, produto_controller, categoria_controller, sacola_controller, pedido_controller, image_controller, auth_controller, profile_controller, pagamento_controller, cartao_controller
+from app.controllers import user_controller, produto_controller, categoria_controller, sacola_controller, pedido_controller, image_controller, auth_controller, profile_controller, pagamento_controller, cartao_controller, metricas_controller, menu_controller
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # antes de iniciar o servidor
     await conectar_db()
+    await garantir_indices(await get_database())
+    await catalogo_cache.sincronizar_versoes()
+    await busca_service.construir_indice()
+    catalogo_cache.ao_mudar_remotamente("produtos", busca_service.construir_indice)
+    await eventos.iniciar()
+    await gateway_pagamento.iniciar()
+    iniciar_tarefa_periodica(
+        "sincronizar_versoes_catalogo",
+        catalogo_cache.CATALOGO_SYNC_INTERVALO,
+        catalogo_cache.sincronizar_versoes
+    )
+    iniciar_tarefa_periodica(
+        "reconciliar_contadores_pedidos",
+        pedido_stats_service.PEDIDO_STATS_RECONCILIACAO_INTERVALO,
+        pedido_stats_service.reconciliar,
+        exclusiva=True
+    )
+    iniciar_tarefa_periodica(
+        "arquivar_pedidos_concluidos",
+        arquivo_pedidos_service.PEDIDOS_ARQUIVO_INTERVALO,
+        arquivo_pedidos_service.arquivar_pedidos,
+        exclusiva=True
+    )
+    iniciar_tarefa_periodica(
+        "processar_webhooks_pix",
+        webhook_service.WEBHOOK_INTERVALO,
+        webhook_service.processar_fila
+    )
+    iniciar_tarefa_periodica(
+        "expirar_pagamentos_pix",
+        pagamento_service.PIX_EXPIRACAO_INTERVALO,
+        pagamento_service.expirar_pagamentos_pix,
+        exclusiva=True
+    )
+    iniciar_tarefa_periodica(
+        "resolver_pagamentos_cartao",
+        pagamento_service.CARTAO_RESOLUCAO_INTERVALO,
+        pagamento_service.resolver_pagamentos_cartao,
+        exclusiva=True
+    )
+    iniciar_tarefa_periodica(
+        "reconciliar_pagamentos",
+        reconciliacao_service.RECONCILIACAO_INTERVALO,
+        reconciliacao_service.reconciliar_pagamentos,
+        exclusiva=True
+    )
     yield
     # quando o servidor for encerrado
+    await parar_tarefas()
+    await eventos.parar()
+    await gateway_pagamento.parar()
+    imagem_variantes.encerrar_pool()
+    brcode_service.encerrar_pool()
     await fechar_db()
 
 app = FastAPI(
@@ -32,18 +88,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Proximo-Cursor", "X-Cursor-Anterior", "X-Total-Estimado"],
 )
 
+# Carregadores (pedidos, usuários, produtos) memoizados por requisição
+app.add_middleware(EscopoCarregadoresMiddleware)
+
 app.include_router(auth_controller.router, prefix="/usuarios", tags=["Autenticação"])
 app.include_router(profile_controller.router, prefix="/usuarios", tags=["Perfil"])
 app.include_router(user_controller.router, prefix="/usuarios", tags=["Usuários"])
 app.include_router(produto_controller.router, prefix="/produtos", tags=["Produtos"])
 app.include_router(categoria_controller.router, prefix="/categorias", tags=["Categorias"])
+app.include_router(menu_controller.router, prefix="/menu", tags=["Cardápio"])
 app.include_router(sacola_controller.router, prefix="/sacola", tags=["Sacola"])
 app.include_router(pedido_controller.router, prefix="/pedidos", tags=["Pedidos"])
 app.include_router(pagamento_controller.router, prefix="/pagamentos", tags=["Pagamentos"])
 app.include_router(cartao_controller.router, prefix="/cartoes", tags=["Cartões"])
 app.include_router(image_controller.router, prefix="/images", tags=["Imagens"])
+app.include_router(metricas_controller.router, prefix="/metricas", tags=["Métricas"])
 
 @app.get("/")
 def root():
@@ -0,0 +1,51 @@
+"""
+Auditoria de índices do MongoDB
+
+Uso:
+    python -m scripts.auditar_indices [--criar]
+
+Roda explain() em cada padrão de consulta declarado em app/indices.py e
+lista os que caem em COLLSCAN. Com --criar, garante os índices antes e lista
+os que não puderam ser criados (para índice único, com os valores duplicados).
+Sai com código 1 se algum índice falhar ou alguma consulta fizer COLLSCAN (útil no CI).
+"""
+from app.database import conectar_db, fechar_db, get_database
+from app.indices import garantir_indices, auditar_consultas
+import argparse
+import asyncio
+import sys
+
+
+async def executar(criar: bool) -> int:
+    await conectar_db()
+    try:
+        db = await get_database()
+        falhas = []
+        if criar:
+            falhas = await garantir_indices(db)
+            for falha in falhas:
+                print(f"[   FALHA] {falha['colecao']}.{falha['indice']}: {falha['erro']}")
+                for duplicado in falha.get("duplicados", []):
+                    print(f"           {duplicado['quantidade']}x {duplicado['valor']}")
+
+        relatorio = await auditar_consultas(db)
+        for item in relatorio:
+            situacao = "COLLSCAN" if item["collscan"] else "ok"
+            print(f"[{situacao:>8}] {item['colecao']}: {item['consulta']} -> {' > '.join(item['estagios'])}")
+
+        problemas = [item for item in relatorio if item["collscan"]]
+        print(f"\n{len(relatorio)} consultas auditadas, {len(problemas)} com COLLSCAN")
+        return 1 if problemas or falhas else 0
+    finally:
+        await fechar_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--criar", action="store_true", help="cria os índices antes de auditar")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(executar(args.criar)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark da busca de produtos (índice invertido em memória)
+
+Uso:
+    python -m scripts.benchmark_busca [--produtos 2000] [--consultas 20000]
+
+Monta um catálogo sintético, constrói o índice e mede a latência das
+consultas (exatas, com acento e por prefixo), reportando p50/p99.
+"""
+from app.schemas import ProdutoOut
+from app.services.busca_service import IndiceInvertido
+import argparse
+import random
+import statistics
+import time
+
+PALAVRAS = [
+    "pão", "queijo", "frango", "calabresa", "catupiry", "chocolate", "morango", "açaí",
+    "linguiça", "batata", "cebola", "picanha", "salmão", "camarão", "maçã", "limão",
+    "cerveja", "suco", "café", "chá", "pudim", "brigadeiro", "torta", "coxinha",
+    "salsicha", "chucrute", "strudel", "pretzel", "schnitzel", "mostarda", "bacon", "presunto",
+]
+CONSULTAS = ["pao", "pão de queijo", "queij", "frango catupiry", "acai", "choc", "salm", "schnitz", "torta maca", "x"]
+
+
+def gerar_catalogo(quantidade: int) -> list[ProdutoOut]:
+    aleatorio = random.Random(42)
+    produtos = []
+    for i in range(quantidade):
+        titulo = " ".join(aleatorio.sample(PALAVRAS, 3)).title()
+        descricao = " ".join(aleatorio.choices(PALAVRAS, k=15))
+        produtos.append(ProdutoOut(
+            id=f"{i:024x}", titulo=titulo, descricao=descricao, preco=10.0,
+            imagem="", categoria_id="cat", quantidade=1, ativo=i % 10 != 0
+        ))
+    return produtos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--produtos", type=int, default=2000)
+    parser.add_argument("--consultas", type=int, default=20000)
+    args = parser.parse_args()
+
+    produtos = gerar_catalogo(args.produtos)
+    inicio = time.perf_counter()
+    indice = IndiceInvertido()
+    for produto in produtos:
+        indice.adicionar(produto)
+    print(f"Índice com {len(indice)} produtos construído em {(time.perf_counter() - inicio) * 1000:.1f} ms")
+
+    latencias = []
+    for i in range(args.consultas):
+        consulta = CONSULTAS[i % len(CONSULTAS)]
+        inicio = time.perf_counter()
+        indice.buscar(consulta)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+    latencias.sort()
+    p50 = statistics.median(latencias)
+    p99 = latencias[int(len(latencias) * 0.99) - 1]
+    print(f"{args.consultas} consultas: p50={p50:.3f} ms  p99={p99:.3f} ms  max={latencias[-1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
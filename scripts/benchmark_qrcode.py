@@ -0,0 +1,68 @@
+"""
+Benchmark da geração de PIX (BR Code + QR Code)
+
+Uso:
+    python -m scripts.benchmark_qrcode [--codigos 500] [--concorrencia 16] [--formato png]
+
+Mede códigos por segundo em cada etapa:
+- montagem do payload BR Code (com CRC16)
+- renderização do QR Code em série, no processo atual
+- renderização pelo pool de processos, com N pedidos simultâneos
+- leitura repetida dos mesmos payloads (cache LRU)
+"""
+from app.services import brcode_service
+import argparse
+import asyncio
+import time
+
+
+def medir(nome: str, quantidade: int, inicio: float) -> None:
+    duracao = time.perf_counter() - inicio
+    print(f"{nome:<32} {quantidade / duracao:>10.1f} códigos/s  ({duracao * 1000:.0f} ms)")
+
+
+async def renderizar_pool(payloads: list[str], formato: str, concorrencia: int) -> None:
+    semaforo = asyncio.Semaphore(concorrencia)
+
+    async def um(payload: str):
+        async with semaforo:
+            await brcode_service.gerar_qrcode(payload, formato)
+
+    await asyncio.gather(*(um(payload) for payload in payloads))
+
+
+async def executar(codigos: int, concorrencia: int, formato: str) -> None:
+    inicio = time.perf_counter()
+    payloads = [brcode_service.payload_pedido(pedido_id, 10 + pedido_id / 100) for pedido_id in range(codigos)]
+    medir("payload BR Code", codigos, inicio)
+    assert all(brcode_service.validar_brcode(payload) for payload in payloads)
+
+    amostra = payloads[:max(1, codigos // 10)]
+    inicio = time.perf_counter()
+    for payload in amostra:
+        brcode_service.renderizar_qrcode(payload, formato)
+    medir("QR em série (1 processo)", len(amostra), inicio)
+
+    # Aquece o pool antes de medir
+    await brcode_service.gerar_qrcode("aquecimento", formato)
+    inicio = time.perf_counter()
+    await renderizar_pool(payloads, formato, concorrencia)
+    medir(f"QR no pool ({brcode_service.QRCODE_PROCESSOS} processos)", codigos, inicio)
+
+    repetidos = payloads[-min(codigos, brcode_service.QRCODE_CACHE_MAX):]
+    inicio = time.perf_counter()
+    await renderizar_pool(repetidos, formato, concorrencia)
+    medir("QR repetido (cache)", len(repetidos), inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codigos", type=int, default=500)
+    parser.add_argument("--concorrencia", type=int, default=16)
+    parser.add_argument("--formato", choices=sorted(brcode_service.FORMATOS_QRCODE), default="png")
+    args = parser.parse_args()
+    asyncio.run(executar(args.codigos, args.concorrencia, args.formato))
+
+
+if __name__ == "__main__":
+    main()
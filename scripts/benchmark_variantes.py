@@ -0,0 +1,57 @@
+"""
+Benchmark da geração de variantes de imagem (thumb, card, full)
+
+Uso:
+    python -m scripts.benchmark_variantes [--imagens 40] [--largura 2400] [--altura 1600]
+
+Mede a vazão com um único processo (imagens/s por núcleo) e com o pool
+de processos usado pela API (IMAGENS_PROCESSOS, padrão = núcleos da máquina).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image
+import argparse
+import os
+import time
+
+from app.services.imagem_variantes import gerar_variantes, IMAGENS_PROCESSOS
+
+
+def gerar_imagem_teste(largura: int, altura: int) -> bytes:
+    """JPEG com ruído, parecido em tamanho com uma foto de produto"""
+    imagem = Image.frombytes("RGB", (largura, altura), os.urandom(largura * altura * 3))
+    saida = BytesIO()
+    imagem.save(saida, "JPEG", quality=85)
+    return saida.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--imagens", type=int, default=40)
+    parser.add_argument("--largura", type=int, default=2400)
+    parser.add_argument("--altura", type=int, default=1600)
+    args = parser.parse_args()
+
+    dados = gerar_imagem_teste(args.largura, args.altura)
+    print(f"Imagem de teste: {args.largura}x{args.altura}, {len(dados) / 1024:.0f} KB")
+
+    gerar_variantes(dados)  # aquecimento
+
+    inicio = time.perf_counter()
+    for _ in range(args.imagens):
+        gerar_variantes(dados)
+    duracao = time.perf_counter() - inicio
+    print(f"1 processo: {args.imagens / duracao:.2f} imagens/s ({duracao / args.imagens * 1000:.1f} ms por imagem)")
+
+    with ProcessPoolExecutor(max_workers=IMAGENS_PROCESSOS) as pool:
+        list(pool.map(gerar_variantes, [dados] * IMAGENS_PROCESSOS))  # aquecimento dos processos
+        inicio = time.perf_counter()
+        list(pool.map(gerar_variantes, [dados] * args.imagens))
+        duracao = time.perf_counter() - inicio
+
+    vazao = args.imagens / duracao
+    print(f"{IMAGENS_PROCESSOS} processos: {vazao:.2f} imagens/s ({vazao / IMAGENS_PROCESSOS:.2f} imagens/s por núcleo)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Gateway de pagamento falso, para testes locais e de carga
+
+Uso:
+    python -m scripts.gateway_fake servir [--porta 8081] [--latencia-ms 120] [--jitter-ms 80]
+                                          [--erro 0.05] [--travamento 0.01] [--aprovacao 0.9]
+    python -m scripts.gateway_fake carga [--chamadas 500] [--concorrencia 32]
+
+servir: sobe a API do adquirente (POST /autorizacoes, GET /autorizacoes/{id}) com
+latência aleatória, uma fração de respostas 503 (--erro) e de chamadas que
+travam além do timeout do cliente (--travamento). A mesma Idempotency-Key
+devolve sempre a mesma resposta.
+
+carga: dispara autorizações pelo GatewayHttp (GATEWAY_URL) e mostra as
+latências p50/p95/p99, retentativas e rejeições do disjuntor.
+Para a API usar este gateway: GATEWAY_BACKEND=http GATEWAY_URL=http://127.0.0.1:8081
+"""
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse
+from typing import Optional
+from app import metrics
+from app.services import gateway_pagamento
+import argparse
+import asyncio
+import random
+import uuid
+
+
+def criar_app(latencia_ms: float, jitter_ms: float, erro: float, travamento: float, aprovacao: float) -> FastAPI:
+    app = FastAPI(title="Gateway de pagamento falso")
+    autorizacoes: dict[str, dict] = {}
+
+    async def simular_rede() -> Optional[JSONResponse]:
+        if random.random() < travamento:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(max(0.0, random.gauss(latencia_ms, jitter_ms)) / 1000)
+        if random.random() < erro:
+            return JSONResponse(status_code=503, content={"erro": "indisponível"})
+        return None
+
+    @app.post("/autorizacoes")
+    async def autorizar(dados: dict, idempotency_key: Optional[str] = Header(None)):
+        falha = await simular_rede()
+        if falha is not None:
+            return falha
+        chave = idempotency_key or dados.get("transacaoId") or str(uuid.uuid4())
+        if chave not in autorizacoes:
+            aprovado = random.random() < aprovacao
+            autorizacoes[chave] = {
+                "transacaoId": dados.get("transacaoId", chave),
+                "aprovado": aprovado,
+                "mensagem": "Aprovado" if aprovado else "Não autorizado",
+            }
+        return autorizacoes[chave]
+
+    @app.get("/autorizacoes/{transacao_id}")
+    async def consultar(transacao_id: str):
+        falha = await simular_rede()
+        if falha is not None:
+            return falha
+        if transacao_id not in autorizacoes:
+            raise HTTPException(status_code=404, detail="Autorização não encontrada")
+        return autorizacoes[transacao_id]
+
+    return app
+
+
+async def carga(chamadas: int, concorrencia: int) -> None:
+    gateway = gateway_pagamento.GatewayHttp()
+    semaforo = asyncio.Semaphore(concorrencia)
+    resultados = {"aprovados": 0, "negados": 0, "indisponivel": 0}
+
+    async def uma(i: int):
+        async with semaforo:
+            try:
+                resultado = await gateway.autorizar(str(uuid.uuid4()), i, 50.0, 1)
+            except gateway_pagamento.GatewayIndisponivel:
+                resultados["indisponivel"] += 1
+                return
+            resultados["aprovados" if resultado["aprovado"] else "negados"] += 1
+
+    try:
+        await asyncio.gather(*(uma(i) for i in range(chamadas)))
+    finally:
+        await gateway.parar()
+
+    snapshot = metrics.snapshot()
+    print(resultados)
+    for nome in ("gateway.autorizar.latencia_ms", "gateway.autorizar.tentativa_ms"):
+        resumo = snapshot["latencias"].get(nome)
+        if resumo:
+            print(f"{nome:<34} p50={resumo['p50']:.0f}ms p95={resumo['p95']:.0f}ms p99={resumo['p99']:.0f}ms max={resumo['max']:.0f}ms")
+    contadores = snapshot["contadores"]
+    for nome in ("gateway.autorizar.retentativas", "gateway.autorizar.falhas", "gateway.circuito.rejeitadas", "gateway.circuito.aberturas"):
+        print(f"{nome:<34} {contadores.get(nome, 0):.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    servir = comandos.add_parser("servir")
+    servir.add_argument("--porta", type=int, default=8081)
+    servir.add_argument("--latencia-ms", type=float, default=120)
+    servir.add_argument("--jitter-ms", type=float, default=80)
+    servir.add_argument("--erro", type=float, default=0.05)
+    servir.add_argument("--travamento", type=float, default=0.01)
+    servir.add_argument("--aprovacao", type=float, default=0.9)
+
+    disparar = comandos.add_parser("carga")
+    disparar.add_argument("--chamadas", type=int, default=500)
+    disparar.add_argument("--concorrencia", type=int, default=32)
+
+    args = parser.parse_args()
+    if args.comando == "servir":
+        import uvicorn
+        app = criar_app(args.latencia_ms, args.jitter_ms, args.erro, args.travamento, args.aprovacao)
+        uvicorn.run(app, host="127.0.0.1", port=args.porta, log_level="warning")
+    else:
+        asyncio.run(carga(args.chamadas, args.concorrencia))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Reconciliação de pagamentos x pedidos
+
+Uso:
+    python -m scripts.reconciliar_pagamentos [--reiniciar] [--listar 20]
+
+Confere os pedidos criados desde o último checkpoint (e fora da janela de
+assentamento), mais os alterados desde a execução anterior, com seus
+pagamentos e grava as divergências em 'reconciliacao_divergencias'. Mostra
+quantos pedidos foram lidos e a vazão em documentos por segundo.
+Com --reiniciar, confere desde o primeiro pedido.
+"""
+from app.database import conectar_db, fechar_db
+from app.services import reconciliacao_service
+import argparse
+import asyncio
+
+
+async def executar(reiniciar: bool, listar: int) -> None:
+    await conectar_db()
+    try:
+        if reiniciar:
+            await reconciliacao_service.reiniciar_checkpoint()
+        resultado = await reconciliacao_service.reconciliar_pagamentos()
+        print(
+            f"{resultado['processados']} pedidos novos e {resultado['reconferidos']} reconferidos "
+            f"em {resultado['duracaoSegundos']:.2f}s "
+            f"({resultado['docsPorSegundo']:.0f} docs/s), {resultado['divergencias']} divergências, "
+            f"checkpoint em {resultado['checkpoint']}"
+        )
+        for doc in await reconciliacao_service.listar_divergencias(limite=listar) if listar else []:
+            print(f"  pedido {doc['pedidoId']}: {doc['tipo']} (status {doc['statusPedido']}, total {doc['totalPedido']})")
+    finally:
+        await fechar_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reiniciar", action="store_true", help="ignora o checkpoint")
+    parser.add_argument("--listar", type=int, default=0, help="mostra as N divergências mais recentes")
+    args = parser.parse_args()
+    asyncio.run(executar(args.reiniciar, args.listar))
+
+
+if __name__ == "__main__":
+    main()